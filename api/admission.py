@@ -0,0 +1,208 @@
+"""聊天生成的准入控制
+
+限制同时进行的上游生成数：全局上限、每个登录用户上限和每个游客IP上限。超出上限的
+请求进入有界的公平队列（按用户/IP轮转出队，单个用户的突发请求不会饿死其他人），
+等待超过最长时间或队列已满时拒绝，由调用方返回 429 和 Retry-After。
+"""
+
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Optional
+from fastapi import Request
+from config import settings
+from metrics import Histogram
+
+QUEUE_DEPTH_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500]
+WAIT_SECONDS_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+
+def client_ip(request: Request, trusted_proxy_hops: Optional[int] = None) -> str:
+    """游客名额使用的客户端IP
+
+    经过 N 层可信代理时，X-Forwarded-For 从右数第 N 个地址是最外层代理看到的客户端；
+    更靠左的部分由客户端自己填写，可以伪造，不使用。地址数不足 N 个说明请求没有经过
+    全部代理，头部整段都不可信，改用连接对端地址。
+    """
+    hops = settings.trusted_proxy_hops if trusted_proxy_hops is None else trusted_proxy_hops
+    if hops > 0:
+        forwarded = [part.strip() for part in request.headers.get("x-forwarded-for", "").split(",")]
+        forwarded = [part for part in forwarded if part]
+        if len(forwarded) >= hops:
+            return forwarded[-hops]
+    return request.client.host if request.client else "unknown"
+
+
+class AdmissionRejected(Exception):
+    """队列已满或等待超时"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """已获准的生成名额，生成结束后必须 release()（可重复调用）"""
+
+    def __init__(self, controller: "AdmissionController", principal: str):
+        self._controller = controller
+        self.principal = principal
+        self.admitted_at = controller._clock()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._controller._release(self)
+
+
+class _Waiter:
+    __slots__ = ("principal", "limit", "future", "enqueued_at")
+
+    def __init__(self, principal: str, limit: int, future: asyncio.Future, enqueued_at: float):
+        self.principal = principal
+        self.limit = limit
+        self.future = future
+        self.enqueued_at = enqueued_at
+
+
+class AdmissionController:
+    """全局/每主体并发上限 + 有界公平等待队列"""
+
+    def __init__(
+        self,
+        max_concurrent: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        max_wait: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_concurrent = max_concurrent or settings.admission_max_concurrent
+        self.queue_size = settings.admission_queue_size if queue_size is None else queue_size
+        self.max_wait = settings.admission_max_wait_seconds if max_wait is None else max_wait
+        self._clock = clock
+
+        self.active = 0
+        self._active_by: Dict[str, int] = {}
+        # 主体 -> 该主体的等待者；按 OrderedDict 顺序轮转出队
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self.waiting = 0
+        # 生成占用名额的平均时长，用于估算 Retry-After
+        self._avg_hold = 10.0
+
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.queue_depth = Histogram(QUEUE_DEPTH_BUCKETS)
+        self.wait_seconds = Histogram(WAIT_SECONDS_BUCKETS)
+
+    def retry_after(self) -> int:
+        """按当前排队数和平均占用时长估算的重试秒数"""
+        return max(1, math.ceil(self._avg_hold * (self.waiting + 1) / self.max_concurrent))
+
+    def _can_admit(self, principal: str, limit: int) -> bool:
+        return self.active < self.max_concurrent and self._active_by.get(principal, 0) < limit
+
+    def _admit(self, waiter: _Waiter):
+        self.active += 1
+        self._active_by[waiter.principal] = self._active_by.get(waiter.principal, 0) + 1
+        self.admitted += 1
+        self.wait_seconds.observe(self._clock() - waiter.enqueued_at)
+        waiter.future.set_result(AdmissionTicket(self, waiter.principal))
+
+    def _dispatch(self):
+        """名额空出时按主体轮转放行队首等待者"""
+        while self.active < self.max_concurrent and self._queues:
+            for principal, queue in self._queues.items():
+                waiter = queue[0]
+                if self._can_admit(principal, waiter.limit):
+                    queue.popleft()
+                    self.waiting -= 1
+                    if queue:
+                        self._queues.move_to_end(principal)
+                    else:
+                        del self._queues[principal]
+                    self._admit(waiter)
+                    break
+            else:
+                return
+
+    def _remove(self, waiter: _Waiter):
+        queue = self._queues.get(waiter.principal)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self.waiting -= 1
+            if not queue:
+                del self._queues[waiter.principal]
+
+    def _release(self, ticket: AdmissionTicket):
+        self.active -= 1
+        remaining = self._active_by.get(ticket.principal, 1) - 1
+        if remaining > 0:
+            self._active_by[ticket.principal] = remaining
+        else:
+            self._active_by.pop(ticket.principal, None)
+        self._avg_hold = 0.8 * self._avg_hold + 0.2 * (self._clock() - ticket.admitted_at)
+        self._dispatch()
+
+    async def acquire(self, principal: str, limit: int) -> AdmissionTicket:
+        """获取生成名额，必要时排队等待
+
+        principal 为限流主体（如 user:<id>、guest:<ip>），limit 为该主体的并发上限。
+        队列已满或等待超时时抛出 AdmissionRejected。
+        """
+        self.queue_depth.observe(self.waiting)
+        if not self._queues and self._can_admit(principal, limit):
+            self.active += 1
+            self._active_by[principal] = self._active_by.get(principal, 0) + 1
+            self.admitted += 1
+            self.wait_seconds.observe(0.0)
+            return AdmissionTicket(self, principal)
+
+        if self.waiting >= self.queue_size:
+            self.rejected_queue_full += 1
+            raise AdmissionRejected("queue_full", self.retry_after())
+
+        waiter = _Waiter(principal, limit, asyncio.get_running_loop().create_future(), self._clock())
+        self._queues.setdefault(principal, deque()).append(waiter)
+        self.waiting += 1
+        self._dispatch()
+
+        try:
+            await asyncio.wait({waiter.future}, timeout=self.max_wait)
+        except asyncio.CancelledError:
+            # 等待中客户端离开：已获准则立即归还名额
+            self._remove(waiter)
+            if waiter.future.done() and not waiter.future.cancelled():
+                waiter.future.result().release()
+            else:
+                waiter.future.cancel()
+            raise
+
+        if waiter.future.done():
+            return waiter.future.result()
+
+        self._remove(waiter)
+        waiter.future.cancel()
+        self.rejected_timeout += 1
+        self.wait_seconds.observe(self._clock() - waiter.enqueued_at)
+        raise AdmissionRejected("timeout", self.retry_after())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "queue_size": self.queue_size,
+            "max_wait_seconds": self.max_wait,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "queue_depth": self.queue_depth.snapshot(),
+            "wait_seconds": self.wait_seconds.snapshot()
+        }
+
+
+# 全局准入控制实例
+admission_controller = AdmissionController()
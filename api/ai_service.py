@@ -1,36 +1,22 @@
 import asyncio
 import json
 from typing import List, Dict, AsyncGenerator, Optional
-from openai import AsyncOpenAI
 from config import settings
+from context_window import ContextBudget, build_context_window
+from llm_router import llm_router
+from rate_limiter import RateLimitExceeded
 import logging
 
 logger = logging.getLogger(__name__)
 
 class AIService:
     def __init__(self):
-        self.client = None
-        self._init_client()
-    
-    def _init_client(self):
-        """初始化AI客户端"""
-        if settings.ai_service_provider == "openrouter" and settings.openrouter_api_key:
-            self.client = AsyncOpenAI(
-                api_key=settings.openrouter_api_key,
-                base_url="https://openrouter.ai/api/v1"
-            )
-        elif settings.ai_service_provider == "openai" and settings.openai_api_key:
-            self.client = AsyncOpenAI(
-                api_key=settings.openai_api_key
-            )
+        # 请求经由多后端路由发送
+        self.router = llm_router
     
     def is_available(self) -> bool:
         """检查AI服务是否可用"""
-        if settings.ai_service_provider == "openrouter":
-            return self.client is not None and settings.openrouter_api_key is not None
-        elif settings.ai_service_provider == "openai":
-            return self.client is not None and settings.openai_api_key is not None
-        return False
+        return self.router.is_available()
     
     async def generate_response(
         self,
@@ -45,21 +31,18 @@ class AIService:
             return
         
         try:
-            model = model or settings.default_ai_model
-            
-            # 调用OpenAI API
-            stream = await self.client.chat.completions.create(
+            # 未指定模型时使用各后端配置的模型
+            async for chunk in self.router.stream_chat(
+                messages,
                 model=model,
-                messages=messages,
                 temperature=temperature,
-                max_tokens=max_tokens,
-                stream=True
-            )
-            
-            async for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
-                    yield chunk.choices[0].delta.content
+                max_tokens=max_tokens
+            ):
+                yield chunk
                     
+        except RateLimitExceeded as e:
+            logger.warning(f"AI服务超出调用预算: {e}")
+            yield "当前AI请求较多，请稍后重试。"
         except Exception as e:
             logger.error(f"AI服务调用失败: {e}")
             yield "抱歉，AI服务出现错误，请稍后重试。"
@@ -67,83 +50,96 @@ class AIService:
     async def generate_summary(
         self,
         messages: List[Dict[str, str]],
-        max_length: int = 100
+        max_length: int = 100,
+        previous_summary: Optional[str] = None
     ) -> str:
         """生成会话摘要"""
         if not self.is_available():
             return "会话摘要"
         
         try:
-            # 构建摘要提示
-            summary_messages = [
-                {
-                    "role": "system",
-                    "content": f"请为以下对话生成一个简洁的摘要，不超过{max_length}个字符。只返回摘要内容，不要其他说明。"
-                },
-                {
-                    "role": "user",
-                    "content": "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages[-10:]])
-                }
-            ]
-            
-            response = await self.client.chat.completions.create(
-                model=settings.default_ai_model,
-                messages=summary_messages,
-                temperature=0.3,
-                max_tokens=50
-            )
-            
-            summary = response.choices[0].message.content.strip()
-            return summary[:max_length] if summary else "会话摘要"
+            summary = await self.summarize(messages[-10:], max_length, previous_summary)
+            return summary or "会话摘要"
             
         except Exception as e:
             logger.error(f"生成摘要失败: {e}")
             return "会话摘要"
     
+    async def summarize(
+        self,
+        messages: List[Dict[str, str]],
+        max_length: int = 100,
+        previous_summary: Optional[str] = None
+    ) -> str:
+        """增量生成摘要：在已有摘要基础上合并新消息，失败时抛出异常"""
+        if not self.is_available():
+            raise RuntimeError("AI服务不可用")
+        
+        # 构建摘要提示
+        conversation_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages])
+        if previous_summary:
+            instruction = f"下面是一段对话此前的摘要和之后的新消息，请把新消息的要点合并进摘要，生成更新后的摘要，不超过{max_length}个字符。只返回摘要内容，不要其他说明。"
+            conversation_text = f"此前的摘要：{previous_summary}\n\n新消息：\n{conversation_text}"
+        else:
+            instruction = f"请为以下对话生成一个简洁的摘要，不超过{max_length}个字符。只返回摘要内容，不要其他说明。"
+        
+        summary_messages = [
+            {
+                "role": "system",
+                "content": instruction
+            },
+            {
+                "role": "user",
+                "content": conversation_text
+            }
+        ]
+        
+        summary = await self.router.complete(
+            summary_messages,
+            temperature=0.3,
+            max_tokens=max(50, max_length)
+        )
+        
+        summary = summary.strip()
+        return summary[:max_length]
+    
     def build_conversation_context(
         self,
         character_system_prompt: str,
         character_greeting: str,
         session_prompt: Optional[str],
         message_history: List[Dict[str, str]],
-        max_context_length: int = 4000
+        max_context_length: int = 4000,
+        reply_tokens: int = 1000
     ) -> List[Dict[str, str]]:
-        """构建对话上下文"""
-        messages = []
+        """构建对话上下文
         
+        max_context_length 为模型上下文的token总数，其中 reply_tokens 预留给回复，
+        其余扣除系统提示词后用于历史消息。
+        """
         # 1. 系统提示词
         system_content = character_system_prompt
         if session_prompt:
             system_content += f"\n\n会话设定：{session_prompt}"
         
-        messages.append({
+        system_message = {
             "role": "system",
             "content": system_content
-        })
+        }
         
         # 2. 角色开场白（如果没有历史消息）
         if not message_history:
-            messages.append({
+            return [system_message, {
                 "role": "assistant",
                 "content": character_greeting
-            })
-        else:
-            # 3. 历史消息（保留最近的消息）
-            total_length = len(system_content)
-            selected_messages = []
-            
-            # 从最新消息开始，逐步添加到上下文中
-            for msg in reversed(message_history):
-                msg_length = len(msg["content"])
-                if total_length + msg_length > max_context_length:
-                    break
-                
-                selected_messages.insert(0, msg)
-                total_length += msg_length
-            
-            messages.extend(selected_messages)
+            }]
         
-        return messages
+        # 3. 历史消息（保留最近且在token预算内的消息）
+        budget = ContextBudget(
+            context_tokens=max_context_length,
+            reply_tokens=reply_tokens
+        )
+        return build_context_window([system_message], message_history, budget)
 
 # 全局AI服务实例
 ai_service = AIService()
\ No newline at end of file
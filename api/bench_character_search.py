@@ -0,0 +1,110 @@
+"""角色搜索微基准
+
+在临时SQLite库中生成角色数据，对比原来的 LIKE 子串查询和 FTS5 全文索引在不同命中
+数量下取第一页（按相关度/最新）和计算总数的耗时：
+    python bench_character_search.py [角色数]
+"""
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, or_, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from character_search import apply_search, ensure_search_index
+from database import Base
+from models import Character
+from pagination import paginate
+from routers.characters import CHARACTER_ORDERS
+
+LIMIT = 20
+
+SURNAMES = ["林", "苏", "叶", "白", "顾", "沈", "陆", "江", "Alice", "Elaine", "Marcus", "Luna"]
+TITLES = ["法师", "骑士", "剑客", "医生", "侦探", "歌手", "厨师", "学者", "精灵", "猎人", "Knight", "Wizard"]
+PHRASES = [
+    "居住在森林深处", "守卫王城多年", "喜欢读书和画画", "性格温和善良", "擅长治愈魔法",
+    "向往远方的冒险", "来自星际殖民地", "经营一家咖啡馆", "热爱古典音乐", "精通各种料理",
+    "曾是宫廷乐师", "在海边灯塔长大", "收藏了许多古籍", "研究失落的文明", "是沙漠商队的向导",
+    "驯养了一只白狐", "能听懂风的声音", "总是迷路", "害怕打雷", "梦想成为画家",
+    "loves ancient history", "an elven ranger from the north", "works as a night-shift detective",
+    "plays the violin", "collects old maps",
+]
+# (说明, 搜索词)：命中较少和较多的词、英文前缀，以及只能逐行检查的短词
+QUERIES = [
+    ("少量命中", "苏骑士 咖啡馆"),
+    ("常见短语", "星际殖民地"),
+    ("英文前缀", "elv*"),
+    ("短词", "精灵"),
+]
+
+
+async def timed(func, repeat: int = 10) -> float:
+    """多次执行取中位数（毫秒）"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def like_search(query, keywords):
+    """原实现：整个搜索词对名称和描述做 LIKE 子串匹配"""
+    search_term = f"%{keywords}%"
+    return query.where(or_(Character.name.ilike(search_term), Character.description.ilike(search_term)))
+
+
+async def run(path: str, count: int):
+    rng = random.Random(42)
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        now = datetime.utcnow()
+        await conn.execute(insert(Character), [
+            {
+                "id": f"character-{i:07d}",
+                "name": rng.choice(SURNAMES) + rng.choice(TITLES),
+                "description": "，".join(rng.sample(PHRASES, 3)),
+                "system_prompt": "设定", "greeting": "你好", "creator_id": "user-1",
+                "is_public": True, "chat_count": i % 50, "created_at": now - timedelta(seconds=i)
+            }
+            for i in range(count)
+        ])
+        start = time.perf_counter()
+        await conn.run_sync(ensure_search_index)
+        build_seconds = time.perf_counter() - start
+
+    public = select(Character).where(Character.is_public == True)
+    latest = CHARACTER_ORDERS["latest"]
+    print(f"{count} 个角色，每页 {LIMIT} 条（中位数），建立全文索引 {build_seconds:.2f} s")
+    async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+        async def total(query):
+            return await db.scalar(select(func.count()).select_from(query.order_by(None).subquery()))
+
+        for label, keywords in QUERIES:
+            like_query = like_search(public, keywords)
+            fts_query, relevance = apply_search(public, keywords)
+            page_query, _ = apply_search(public, keywords, ordered=True)
+            matched = await total(fts_query)
+            print(f"  {label}「{keywords}」：全文索引命中 {matched}，LIKE 命中 {await total(like_query)}")
+
+            like_ms = await timed(lambda: paginate(db, like_query, latest, LIMIT))
+            fts_ms = await timed(lambda: paginate(db, page_query, latest, LIMIT))
+            print(f"    最新第一页  LIKE {like_ms:8.2f} ms   全文索引 {fts_ms:8.2f} ms")
+            if relevance is not None:
+                ranked_ms = await timed(lambda: paginate(db, fts_query, relevance, LIMIT))
+                print(f"    相关度第一页                   全文索引 {ranked_ms:8.2f} ms")
+            like_count_ms = await timed(lambda: total(like_query))
+            fts_count_ms = await timed(lambda: total(fts_query))
+            print(f"    总数        LIKE {like_count_ms:8.2f} ms   全文索引 {fts_count_ms:8.2f} ms")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    total_characters = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as workdir:
+        asyncio.run(run(os.path.join(workdir, "bench.db"), total_characters))
@@ -0,0 +1,108 @@
+"""JSON序列化微基准
+
+对比100条角色的列表页和SSE内容帧在原实现与快速序列化路径下的耗时：
+    python bench_json.py
+
+列表页按FastAPI处理响应的完整流程计时：端点内构造响应模型、response_model校验与
+序列化、响应类渲染。
+"""
+
+import asyncio
+import json
+import timeit
+import warnings
+from datetime import datetime
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+import fast_json
+from fast_json import FastJSONResponse, sse_content
+from models import Character
+from routers.characters import _character_response
+from schemas import CharacterListResponse, CharacterResponse
+
+
+def make_characters(count: int = 100):
+    now = datetime.utcnow()
+    return [
+        Character(
+            id=f"character-{i}",
+            name=f"精灵法师{i}",
+            description="一位来自森林深处的精灵法师，喜欢冒险，也乐于分享古老的魔法知识。" * 3,
+            system_prompt="你是一位温和而睿智的精灵法师，说话时带着古老的韵味。" * 10,
+            greeting="你好，旅行者！欢迎来到精灵之森。",
+            avatar_url=f"/uploads/avatar-{i}.png",
+            is_public=True,
+            creator_id="user-1",
+            chat_count=i * 7,
+            created_at=now,
+            updated_at=now
+        )
+        for i in range(count)
+    ]
+
+
+def legacy_character_response(char: Character) -> CharacterResponse:
+    """原端点中的转换方式（构造、转dict、再构造一次）"""
+    char_dict = CharacterResponse.from_orm(char).dict()
+    char_dict['tags'] = ["魔法", "精灵", "冒险"]
+    return CharacterResponse(**char_dict)
+
+
+def legacy_sse_content(chunk: str) -> str:
+    return f"data: {json.dumps({'type': 'content', 'content': chunk})}\n\n"
+
+
+def run(number: int = 300):
+    # 原实现使用的 from_orm/dict 在 pydantic v2 下会产生弃用警告
+    warnings.simplefilter("ignore", DeprecationWarning)
+    characters = make_characters()
+    field = create_response_field(name="response", type_=CharacterListResponse)
+    loop = asyncio.new_event_loop()
+
+    def page(convert, response_class):
+        model = CharacterListResponse(
+            characters=[convert(char) for char in characters], total=1000, page=1, limit=100
+        )
+        content = loop.run_until_complete(serialize_response(field=field, response_content=model))
+        return response_class(content).body
+
+    assert json.loads(page(legacy_character_response, JSONResponse))["total"] == 1000
+    assert json.loads(page(_character_response, FastJSONResponse))["total"] == 1000
+
+    legacy = timeit.timeit(lambda: page(legacy_character_response, JSONResponse), number=number)
+    fast = timeit.timeit(lambda: page(_character_response, FastJSONResponse), number=number)
+    orjson_module, fast_json.orjson = fast_json.orjson, None
+    try:
+        fallback = timeit.timeit(lambda: page(_character_response, FastJSONResponse), number=number)
+    finally:
+        fast_json.orjson = orjson_module
+
+    model = CharacterListResponse(
+        characters=[_character_response(char) for char in characters], total=1000, page=1, limit=100
+    )
+    content = loop.run_until_complete(serialize_response(field=field, response_content=model))
+    legacy_render = timeit.timeit(lambda: JSONResponse(content).body, number=number)
+    fast_render = timeit.timeit(lambda: FastJSONResponse(content).body, number=number)
+
+    print(f"100条角色列表页（orjson {'已安装' if orjson_module else '未安装'}）")
+    print(f"  原实现:        {legacy / number * 1000:8.3f} ms")
+    print(f"  快速路径:      {fast / number * 1000:8.3f} ms")
+    print(f"  快速路径回退:  {fallback / number * 1000:8.3f} ms")
+    print("  其中响应渲染:")
+    print(f"    JSONResponse:      {legacy_render / number * 1000:8.3f} ms")
+    print(f"    FastJSONResponse:  {fast_render / number * 1000:8.3f} ms")
+
+    chunk = "精灵法师轻轻一笑，"
+    frames = number * 100
+    assert json.loads(sse_content(chunk)[6:]) == json.loads(legacy_sse_content(chunk)[6:])
+    legacy = timeit.timeit(lambda: legacy_sse_content(chunk).encode("utf-8"), number=frames)
+    fast = timeit.timeit(lambda: sse_content(chunk), number=frames)
+    print("SSE内容帧（含编码为字节）")
+    print(f"  原实现:        {legacy / frames * 1e6:8.3f} us")
+    print(f"  帧模板:        {fast / frames * 1e6:8.3f} us")
+    loop.close()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,54 @@
+"""语言检测微基准
+
+对比原有的逐语言正则 findall 实现与单次扫描实现：
+    python bench_language_detector.py
+"""
+
+import re
+import timeit
+from language_detector import detect_language
+
+
+def legacy_detect_language(text: str) -> str:
+    """原 LangChainAIService.detect_language 的实现（每次编译5个正则并扫描5遍）"""
+    if not text:
+        return "en"
+    chinese_chars = len(re.compile(r'[一-鿿]').findall(text))
+    japanese_chars = len(re.compile(r'[぀-ゟ゠-ヿ]').findall(text))
+    korean_chars = len(re.compile(r'[가-힯]').findall(text))
+    russian_chars = len(re.compile(r'[Ѐ-ӿ]').findall(text))
+    arabic_chars = len(re.compile(r'[؀-ۿ]').findall(text))
+    total_chars = len(text)
+    if chinese_chars / total_chars > 0.3:
+        return "zh"
+    elif japanese_chars / total_chars > 0.2:
+        return "ja"
+    elif korean_chars / total_chars > 0.2:
+        return "ko"
+    elif russian_chars / total_chars > 0.2:
+        return "ru"
+    elif arabic_chars / total_chars > 0.2:
+        return "ar"
+    return "en"
+
+
+SAMPLES = {
+    "en_short": "Hello, how is the weather today?",
+    "zh_short": "你好，今天天气怎么样？",
+    "ja_mixed": "こんにちは、今日はいい天気ですね。散歩に行きましょう。" * 4,
+    "zh_long": "这是一段比较长的中文消息，用来测试语言检测在长文本上的表现。" * 40,
+    "en_long": "This is a fairly long English message used for benchmarking. " * 40,
+}
+
+
+def run(number: int = 5000):
+    print(f"{'样本':<10}{'原实现(us)':>12}{'单次扫描(us)':>14}")
+    for name, text in SAMPLES.items():
+        assert legacy_detect_language(text) == detect_language(text), name
+        legacy = timeit.timeit(lambda: legacy_detect_language(text), number=number)
+        single = timeit.timeit(lambda: detect_language(text), number=number)
+        print(f"{name:<10}{legacy / number * 1e6:>12.2f}{single / number * 1e6:>14.2f}")
+
+
+if __name__ == "__main__":
+    run()
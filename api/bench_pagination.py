@@ -0,0 +1,84 @@
+"""分页查询微基准
+
+在临时SQLite库中生成角色数据，对比页码偏移和游标分页在首页与深页的耗时，以及
+列表总数每次 COUNT(*)、缓存命中和估算三种方式的耗时：
+    python bench_pagination.py [角色数]
+
+游标分页的深页通过从同一位置的偏移页取得的 next_cursor 开始，两者返回相同的记录。
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from database import Base
+from list_totals import ListTotals
+from models import Character
+from pagination import paginate
+from routers.characters import CHARACTER_ORDERS
+
+LIMIT = 20
+
+
+async def timed(func, repeat: int = 20) -> float:
+    """多次执行取中位数（毫秒）"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+async def run(path: str, count: int):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        now = datetime.utcnow()
+        await conn.execute(insert(Character), [
+            {
+                "id": f"character-{i:07d}", "name": f"角色{i % 997}", "description": "描述",
+                "system_prompt": "设定", "greeting": "你好", "creator_id": "user-1",
+                "is_public": True, "chat_count": i % 50, "created_at": now - timedelta(seconds=i)
+            }
+            for i in range(count)
+        ])
+
+    query = select(Character).where(Character.is_public == True)
+    print(f"{count} 个角色，每页 {LIMIT} 条（中位数）")
+    async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+        for sort, order in CHARACTER_ORDERS.items():
+            print(f"  sort={sort}")
+            for page in (1, count // LIMIT // 2, count // LIMIT - 1):
+                # 偏移第 page-1 页的 next_cursor 指向第 page 页
+                previous = await paginate(db, query, order, LIMIT, page=max(page - 1, 1))
+                cursor = previous.next_cursor if page > 1 else None
+                by_offset = await paginate(db, query, order, LIMIT, page=page)
+                by_cursor = await paginate(db, query, order, LIMIT, cursor=cursor)
+                assert [c.id for c in by_offset.items] == [c.id for c in by_cursor.items]
+
+                offset_ms = await timed(lambda: paginate(db, query, order, LIMIT, page=page))
+                cursor_ms = await timed(lambda: paginate(db, query, order, LIMIT, cursor=cursor))
+                print(f"    第{page:>6}页  偏移 {offset_ms:8.2f} ms   游标 {cursor_ms:8.2f} ms")
+
+        totals = ListTotals(ttl_seconds=3600, estimate_refresh_seconds=3600)
+        uncached = ListTotals(ttl_seconds=0)
+        count_ms = await timed(lambda: uncached.count(db, query, "characters"))
+        await totals.count(db, query, "characters")
+        cached_ms = await timed(lambda: totals.count(db, query, "characters"))
+        await totals.estimate(db, query, "public_characters")
+        estimate_ms = await timed(lambda: totals.estimate(db, query, "public_characters"))
+        print("  公开角色总数")
+        print(f"    COUNT(*)  {count_ms:8.3f} ms   缓存 {cached_ms:8.3f} ms   估算 {estimate_ms:8.3f} ms")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as workdir:
+        asyncio.run(run(os.path.join(workdir, "bench.db"), total))
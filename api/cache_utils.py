@@ -0,0 +1,157 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple
+
+
+class BoundedLRUCache:
+    """有界LRU缓存
+
+    同时支持最大条目数、字节预算和空闲TTL三种限制，超出时按最近最少使用顺序淘汰。
+    条目大小由 sizeof 回调估算，值在缓存外被修改后需调用 resize() 重新计量。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        max_bytes: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        sizeof: Optional[Callable[[Any], int]] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._sizeof = sizeof or (lambda value: 0)
+        self._clock = clock
+        # key -> (value, size, last_access)
+        self._data: "OrderedDict[Hashable, Tuple[Any, int, float]]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """检查是否存在未过期的条目（不影响LRU顺序和命中统计）"""
+        entry = self._data.get(key)
+        if entry is None:
+            return False
+        if self._is_expired(entry[2], self._clock()):
+            self._remove(key, expired=True)
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(list(self._data.keys()))
+
+    def _is_expired(self, last_access: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - last_access > self.ttl_seconds
+
+    def _remove(self, key: Hashable, expired: bool = False, evicted: bool = False):
+        _, size, _ = self._data.pop(key)
+        self.total_bytes -= size
+        if expired:
+            self.expirations += 1
+        elif evicted:
+            self.evictions += 1
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """获取条目并刷新其LRU位置"""
+        entry = self._data.get(key)
+        now = self._clock()
+        if entry is None or self._is_expired(entry[2], now):
+            if entry is not None:
+                self._remove(key, expired=True)
+            self.misses += 1
+            return default
+
+        value, size, _ = entry
+        self._data[key] = (value, size, now)
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """读取条目但不刷新LRU位置、不计入命中统计"""
+        entry = self._data.get(key)
+        if entry is None or self._is_expired(entry[2], self._clock()):
+            return default
+        return entry[0]
+
+    def put(self, key: Hashable, value: Any):
+        """写入条目，必要时淘汰最久未使用的条目"""
+        if key in self._data:
+            self._remove(key)
+
+        size = self._sizeof(value)
+        self._data[key] = (value, size, self._clock())
+        self.total_bytes += size
+        self._enforce_limits(protect=key)
+
+    def resize(self, key: Hashable):
+        """值被原地修改后重新计算其大小"""
+        entry = self._data.get(key)
+        if entry is None:
+            return
+
+        value, old_size, last_access = entry
+        new_size = self._sizeof(value)
+        self._data[key] = (value, new_size, last_access)
+        self.total_bytes += new_size - old_size
+        self._enforce_limits(protect=key)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """移除条目并返回其值"""
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        self._remove(key)
+        return entry[0]
+
+    def clear(self):
+        self._data.clear()
+        self.total_bytes = 0
+
+    def purge_expired(self) -> int:
+        """清理所有已过期的条目，返回清理数量"""
+        if self.ttl_seconds is None:
+            return 0
+
+        now = self._clock()
+        expired = [key for key, (_, _, last_access) in self._data.items()
+                   if self._is_expired(last_access, now)]
+        for key in expired:
+            self._remove(key, expired=True)
+        return len(expired)
+
+    def _enforce_limits(self, protect: Optional[Hashable] = None):
+        self.purge_expired()
+
+        # 按LRU顺序淘汰，刚写入的条目最后考虑
+        while self._data and (
+            len(self._data) > self.max_entries
+            or (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+        ):
+            oldest = next(iter(self._data))
+            if oldest == protect and len(self._data) == 1:
+                break
+            self._remove(oldest, evicted=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
@@ -0,0 +1,177 @@
+"""角色全文搜索
+
+characters_fts 是SQLite FTS5虚拟表，索引角色的名称、描述和标签，rowid 与 characters
+表的 rowid 相同，由触发器在角色新建、修改名称/描述、删除时同步。分词使用 trigram：
+按连续三个字符切分，中文不需要分词词典，任意位置的子串（包括前缀，"elv*" 这样的
+前缀写法也接受）都能命中，英文不区分大小写。结果按 bm25 相关度排序，名称权重最高。
+
+多个词之间是"且"的关系。trigram 无法匹配少于三个字符的词，这样的词逐行检查索引中
+保存的名称、描述和标签；全部是短词时没有相关度，按请求的排序方式返回。
+
+启动时 ensure_search_index 创建索引和触发器（已有数据库首次创建时回填）。修改
+TAG_RULES 或数据不一致时执行 python character_search.py 重建索引。
+"""
+
+from typing import List, Optional, Tuple
+from sqlalchemy import Column, Float, Integer, MetaData, Table, Text, func, literal_column, or_, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql import Select
+from database import unindexed
+from models import Character
+from pagination import KeysetOrder
+
+# 标签由名称和描述中的关键词得出：(标签, 名称关键词, 描述关键词)
+TAG_RULES = (
+    ("魔法", ("法师",), ("魔法",)),
+    ("战斗", ("骑士",), ("战士",)),
+    ("精灵", ("精灵",), ("精灵",)),
+    ("可爱", (), ("可爱", "萌")),
+    ("智慧", (), ("智慧", "聪明")),
+    ("冒险", (), ("冒险",)),
+)
+DEFAULT_TAGS = ["角色扮演", "对话"]
+
+# trigram 能匹配的最短词长
+MIN_TERM_LENGTH = 3
+
+# bm25 的列权重：名称、描述、标签
+RANK_WEIGHTS = (10.0, 1.0, 5.0)
+
+# 只用于构造查询，不参与 create_all（虚拟表由 ensure_search_index 创建）
+search_index = Table(
+    "characters_fts", MetaData(),
+    Column("rowid", Integer, primary_key=True),
+    Column("name", Text),
+    Column("description", Text),
+    Column("tags", Text),
+    Column("rank", Float)
+)
+
+# 按相关度排序（bm25 越小越相关）
+RELEVANCE_ORDER = KeysetOrder("relevance", search_index.c.rank, Character.id)
+
+
+def character_tags(name: str, description: str) -> List[str]:
+    """角色的标签，没有匹配的关键词时使用默认标签"""
+    tags = [
+        tag for tag, name_keywords, description_keywords in TAG_RULES
+        if any(keyword in name for keyword in name_keywords)
+        or any(keyword in description for keyword in description_keywords)
+    ]
+    return tags or list(DEFAULT_TAGS)
+
+
+def _tags_sql(row: str) -> str:
+    """与 character_tags 相同规则的SQL表达式（空格分隔），row 为触发器中的 new/old"""
+    cases = []
+    for tag, name_keywords, description_keywords in TAG_RULES:
+        conditions = [f"instr({row}.name, '{keyword}') > 0" for keyword in name_keywords]
+        conditions += [f"instr({row}.description, '{keyword}') > 0" for keyword in description_keywords]
+        cases.append(f"CASE WHEN {' OR '.join(conditions)} THEN ' {tag}' ELSE '' END")
+    return f"coalesce(nullif(trim({' || '.join(cases)}), ''), '{' '.join(DEFAULT_TAGS)}')"
+
+
+TRIGGERS = {
+    "characters_fts_insert": f"""
+        CREATE TRIGGER characters_fts_insert AFTER INSERT ON characters BEGIN
+            INSERT INTO characters_fts (rowid, name, description, tags)
+            VALUES (new.rowid, new.name, new.description, {_tags_sql("new")});
+        END
+    """,
+    "characters_fts_update": f"""
+        CREATE TRIGGER characters_fts_update AFTER UPDATE OF name, description ON characters BEGIN
+            UPDATE characters_fts
+            SET name = new.name, description = new.description, tags = {_tags_sql("new")}
+            WHERE rowid = new.rowid;
+        END
+    """,
+    "characters_fts_delete": """
+        CREATE TRIGGER characters_fts_delete AFTER DELETE ON characters BEGIN
+            DELETE FROM characters_fts WHERE rowid = old.rowid;
+        END
+    """,
+}
+
+
+def ensure_search_index(conn: Connection) -> bool:
+    """创建全文索引表和同步触发器，表是新建的则从现有角色回填；返回是否新建
+
+    触发器每次重新创建，与当前的 TAG_RULES 保持一致。
+    """
+    created = conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'characters_fts'"
+    )).first() is None
+    if created:
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE characters_fts USING fts5(name, description, tags, tokenize = 'trigram')"
+        ))
+    conn.execute(text(
+        "INSERT INTO characters_fts (characters_fts, rank) VALUES ('rank', :rank)"
+    ), {"rank": f"bm25({', '.join(str(weight) for weight in RANK_WEIGHTS)})"})
+
+    for name, ddl in TRIGGERS.items():
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+        conn.execute(text(ddl))
+
+    if created:
+        rebuild_search_index(conn)
+    return created
+
+
+def rebuild_search_index(conn: Connection) -> int:
+    """按 characters 表重建全文索引，返回索引的角色数"""
+    conn.execute(text("DELETE FROM characters_fts"))
+    result = conn.execute(text(
+        f"INSERT INTO characters_fts (rowid, name, description, tags) "
+        f"SELECT rowid, name, description, {_tags_sql('characters')} FROM characters"
+    ))
+    return result.rowcount
+
+
+def split_terms(search: str) -> Tuple[List[str], List[str]]:
+    """搜索词按空白切分 -> (可以走全文索引的词, 短于 MIN_TERM_LENGTH 的词)"""
+    terms = [term.strip('"').rstrip("*") for term in search.split()]
+    terms = [term for term in terms if term]
+    return (
+        [term for term in terms if len(term) >= MIN_TERM_LENGTH],
+        [term for term in terms if len(term) < MIN_TERM_LENGTH]
+    )
+
+
+def match_expression(terms: List[str]) -> str:
+    """FTS5 查询：各词都需出现；每个词作为短语加引号，其中的 AND、-、: 等按原文匹配"""
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def apply_search(query: Select, search: str, ordered: bool = False) -> Tuple[Select, Optional[KeysetOrder]]:
+    """为角色查询加上搜索条件，各词都需出现在名称、描述或标签中
+
+    有可以走全文索引的词时同时返回按相关度排序的方式，否则为 None。短词逐行检查索引中
+    保存的文本：ordered 为 True 时（只有短词的翻页查询）沿排序索引读取角色、逐个按 rowid
+    检查，够一页即停止；否则顺序扫描索引中的文本，计数时开销最小。
+    """
+    full_text_terms, short_terms = split_terms(search)
+    join_key = search_index.c.rowid
+    if full_text_terms or not ordered:
+        # 关联条件不能用来按 rowid 查全文索引，SQLite只能先执行 MATCH（或扫描索引）再按
+        # rowid 取角色；否则会沿排序索引遍历全部角色，逐个到全文索引中查找
+        join_key = unindexed(join_key)
+    query = query.join(search_index, join_key == literal_column("characters.rowid"))
+
+    if full_text_terms:
+        query = query.where(literal_column(search_index.name).match(match_expression(full_text_terms)))
+    for term in short_terms:
+        query = query.where(or_(*(
+            func.instr(func.lower(column), func.lower(term)) > 0
+            for column in (search_index.c.name, search_index.c.description, search_index.c.tags)
+        )))
+    return query, RELEVANCE_ORDER if full_text_terms else None
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    with engine.begin() as conn:
+        ensure_search_index(conn)
+        count = rebuild_search_index(conn)
+    print(f"已重建 {count} 个角色的全文索引")
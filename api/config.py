@@ -1,10 +1,18 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Optional, List, Dict, Any
 import os
 
 class Settings(BaseSettings):
     # 数据库配置
     database_url: str = "sqlite:///./ai_roleplay.db"
+    async_db_pool_size: int = 20  # 异步连接池（路由使用）
+    async_db_max_overflow: int = 40
+    sqlite_busy_timeout_ms: int = 30000  # 并发写入时等待写锁的时间
+    
+    # 列表总数（count=exact 按过滤条件短时缓存；count=estimated 用于未过滤的公开角色列表）
+    list_total_cache_ttl_seconds: float = 10.0
+    list_total_cache_max_entries: int = 10000
+    list_total_estimate_refresh_seconds: float = 300.0  # 估算计数的校准间隔
     
     # JWT配置
     secret_key: str = "your-secret-key-here-change-in-production"
@@ -16,7 +24,102 @@ class Settings(BaseSettings):
     anthropic_api_key: str = ""
     openrouter_api_key: str = ""
     default_ai_model: str = "gpt-3.5-turbo"
-    ai_service_provider: str = "openai"
+    ai_service_provider: str = "openai"  # openai / openrouter / record / replay
+    
+    # LLM调用录制与回放（离线测试、性能回归）
+    llm_record_provider: str = "openrouter"  # record 模式下实际调用的提供方
+    llm_cassette_dir: str = "cassettes"
+    llm_replay_speed: float = 1.0  # 1 为原速，大于1为加速，0 为无延迟
+    
+    # 多后端LLM路由配置
+    # JSON列表，如 [{"name": "a", "base_url": "...", "api_key": "...", "model": "...", "weight": 1}]
+    # 为空时使用 ai_service_provider 指定的单个提供方
+    llm_backends: List[Dict[str, Any]] = []
+    llm_first_token_timeout: float = 30.0  # 超过该时间仍无首token则切换后端
+    llm_router_ewma_alpha: float = 0.2
+    llm_router_error_window: int = 20  # 错误率统计的最近请求数
+    llm_router_failure_threshold: int = 3  # 连续失败多少次后熔断
+    llm_router_cooldown_seconds: float = 30.0
+    # 对冲请求：首token迟迟不到时向同一或另一后端补发一个相同请求，先出token者胜出
+    llm_hedge_enabled: bool = False
+    llm_hedge_percentile: float = 95.0  # 按后端最近首token延迟的该百分位决定补发时机
+    llm_hedge_min_samples: int = 20  # 样本不足时使用默认延迟
+    llm_hedge_default_delay: float = 2.0
+    llm_hedge_min_delay: float = 0.05
+    # 客户端RPM/TPM预算，JSON对象，键为 "提供方" 或 "提供方:模型"，如 {"openrouter": {"rpm": 20, "tpm": 40000}}
+    llm_rate_limits: Dict[str, Dict[str, float]] = {}
+    llm_rate_limit_max_wait: float = 5.0  # 预算不足时最多等待的秒数，超过则切换后端
+    llm_rate_limit_completion_estimate: int = 500  # 未指定 max_tokens 时预留的输出token数
+    llm_stream_include_usage: bool = True  # 流式请求要求上游在末尾返回 usage
+    
+    # LLM回复精确匹配缓存（默认关闭）
+    # 键为模型、温度和完整消息列表的哈希；response_cache_path 为空时只用内存缓存
+    response_cache_enabled: bool = False
+    response_cache_max_entries: int = 1000
+    response_cache_ttl_seconds: float = 86400.0
+    response_cache_path: str = "response_cache.db"
+    response_cache_disk_max_entries: int = 10000
+
+    # 相同在途生成合并：同一提示键的并发请求共用一次上游流
+    single_flight_enabled: bool = True
+    single_flight_queue_size: int = 256  # 每个订阅者的缓冲分块数，写满后转为追赶模式
+
+    # 聊天生成准入控制
+    admission_enabled: bool = True
+    admission_max_concurrent: int = 64  # 全局同时进行的生成数
+    admission_max_per_user: int = 2  # 每个登录用户
+    admission_max_per_guest_ip: int = 2  # 每个游客IP（学校、公司等共用出口IP的游客共享该名额）
+    # 前面的可信反向代理层数：大于0时游客IP取自 X-Forwarded-For 从右数第N个地址，
+    # 否则使用连接的对端地址（部署在代理之后却不设置时，所有游客共用代理的IP）
+    trusted_proxy_hops: int = 0
+    admission_queue_size: int = 128  # 排队上限，超出直接返回429
+    admission_max_wait_seconds: float = 10.0
+
+    # SSE输出分块合并（两者都为0时逐块发送）
+    sse_coalesce_interval_ms: float = 30.0
+    sse_coalesce_max_bytes: int = 512
+
+    # SSE断线续传（按消息缓存最近的内容帧，重连时凭Last-Event-ID续传）
+    sse_resume_buffer_frames: int = 512  # 每条回复保留的最近帧数
+    sse_resume_retention_seconds: float = 60.0  # 回复结束后缓冲保留时长
+    sse_resume_max_finished: int = 1000
+    sse_heartbeat_interval: float = 15.0  # 无输出时发送心跳注释的间隔，0为关闭
+    sse_cancel_on_disconnect: bool = True  # 所有客户端断开后取消上游生成，保存已生成部分
+    sse_stale_reply_seconds: float = 600.0  # 超过该时长仍在生成且没有缓冲的回复视为已中断，标记为失败
+    sse_cancel_grace_seconds: float = 10.0  # 断开后等待重连的宽限期（覆盖浏览器重连和移动网络切换），0为立即取消
+
+    # LLM共享HTTP连接池配置
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry: float = 30.0  # 空闲连接保活秒数
+    http_connect_timeout: float = 10.0
+    http_timeout: float = 60.0
+    http_http2: bool = True  # 安装h2后启用HTTP/2
+    
+    # 会话记忆缓存配置
+    memory_cache_max_entries: int = 1000
+    memory_cache_max_bytes: int = 64 * 1024 * 1024  # 64MB
+    memory_cache_ttl_seconds: int = 3600  # 空闲1小时后过期
+    memory_rehydrate_window: int = 20  # 缓存未命中且缺少token前缀和时加载的最近消息条数
+    
+    # 上下文窗口配置（单位：token）
+    token_counter: str = "auto"  # auto / tiktoken / estimate
+    token_count_cache_size: int = 10000
+    context_window_tokens: int = 4096
+    context_reply_tokens: int = 1000
+    context_system_tokens: int = 1500
+    
+    # 提示词模板缓存
+    prompt_cache_max_entries: int = 512
+    
+    # 滚动会话摘要配置
+    summary_enabled: bool = True
+    summary_trigger_turns: int = 10  # 每隔多少轮对话更新一次摘要
+    summary_trigger_tokens: int = 2000  # 或新增多少token后更新
+    summary_workers: int = 2
+    summary_queue_size: int = 100
+    summary_max_length: int = 300
+    summary_max_input_tokens: int = 4000
     
     # 应用配置
     app_name: str = "AI角色扮演网站"
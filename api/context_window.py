@@ -0,0 +1,168 @@
+import logging
+import math
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from config import settings
+from cache_utils import BoundedLRUCache
+
+logger = logging.getLogger(__name__)
+
+# 每条消息在对话格式中的额外开销（角色标记、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class EstimateTokenCounter:
+    """廉价的token估算器
+
+    ASCII文本约4个字符一个token，中日韩等非ASCII字符按每字符1.2个token保守估计，
+    避免按字符数预算时对中文严重低估。
+    """
+
+    name = "estimate"
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        ascii_chars = len(text.encode("ascii", "ignore"))
+        other_chars = len(text) - ascii_chars
+        return math.ceil(ascii_chars / 4 + other_chars * 1.2)
+
+
+class TiktokenCounter:
+    """基于本地BPE词表（tiktoken）的精确计数器"""
+
+    name = "tiktoken"
+
+    def __init__(self, model: str):
+        import tiktoken
+
+        try:
+            self._encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            # OpenRouter等非OpenAI模型名无法识别时使用通用词表
+            self._encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+class CachedTokenCounter:
+    """带缓存的计数器，同一段文本只计算一次"""
+
+    def __init__(self, counter, max_entries: int = 10000):
+        self.counter = counter
+        self.name = counter.name
+        self._cache = BoundedLRUCache(max_entries=max_entries)
+
+    def count(self, text: str) -> int:
+        tokens = self._cache.get(text)
+        if tokens is None:
+            tokens = self.counter.count(text)
+            self._cache.put(text, tokens)
+        return tokens
+
+    def count_message(self, message: Any) -> int:
+        """计算单条消息的token数（含格式开销）
+
+        dict消息若已带有预先计算的 token_count 字段则直接使用，否则按内容查缓存计算。
+        """
+        if isinstance(message, dict):
+            tokens = message.get("token_count")
+            if tokens is None:
+                tokens = self.count(message.get("content", ""))
+        else:
+            tokens = self.count(getattr(message, "content", "") or "")
+        return tokens + MESSAGE_OVERHEAD_TOKENS
+
+    def stats(self) -> Dict[str, Any]:
+        return {"counter": self.name, **self._cache.stats()}
+
+
+def create_token_counter(kind: Optional[str] = None, model: Optional[str] = None) -> CachedTokenCounter:
+    """按配置创建token计数器
+
+    kind: "tiktoken" | "estimate" | "auto"（优先tiktoken，不可用时退化为估算）
+    """
+    kind = kind or settings.token_counter
+    model = model or settings.default_ai_model
+
+    counter = None
+    if kind in ("auto", "tiktoken"):
+        try:
+            counter = TiktokenCounter(model)
+        except Exception as e:
+            if kind == "tiktoken":
+                logger.error(f"加载tiktoken词表失败，改用估算计数: {e}")
+            counter = None
+    if counter is None:
+        counter = EstimateTokenCounter()
+
+    return CachedTokenCounter(counter, max_entries=settings.token_count_cache_size)
+
+
+class ContextBudget:
+    """上下文token预算，系统提示词、历史消息和回复分别计算"""
+
+    def __init__(
+        self,
+        context_tokens: Optional[int] = None,
+        reply_tokens: Optional[int] = None,
+        system_tokens: Optional[int] = None,
+        history_tokens: Optional[int] = None
+    ):
+        self.context_tokens = context_tokens or settings.context_window_tokens
+        self.reply_tokens = reply_tokens if reply_tokens is not None else settings.context_reply_tokens
+        self.system_tokens = system_tokens if system_tokens is not None else settings.context_system_tokens
+        self.history_tokens = history_tokens
+
+    def history_budget(self, system_used: int) -> int:
+        """历史消息可用的token数"""
+        available = self.context_tokens - self.reply_tokens - system_used
+        if self.history_tokens is not None:
+            available = min(available, self.history_tokens)
+        return max(available, 0)
+
+
+def select_history_window(
+    history: Sequence[Any],
+    budget_tokens: int,
+    count_message: Callable[[Any], int]
+) -> List[Any]:
+    """从最新消息开始向前选取，直到超出预算（线性时间）"""
+    selected = []
+    used = 0
+    for message in reversed(history):
+        tokens = count_message(message)
+        if used + tokens > budget_tokens:
+            break
+        selected.append(message)
+        used += tokens
+    selected.reverse()
+    return selected
+
+
+def build_context_window(
+    system_messages: Sequence[Any],
+    history: Sequence[Any],
+    budget: Optional[ContextBudget] = None,
+    counter: Optional[CachedTokenCounter] = None
+) -> List[Any]:
+    """按token预算构建上下文：系统消息完整保留，历史消息保留最近且放得下的部分"""
+    budget = budget or ContextBudget()
+    counter = counter or token_counter
+
+    system_used = sum(counter.count_message(msg) for msg in system_messages)
+    if system_used > budget.system_tokens:
+        logger.warning(f"系统提示词超出预算: {system_used} > {budget.system_tokens} tokens")
+
+    history_window = select_history_window(
+        history,
+        budget.history_budget(system_used),
+        counter.count_message
+    )
+    return list(system_messages) + history_window
+
+
+# 全局计数器实例
+token_counter = create_token_counter()
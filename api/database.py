@@ -1,4 +1,9 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import UnaryExpression
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from config import settings
@@ -14,9 +19,44 @@ engine = create_engine(
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def async_database_url(url: str) -> str:
+    """同步数据库URL对应的异步驱动URL（sqlite -> sqlite+aiosqlite）"""
+    parsed = make_url(url)
+    if parsed.drivername == "sqlite":
+        parsed = parsed.set(drivername="sqlite+aiosqlite")
+    return parsed.render_as_string(hide_password=False)
+
+# 异步引擎：路由中的查询不阻塞事件循环（aiosqlite默认不复用连接，这里显式使用连接池）
+async_engine = create_async_engine(
+    async_database_url(settings.database_url),
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=settings.async_db_pool_size,
+    max_overflow=settings.async_db_max_overflow,
+    echo=settings.debug
+)
+
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    # WAL模式是数据库级的，synchronous和忙等待时间需要每个连接单独设置
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}")
+    cursor.close()
+
+# 同步引擎（启动初始化和脚本）与异步引擎并发写同一个库，两者都需要忙等待
+for _engine in (engine, async_engine.sync_engine):
+    if _engine.dialect.name == "sqlite":
+        event.listen(_engine, "connect", _set_sqlite_pragma)
+
+# 提交后不过期对象，响应序列化时无需再次加载（异步会话不支持隐式懒加载）
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
 # 创建基类
 Base = declarative_base()
 
+def unindexed(column):
+    """一元 +column：值不变，但SQLite不会用这一列上的索引来处理该条件（用于引导查询计划）"""
+    return UnaryExpression(column.expression, operator=operators.custom_op("+"), type_=column.type)
+
 # 数据库依赖
 def get_db():
     db = SessionLocal()
@@ -25,6 +65,10 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # 初始化数据库配置
 def init_database():
     """初始化数据库配置"""
@@ -39,6 +83,11 @@ def init_database():
     # 创建所有表
     Base.metadata.create_all(bind=engine)
     
+    # 角色全文索引（FTS5虚拟表和同步触发器）
+    from character_search import ensure_search_index
+    with engine.begin() as conn:
+        ensure_search_index(conn)
+    
     # 初始化示例数据
     from init_data import init_sample_characters
     init_sample_characters()
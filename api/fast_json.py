@@ -0,0 +1,53 @@
+"""快速JSON序列化
+
+安装了 orjson 时用它序列化所有JSON响应和SSE帧，没有安装时回退到标准库json，
+输出格式相同（紧凑分隔符、不转义非ASCII字符）。SSE内容帧按预先编码好的模板拼接，
+每个token只需序列化文本本身。
+"""
+
+import json
+from typing import Any, Dict, Optional
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """序列化为UTF-8编码的JSON字节串"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """默认响应类：优先使用 orjson 渲染"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+# SSE帧模板
+_CONTENT_FRAME_PREFIX = b'data: {"type":"content","content":'
+_FRAME_SUFFIX = b"}\n\n"
+SSE_DONE = b"data: [DONE]\n\n"
+# 注释行，客户端忽略，用于在长时间无输出时保持连接
+SSE_HEARTBEAT = b": ping\n\n"
+
+
+def _event_id(event_id: Optional[int]) -> bytes:
+    return b"" if event_id is None else b"id: %d\n" % event_id
+
+
+def sse_event(payload: Dict[str, Any], event_id: Optional[int] = None) -> bytes:
+    """任意事件的SSE帧"""
+    return _event_id(event_id) + b"data: " + dumps(payload) + b"\n\n"
+
+
+def sse_content(content: str, event_id: Optional[int] = None) -> bytes:
+    """内容块的SSE帧（热路径，只序列化文本）"""
+    return _event_id(event_id) + _CONTENT_FRAME_PREFIX + dumps(content) + _FRAME_SUFFIX
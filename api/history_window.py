@@ -0,0 +1,181 @@
+"""消息token计数与前缀和维护
+
+每条消息持久化 token_count（内容token数）和 cumulative_tokens（本会话内截至该消息的
+token前缀和，含每条消息的格式开销）。选取最近N个token的历史只需一次
+(conversation_id, cumulative_tokens) 索引范围查询，与会话长度无关。
+
+同一会话可能有多个请求同时写入（AI回复生成期间又发送了消息）。新消息的前缀和在
+INSERT 语句中按会话当前最大值计算，修改和删除用相对更新平移其后的消息，都由数据库
+的写锁串行化，不依赖事先读出的前缀和。
+"""
+
+from typing import Iterable, List, Optional
+from sqlalchemy import desc, func, select
+from sqlalchemy.orm import Session, aliased
+from context_window import MESSAGE_OVERHEAD_TOKENS, token_counter
+from models import Conversation, Message
+
+
+def message_cost(token_count: int) -> int:
+    """单条消息在上下文中占用的token数"""
+    return (token_count or 0) + MESSAGE_OVERHEAD_TOKENS
+
+
+def last_cumulative_tokens(db: Session, conversation_id: str) -> int:
+    """会话当前的token前缀和（索引上取最大值）"""
+    value = db.query(func.max(Message.cumulative_tokens)).filter(
+        Message.conversation_id == conversation_id
+    ).scalar()
+    return value or 0
+
+
+def assign_token_counts(db: Session, message: Message, previous_cumulative: Optional[int] = None):
+    """在写入消息前计算其token数和前缀和
+
+    previous_cumulative 为同一会话上一条消息的前缀和（回填时使用）；不传时前缀和在
+    INSERT 语句中按会话当前的最大值计算，写入后才能读取。
+    """
+    message.token_count = token_counter.count(message.content or "")
+    if previous_cumulative is None:
+        current = aliased(Message)
+        previous_cumulative = select(func.coalesce(func.max(current.cumulative_tokens), 0)).where(
+            current.conversation_id == message.conversation_id
+        ).scalar_subquery()
+    message.cumulative_tokens = previous_cumulative + message_cost(message.token_count)
+
+
+def _position(message: Message):
+    """消息当前的前缀和（在执行语句时读取，其他请求可能已经平移过）"""
+    current = aliased(Message)
+    return select(current.cumulative_tokens).where(current.id == message.id).scalar_subquery()
+
+
+def _shift_after(db: Session, message: Message, delta: int):
+    """把同会话中 message 之后的消息（以及不早于它的摘要检查点）的前缀和平移 delta
+
+    删除在摘要检查点及之前的消息时检查点同样前移，否则检查点之后尚未摘要的消息会
+    落到检查点以内，既不再放入上下文，也不会被摘要。
+    """
+    position = _position(message)
+    db.query(Conversation).filter(
+        Conversation.id == message.conversation_id,
+        Conversation.summary_checkpoint_tokens >= position
+    ).update(
+        {Conversation.summary_checkpoint_tokens: Conversation.summary_checkpoint_tokens + delta},
+        synchronize_session=False
+    )
+    db.query(Message).filter(
+        Message.conversation_id == message.conversation_id,
+        Message.cumulative_tokens > position
+    ).update(
+        {Message.cumulative_tokens: Message.cumulative_tokens + delta},
+        synchronize_session=False
+    )
+
+
+def shift_cumulative_after_delete(db: Session, message: Message):
+    """删除消息前修正同会话中后续消息的前缀和和摘要检查点（须在删除之前调用）"""
+    if message.cumulative_tokens is None:
+        return
+    _shift_after(db, message, -message_cost(message.token_count))
+
+
+def update_token_counts(db: Session, message: Message, content: str):
+    """修改已写入消息的内容（AI回复生成结束），按token数变化平移其后消息的前缀和
+
+    回复生成期间同会话写入的新消息排在占位消息之后，占位消息的前缀和按变化量相对
+    更新，保持前缀和随写入顺序单调递增。
+    """
+    token_count = token_counter.count(content)
+    delta = message_cost(token_count) - message_cost(message.token_count)
+    message.content = content
+    message.token_count = token_count
+    if message.cumulative_tokens is None or not delta:
+        return
+    _shift_after(db, message, delta)
+    message.cumulative_tokens = Message.cumulative_tokens + delta
+
+
+def _history_query(db: Session, conversation_id: str, exclude_message_ids: Iterable[str]):
+    query = db.query(
+        Message.id, Message.role, Message.content,
+        Message.token_count, Message.cumulative_tokens
+    ).filter(
+        Message.conversation_id == conversation_id,
+        Message.content != ""
+    )
+    exclude_message_ids = [mid for mid in exclude_message_ids if mid]
+    if exclude_message_ids:
+        query = query.filter(Message.id.notin_(exclude_message_ids))
+    return query
+
+
+def load_history_window(
+    db: Session,
+    conversation_id: str,
+    budget_tokens: int,
+    exclude_message_ids: Iterable[str] = (),
+    fallback_limit: int = 20,
+    after_tokens: Optional[int] = None
+) -> List:
+    """加载放得进 budget_tokens 的最近消息（按时间正序）
+
+    after_tokens 为摘要检查点，只加载其后的消息（之前的内容由摘要代替）。
+    尚未回填前缀和的旧数据退化为按条数加载最近 fallback_limit 条。
+    """
+    exclude_message_ids = list(exclude_message_ids)
+    head = _history_query(db, conversation_id, exclude_message_ids).order_by(
+        desc(Message.cumulative_tokens)
+    ).first()
+
+    if head is None:
+        return []
+
+    if head.cumulative_tokens is None:
+        rows = _history_query(db, conversation_id, exclude_message_ids).order_by(
+            desc(Message.created_at)
+        ).limit(fallback_limit).all()
+        return list(reversed(rows))
+
+    threshold = head.cumulative_tokens - budget_tokens
+    if after_tokens is not None:
+        threshold = max(threshold, after_tokens)
+    rows = _history_query(db, conversation_id, exclude_message_ids).filter(
+        Message.cumulative_tokens > threshold,
+        Message.cumulative_tokens <= head.cumulative_tokens
+    ).order_by(Message.cumulative_tokens).all()
+
+    # 第一条消息可能只有后半部分落在预算内
+    if rows and rows[0].cumulative_tokens - message_cost(rows[0].token_count) < threshold:
+        rows = rows[1:]
+    return rows
+
+
+def backfill_token_counts(db: Session) -> int:
+    """为迁移前的历史消息回填token数和前缀和，返回处理的会话数"""
+    conversation_ids = [row[0] for row in db.query(Message.conversation_id).filter(
+        Message.cumulative_tokens.is_(None)
+    ).distinct().all()]
+
+    for conversation_id in conversation_ids:
+        cumulative = 0
+        messages = db.query(Message).filter(
+            Message.conversation_id == conversation_id
+        ).order_by(Message.created_at, Message.id).all()
+        for message in messages:
+            assign_token_counts(db, message, previous_cumulative=cumulative)
+            cumulative = message.cumulative_tokens
+        db.commit()
+
+    return len(conversation_ids)
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        count = backfill_token_counts(db)
+        print(f"已回填 {count} 个会话的消息token数")
+    finally:
+        db.close()
@@ -0,0 +1,186 @@
+"""所有LLM提供方共用的异步HTTP连接池
+
+AsyncOpenAI 和 LangChain 的 ChatOpenAI 都通过 get_http_client() 拿到同一个
+httpx.AsyncClient，共享连接数上限、keep-alive 和（可用时）HTTP/2 复用，避免
+各自维护连接池带来的额外TLS握手。连接池由应用生命周期负责关闭。
+"""
+
+import asyncio
+import importlib.util
+import logging
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+import httpx
+from config import settings
+from metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+
+class PoolMetrics:
+    """连接池等待时间与连接复用统计"""
+
+    def __init__(self, window: int = 1000):
+        self.requests = 0
+        self.in_flight = 0
+        self.connections_opened = 0
+        self.errors = 0
+        self._waits = deque(maxlen=window)
+
+    def record_wait(self, seconds: float):
+        self._waits.append(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        waits = list(self._waits)
+        return {
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "connections_opened": self.connections_opened,
+            "connections_reused": max(self.requests - self.connections_opened - self.errors, 0),
+            "errors": self.errors,
+            "pool_wait_ms": {
+                "avg": sum(waits) / len(waits) * 1000 if waits else 0.0,
+                "p50": percentile(waits, 50) * 1000,
+                "p95": percentile(waits, 95) * 1000,
+                "max": max(waits) * 1000 if waits else 0.0
+            }
+        }
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """在连接池外层统计等待时间的传输层
+
+    借助 httpcore 的 trace 扩展：请求进入连接池到第一个连接/发送事件之间的时间
+    即为等待可用连接（或新建连接前）的耗时。底层连接池关闭后会在下次请求时重建。
+    """
+
+    def __init__(self, **transport_kwargs):
+        self._transport_kwargs = transport_kwargs
+        self._transport: Optional[httpx.AsyncHTTPTransport] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.metrics = PoolMetrics()
+
+    async def _get_transport(self) -> httpx.AsyncHTTPTransport:
+        # 连接绑定在创建它的事件循环上，换了事件循环（如脚本/测试多次 asyncio.run）时重建连接池
+        loop = asyncio.get_running_loop()
+        if self._transport is None or self._loop is not loop:
+            stale, stale_loop = self._transport, self._loop
+            self._transport = httpx.AsyncHTTPTransport(**self._transport_kwargs)
+            self._loop = loop
+            if stale is not None:
+                await _close_transport(stale, stale_loop)
+        return self._transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        metrics = self.metrics
+        started = time.perf_counter()
+        first_event = []
+        user_trace = request.extensions.get("trace")
+
+        async def trace(event_name: str, info: dict):
+            if not first_event and event_name.endswith(".started"):
+                first_event.append(True)
+                metrics.record_wait(time.perf_counter() - started)
+            if event_name == "connection.connect_tcp.started":
+                metrics.connections_opened += 1
+            if user_trace is not None:
+                result = user_trace(event_name, info)
+                if hasattr(result, "__await__"):
+                    await result
+
+        request.extensions["trace"] = trace
+        metrics.requests += 1
+        metrics.in_flight += 1
+        try:
+            transport = await self._get_transport()
+            return await transport.handle_async_request(request)
+        except Exception:
+            metrics.errors += 1
+            raise
+        finally:
+            metrics.in_flight -= 1
+
+    async def aclose(self):
+        if self._transport is not None:
+            transport, self._transport = self._transport, None
+            await _close_transport(transport, self._loop)
+
+
+async def _close_transport(transport: httpx.AsyncHTTPTransport, loop: asyncio.AbstractEventLoop):
+    """关闭连接池
+
+    连接只能在创建它的事件循环上正常关闭：该循环仍在其他线程运行时交给它关闭；
+    已关闭时无法走正常关闭流程，直接释放底层套接字，避免泄漏。
+    """
+    if loop is not asyncio.get_running_loop() and loop.is_running():
+        asyncio.run_coroutine_threadsafe(transport.aclose(), loop)
+        return
+
+    # aclose 会清空连接列表，先取出各连接的网络流
+    streams = []
+    for connection in transport._pool.connections:
+        stream = getattr(getattr(connection, "_connection", None), "_network_stream", None)
+        if stream is not None:
+            streams.append(stream)
+    try:
+        await transport.aclose()
+    except RuntimeError:
+        for stream in streams:
+            sock = stream.get_extra_info("socket")
+            # asyncio 只暴露 TransportSocket 包装，真正的套接字在 _sock 上
+            sock = getattr(sock, "_sock", sock)
+            if sock is not None:
+                sock.close()
+        logger.debug(f"旧事件循环已关闭，直接释放 {len(streams)} 个连接")
+
+
+def http2_available() -> bool:
+    """HTTP/2 需要可选依赖 h2"""
+    return importlib.util.find_spec("h2") is not None
+
+
+_transport: Optional[InstrumentedTransport] = None
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取共享的异步HTTP客户端（首次调用时创建）"""
+    global _transport, _client
+    if _client is None:
+        http2 = settings.http_http2 and http2_available()
+        if settings.http_http2 and not http2:
+            logger.info("未安装h2，LLM连接池使用HTTP/1.1")
+
+        _transport = InstrumentedTransport(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings.http_max_connections,
+                max_keepalive_connections=settings.http_max_keepalive_connections,
+                keepalive_expiry=settings.http_keepalive_expiry
+            )
+        )
+        _client = httpx.AsyncClient(
+            transport=_transport,
+            timeout=httpx.Timeout(settings.http_timeout, connect=settings.http_connect_timeout)
+        )
+    return _client
+
+
+async def close_http_client():
+    """关闭连接池中的所有连接（客户端对象保留，下次请求时重建连接池）"""
+    if _transport is not None:
+        await _transport.aclose()
+
+
+def http_pool_stats() -> Dict[str, Any]:
+    """获取连接池统计"""
+    stats = {
+        "max_connections": settings.http_max_connections,
+        "max_keepalive_connections": settings.http_max_keepalive_connections,
+        "keepalive_expiry": settings.http_keepalive_expiry,
+        "http2": settings.http_http2 and http2_available()
+    }
+    if _transport is not None:
+        stats.update(_transport.metrics.snapshot())
+    return stats
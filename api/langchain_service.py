@@ -8,62 +8,70 @@ from langchain_core.prompts import (
 )
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage, BaseMessage
 from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
-from typing import List, Dict, AsyncGenerator, Optional
+from sqlalchemy import desc
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Dict, AsyncGenerator, Optional, Iterable
 import asyncio
-import re
+import hashlib
 from config import settings
+from cache_utils import BoundedLRUCache
+from database import AsyncSessionLocal
+from context_window import ContextBudget, select_history_window, token_counter
+from history_window import load_history_window
+from language_detector import detect_language, language_detector
+from http_client import get_http_client
+from llm_router import llm_router
+from rate_limiter import RateLimitExceeded
+from models import Message
+
+class _MemoryEntry:
+    """缓存中的会话记忆及其对应的最新持久化消息ID"""
+    __slots__ = ("memory", "head_message_id")
+    
+    def __init__(self, memory: ConversationBufferMemory, head_message_id: Optional[str] = None):
+        self.memory = memory
+        self.head_message_id = head_message_id
+
+class _PromptEntry:
+    """编译好的提示词模板及预先渲染的系统消息"""
+    __slots__ = ("template", "system_messages", "system_tokens")
+    
+    def __init__(self, template: ChatPromptTemplate, system_messages: List[BaseMessage], system_tokens: int):
+        self.template = template
+        self.system_messages = system_messages
+        self.system_tokens = system_tokens
+
+# LangChain消息类型 -> OpenAI消息角色
+_OPENAI_ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+def to_openai_messages(messages: List[BaseMessage]) -> List[Dict[str, str]]:
+    """将LangChain消息转换为OpenAI格式"""
+    return [{"role": _OPENAI_ROLES.get(msg.type, "user"), "content": msg.content} for msg in messages]
+
+def _memory_size(entry: _MemoryEntry) -> int:
+    """估算会话记忆占用的字节数"""
+    return sum(len(msg.content.encode("utf-8")) for msg in entry.memory.chat_memory.messages)
 
 class LangChainAIService:
     def __init__(self):
         self.llm = None
-        self.memory_store = {}  # 存储每个会话的记忆
+        # 对话生成统一走LLM路由（多后端、缓存、限流、录制回放）
+        self.router = llm_router
+        # 存储每个会话的记忆（按LRU/TTL淘汰，避免常驻进程内存无限增长）
+        self.memory_store = BoundedLRUCache(
+            max_entries=settings.memory_cache_max_entries,
+            max_bytes=settings.memory_cache_max_bytes,
+            ttl_seconds=settings.memory_cache_ttl_seconds,
+            sizeof=_memory_size
+        )
+        # 编译好的提示词模板，键为 (角色ID, 提示词内容哈希)
+        self.prompt_cache = BoundedLRUCache(max_entries=settings.prompt_cache_max_entries)
         self._init_llm()
     
     def detect_language(self, text: str) -> str:
         """检测文本语言"""
-        if not text:
-            return "en"
-        
-        # 检测中文字符
-        chinese_pattern = re.compile(r'[\u4e00-\u9fff]')
-        chinese_chars = len(chinese_pattern.findall(text))
-        
-        # 检测日文字符
-        japanese_pattern = re.compile(r'[\u3040-\u309f\u30a0-\u30ff]')
-        japanese_chars = len(japanese_pattern.findall(text))
-        
-        # 检测韩文字符
-        korean_pattern = re.compile(r'[\uac00-\ud7af]')
-        korean_chars = len(korean_pattern.findall(text))
-        
-        # 检测俄文字符
-        russian_pattern = re.compile(r'[\u0400-\u04ff]')
-        russian_chars = len(russian_pattern.findall(text))
-        
-        # 检测阿拉伯文字符
-        arabic_pattern = re.compile(r'[\u0600-\u06ff]')
-        arabic_chars = len(arabic_pattern.findall(text))
-        
-        total_chars = len(text)
-        
-        # 如果中文字符占比超过30%，认为是中文
-        if chinese_chars / total_chars > 0.3:
-            return "zh"
-        # 如果日文字符占比超过20%，认为是日文
-        elif japanese_chars / total_chars > 0.2:
-            return "ja"
-        # 如果韩文字符占比超过20%，认为是韩文
-        elif korean_chars / total_chars > 0.2:
-            return "ko"
-        # 如果俄文字符占比超过20%，认为是俄文
-        elif russian_chars / total_chars > 0.2:
-            return "ru"
-        # 如果阿拉伯文字符占比超过20%，认为是阿拉伯文
-        elif arabic_chars / total_chars > 0.2:
-            return "ar"
-        # 默认为英文
-        else:
-            return "en"
+        return detect_language(text)
     
     def get_language_instruction(self, language_code: str) -> str:
         """根据语言代码获取语言指令"""
@@ -78,94 +86,302 @@ class LangChainAIService:
         return language_instructions.get(language_code, "IMPORTANT: Always respond in English.")
     
     def _init_llm(self):
-        """初始化LangChain LLM"""
-        if settings.ai_service_provider == "openrouter":
+        """初始化LangChain LLM（回放模式下摘要链不可用，对话生成仍走路由回放）"""
+        provider = settings.ai_service_provider
+        if provider == "record":
+            provider = settings.llm_record_provider
+        if provider == "openrouter":
             self.llm = ChatOpenAI(
                 api_key=settings.openrouter_api_key,
                 base_url="https://openrouter.ai/api/v1",
                 model=settings.default_ai_model,
                 temperature=0.7,
-                streaming=True
+                streaming=True,
+                http_async_client=get_http_client()
             )
-        elif settings.ai_service_provider == "openai":
+        elif provider == "openai":
             self.llm = ChatOpenAI(
                 api_key=settings.openai_api_key,
                 model=settings.default_ai_model,
                 temperature=0.7,
-                streaming=True
+                streaming=True,
+                http_async_client=get_http_client()
             )
     
-    def get_memory(self, conversation_id: str) -> ConversationBufferMemory:
-        """获取或创建会话记忆"""
-        if conversation_id not in self.memory_store:
-            self.memory_store[conversation_id] = ConversationBufferMemory(
+    def _history_query(self, db: Session, conversation_id: str, exclude_message_ids: Iterable[str]):
+        """会话历史查询（按时间倒序，走conversation_id索引）"""
+        query = db.query(Message.id, Message.role, Message.content).filter(
+            Message.conversation_id == conversation_id,
+            Message.content != ""
+        )
+        exclude_message_ids = [mid for mid in exclude_message_ids if mid]
+        if exclude_message_ids:
+            query = query.filter(Message.id.notin_(exclude_message_ids))
+        return query.order_by(desc(Message.created_at))
+    
+    def _rehydrate_memory(
+        self,
+        db: Session,
+        conversation_id: str,
+        exclude_message_ids: Iterable[str],
+        summary_checkpoint: Optional[int] = None
+    ) -> _MemoryEntry:
+        """从messages表加载最近的消息窗口重建会话记忆
+        
+        按持久化的token前缀和只加载放得进上下文预算、且在摘要检查点之后的消息。
+        """
+        rows = load_history_window(
+            db,
+            conversation_id,
+            ContextBudget().history_budget(0),
+            exclude_message_ids=exclude_message_ids,
+            fallback_limit=settings.memory_rehydrate_window,
+            after_tokens=summary_checkpoint
+        )
+        
+        memory = ConversationBufferMemory(
+            return_messages=True,
+            memory_key="chat_history"
+        )
+        for row in rows:
+            if row.role == "user":
+                memory.chat_memory.add_user_message(row.content)
+            elif row.role == "assistant":
+                memory.chat_memory.add_ai_message(row.content)
+        
+        return _MemoryEntry(memory, rows[-1].id if rows else None)
+    
+    def get_memory(
+        self,
+        conversation_id: str,
+        db: Session,
+        exclude_message_ids: Iterable[str] = (),
+        summary_checkpoint: Optional[int] = None
+    ) -> ConversationBufferMemory:
+        """获取会话记忆，未命中或已过时则从数据库重建
+        
+        exclude_message_ids 用于排除当前轮次刚写入的消息（用户消息和AI占位消息）；
+        summary_checkpoint 为摘要检查点，重建时只加载其后的消息。
+        """
+        exclude_message_ids = list(exclude_message_ids)
+        entry = self.memory_store.get(conversation_id)
+        
+        try:
+            if entry is not None:
+                # 其他worker可能已写入新消息，比较最新消息ID判断缓存是否仍然有效
+                head = self._history_query(db, conversation_id, exclude_message_ids).with_entities(
+                    Message.id
+                ).first()
+                if (head.id if head else None) == entry.head_message_id:
+                    return entry.memory
+            
+            entry = self._rehydrate_memory(db, conversation_id, exclude_message_ids, summary_checkpoint)
+        except Exception as e:
+            # 数据库不可用时退化为空记忆，不影响对话
+            print(f"重建会话记忆失败: {str(e)}")
+            entry = _MemoryEntry(ConversationBufferMemory(
                 return_messages=True,
                 memory_key="chat_history"
+            ))
+        
+        self.memory_store.put(conversation_id, entry)
+        return entry.memory
+    
+    async def prepare_memory(
+        self,
+        conversation_id: str,
+        db: Optional[AsyncSession] = None,
+        exclude_message_ids: Iterable[str] = (),
+        summary_checkpoint: Optional[int] = None
+    ) -> ConversationBufferMemory:
+        """在异步会话上校验并按需重建会话记忆（未传db时使用独立的短会话）
+        
+        之后调用 generate_response 时不必再传db，直接使用刚校验过的缓存记忆，
+        流式生成期间不占用数据库连接。
+        """
+        if db is None:
+            async with AsyncSessionLocal() as session:
+                return await self.prepare_memory(conversation_id, session, exclude_message_ids, summary_checkpoint)
+        return await db.run_sync(
+            lambda session: self.get_memory(
+                conversation_id,
+                db=session,
+                exclude_message_ids=exclude_message_ids,
+                summary_checkpoint=summary_checkpoint
             )
-        return self.memory_store[conversation_id]
+        )
+    
+    async def _current_memory(
+        self,
+        conversation_id: str,
+        db: Optional[Session] = None,
+        exclude_message_ids: Iterable[str] = (),
+        summary_checkpoint: Optional[int] = None
+    ) -> ConversationBufferMemory:
+        """生成时使用的记忆：未传db时直接使用缓存，缓存已被淘汰才在异步会话中重建"""
+        if db is not None:
+            return self.get_memory(conversation_id, db, exclude_message_ids, summary_checkpoint)
+        entry = self.memory_store.get(conversation_id)
+        if entry is not None:
+            return entry.memory
+        return await self.prepare_memory(
+            conversation_id,
+            exclude_message_ids=exclude_message_ids,
+            summary_checkpoint=summary_checkpoint
+        )
+    
+    def forget_memory(self, conversation_id: str):
+        """丢弃会话的进程内记忆（下次使用时从数据库重建）"""
+        self.memory_store.pop(conversation_id)
+    
+    def memory_stats(self) -> Dict:
+        """获取会话记忆缓存统计"""
+        return self.memory_store.stats()
     
     def create_prompt_template(self, system_prompt: str) -> ChatPromptTemplate:
         """创建提示词模板"""
+        # 系统提示词作为字面消息，避免角色设定中的花括号被当作模板变量
         return ChatPromptTemplate.from_messages([
-            SystemMessagePromptTemplate.from_template(system_prompt),
+            SystemMessage(content=system_prompt),
             MessagesPlaceholder(variable_name="chat_history"),
             HumanMessagePromptTemplate.from_template("{input}")
         ])
     
+    def get_prompt_template(
+        self,
+        system_prompt: str,
+        session_prompt: Optional[str],
+        language_instruction: str,
+        character_id: Optional[str] = None
+    ) -> _PromptEntry:
+        """获取（或编译并缓存）提示词模板"""
+        digest = hashlib.sha256(
+            "\x00".join((system_prompt, session_prompt or "", language_instruction)).encode("utf-8")
+        ).hexdigest()
+        key = (character_id, digest)
+        
+        entry = self.prompt_cache.get(key)
+        if entry is None:
+            full_prompt = system_prompt
+            if session_prompt:
+                full_prompt += f"\n\n{session_prompt}"
+            full_prompt += f"\n\n{language_instruction}"
+            
+            template = self.create_prompt_template(full_prompt)
+            system_messages = template.format_messages(chat_history=[], input="")[:-1]
+            system_tokens = sum(token_counter.count_message(msg) for msg in system_messages)
+            entry = _PromptEntry(template, system_messages, system_tokens)
+            self.prompt_cache.put(key, entry)
+        return entry
+    
+    def invalidate_character(self, character_id: str) -> int:
+        """角色被修改或删除后清除其提示词模板缓存，返回清除数量"""
+        keys = [key for key in self.prompt_cache if key[0] == character_id]
+        for key in keys:
+            self.prompt_cache.pop(key)
+        return len(keys)
+    
+    def prompt_cache_stats(self) -> Dict:
+        """获取提示词模板缓存统计"""
+        return self.prompt_cache.stats()
+    
     async def generate_response(
         self,
         conversation_id: str,
         user_input: str,
         system_prompt: str,
+        session_prompt: Optional[str] = None,
+        character_id: Optional[str] = None,
+        db: Optional[Session] = None,
+        user_message_id: Optional[str] = None,
+        ai_message_id: Optional[str] = None,
+        summary: Optional[str] = None,
+        summary_checkpoint: Optional[int] = None,
         **kwargs
     ) -> AsyncGenerator[str, None]:
-        """生成流式响应"""
-        if not self.llm:
+        """生成流式响应
+        
+        system_prompt为角色设定，session_prompt为会话设定，两者与语言指令一起
+        按character_id缓存编译好的提示词模板。传入db时会校验并按需从数据库重建会话记忆；
+        user_message_id和ai_message_id为本轮刚写入的消息，重建时排除，生成完成后
+        ai_message_id成为记忆的最新消息。
+        summary为滚动摘要，代替summary_checkpoint之前的历史消息放入上下文。
+        """
+        if not self.router.is_available():
             yield "AI服务暂不可用，请稍后重试。"
             return
         
         try:
             # 检测用户输入的语言
-            detected_language = self.detect_language(user_input)
+            detected_language = language_detector.detect(conversation_id, user_input)
             language_instruction = self.get_language_instruction(detected_language)
             
-            # 将语言指令添加到系统提示词中
-            enhanced_system_prompt = f"{system_prompt}\n\n{language_instruction}"
+            # 角色设定、会话设定和语言指令组成系统提示词（模板已缓存）
+            prompt = self.get_prompt_template(
+                system_prompt,
+                session_prompt,
+                language_instruction,
+                character_id=character_id
+            )
             
-            memory = self.get_memory(conversation_id)
-            prompt_template = self.create_prompt_template(enhanced_system_prompt)
+            memory = await self._current_memory(
+                conversation_id,
+                db=db,
+                exclude_message_ids=(user_message_id, ai_message_id),
+                summary_checkpoint=summary_checkpoint if summary else None
+            )
             
-            # 构建完整提示词
-            messages = prompt_template.format_messages(
-                input=user_input,
-                chat_history=memory.chat_memory.messages
+            # 构建完整提示词，历史消息按token预算截取最近的部分
+            system_messages = prompt.system_messages
+            if summary:
+                system_messages = system_messages + [SystemMessage(content=f"此前的对话摘要：{summary}")]
+            input_message = HumanMessage(content=user_input)
+            fixed_tokens = (
+                sum(token_counter.count_message(msg) for msg in system_messages[len(prompt.system_messages):])
+                + prompt.system_tokens
+                + token_counter.count_message(input_message)
+            )
+            history = select_history_window(
+                memory.chat_memory.messages,
+                ContextBudget().history_budget(fixed_tokens),
+                token_counter.count_message
             )
+            messages = system_messages + history + [input_message]
             
-            # 流式生成响应
-            response = ""
-            async for chunk in self.llm.astream(messages):
-                if chunk.content:
-                    response += chunk.content
-                    yield chunk.content
+            # 流式生成响应（经多后端路由，首token前失败会自动切换后端）
+            response_parts = []
+            async for chunk in self.router.stream_chat(
+                to_openai_messages(messages),
+                temperature=0.7
+            ):
+                response_parts.append(chunk)
+                yield chunk
             
             # 更新记忆
             memory.chat_memory.add_user_message(user_input)
-            memory.chat_memory.add_ai_message(response)
+            memory.chat_memory.add_ai_message("".join(response_parts))
+            entry = self.memory_store.peek(conversation_id)
+            if entry is not None and entry.memory is memory:
+                entry.head_message_id = ai_message_id
+                self.memory_store.resize(conversation_id)
             
+        except RateLimitExceeded:
+            yield "当前AI请求较多，请稍后重试。"
         except Exception as e:
             yield f"抱歉，AI服务出现错误：{str(e)}"
     
     async def generate_summary(
         self,
         conversation_id: str,
-        max_length: int = 100
+        max_length: int = 100,
+        previous_summary: Optional[str] = None
     ) -> str:
-        """生成会话摘要"""
+        """生成会话摘要（传入previous_summary时在其基础上增量合并）"""
         if not self.llm:
             return "会话摘要"
         
         try:
-            memory = self.get_memory(conversation_id)
+            memory = await self._current_memory(conversation_id)
             messages = memory.chat_memory.messages
             
             if not messages:
@@ -178,6 +394,8 @@ class LangChainAIService:
             # 将消息转换为文档
             text = "\n".join([f"{msg.type}: {msg.content}" for msg in messages[-10:]])
             docs = [Document(page_content=text)]
+            if previous_summary:
+                docs.insert(0, Document(page_content=f"此前的摘要：{previous_summary}"))
             
             # 生成摘要
             chain = load_summarize_chain(self.llm, chain_type="stuff")
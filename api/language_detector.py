@@ -0,0 +1,108 @@
+"""单次扫描的语言检测
+
+预先把各文字的码位区间编译成一张 str.translate 查找表：区间内的字符映射为单字符文字标记，
+ASCII字符映射为删除。检测时对输入只做一次C层扫描，得到的标记串很短（纯英文时为空），
+再在其上统计各标记数量，即可一次得到全部文字的字符数。
+"""
+
+from typing import Dict, Optional
+from cache_utils import BoundedLRUCache
+
+# (起始码位, 结束码位, 文字)
+SCRIPT_RANGES = (
+    (0x0400, 0x04FF, "ru"),  # 西里尔字母
+    (0x0600, 0x06FF, "ar"),  # 阿拉伯字母
+    (0x3040, 0x309F, "ja"),  # 平假名
+    (0x30A0, 0x30FF, "ja"),  # 片假名
+    (0x4E00, 0x9FFF, "zh"),  # 中日韩统一表意文字
+    (0xAC00, 0xD7AF, "ko"),  # 韩文音节
+)
+
+# 按优先级排列的判定阈值（与原有实现一致）
+LANGUAGE_THRESHOLDS = (
+    ("zh", 0.3),
+    ("ja", 0.2),
+    ("ko", 0.2),
+    ("ru", 0.2),
+    ("ar", 0.2),
+)
+
+DEFAULT_LANGUAGE = "en"
+
+_SCRIPT_MARKS = {"zh": "z", "ja": "j", "ko": "k", "ru": "r", "ar": "a"}
+
+
+def _build_script_table() -> Dict[int, Optional[str]]:
+    """构建码位 -> 文字标记的查找表
+
+    表中没有的其他非ASCII字符（标点、emoji等）translate时保持原样，统计时会被忽略。
+    """
+    table: Dict[int, Optional[str]] = dict.fromkeys(range(128))
+    for start, end, script in SCRIPT_RANGES:
+        mark = _SCRIPT_MARKS[script]
+        for code_point in range(start, end + 1):
+            table[code_point] = mark
+    return table
+
+
+_SCRIPT_TABLE = _build_script_table()
+
+
+def count_scripts(text: str) -> Dict[str, int]:
+    """单次扫描统计各文字的字符数"""
+    if not text:
+        return dict.fromkeys(_SCRIPT_MARKS, 0)
+
+    marks = text.translate(_SCRIPT_TABLE)
+    return {script: marks.count(mark) for script, mark in _SCRIPT_MARKS.items()}
+
+
+def detect_language(text: str) -> str:
+    """检测文本语言"""
+    if not text:
+        return DEFAULT_LANGUAGE
+
+    counts = count_scripts(text)
+    total_chars = len(text)
+    for language, threshold in LANGUAGE_THRESHOLDS:
+        if counts[language] / total_chars > threshold:
+            return language
+    return DEFAULT_LANGUAGE
+
+
+class ConversationLanguageDetector:
+    """按会话记录语言的检测器
+
+    每轮都对全文检测（count_scripts 只是一次C层扫描），结果与原实现完全一致；按会话
+    记录上次的语言，用于统计对话中途切换语言的次数。
+    """
+
+    def __init__(self, max_conversations: int = 10000):
+        # conversation_id -> 上次检测到的语言
+        self._languages = BoundedLRUCache(max_entries=max_conversations)
+        self.detections = 0
+        self.language_switches = 0
+
+    def detect(self, conversation_id: Optional[str], text: str) -> str:
+        language = detect_language(text)
+        self.detections += 1
+        if conversation_id:
+            previous = self._languages.get(conversation_id)
+            if previous is not None and previous != language:
+                self.language_switches += 1
+            self._languages.put(conversation_id, language)
+        return language
+
+    def forget(self, conversation_id: str):
+        self._languages.pop(conversation_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "conversations": len(self._languages),
+            "detections": self.detections,
+            "language_switches": self.language_switches
+        }
+
+
+# 全局检测器实例
+language_detector = ConversationLanguageDetector()
@@ -0,0 +1,120 @@
+"""列表总数缓存
+
+列表接口的总数可以通过 count 参数选择：
+    exact      精确总数，按过滤条件短时缓存（默认）
+    estimated  估算总数，只用于未过滤的公开角色列表：进程内维护的计数，新建/删除/
+               公开状态变化时增减，每隔一段时间用 COUNT(*) 校准；其他列表按 exact 处理
+    none       不计算总数（只需要翻页时使用）
+
+插入或删除记录后按表（和作用域，例如会话ID）作废对应的缓存总数。多个worker之间
+不共享缓存，缓存时间和校准间隔限制了其他worker写入造成的偏差。
+"""
+
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+from cache_utils import BoundedLRUCache
+from config import settings
+
+COUNT_MODES = "^(exact|estimated|none)$"
+
+# invalidate() 不限作用域
+ALL_SCOPES = object()
+
+
+class ListTotals:
+    """按 (表, 作用域, 过滤条件) 缓存列表总数"""
+
+    def __init__(
+        self,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        estimate_refresh_seconds: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.ttl_seconds = settings.list_total_cache_ttl_seconds if ttl_seconds is None else ttl_seconds
+        self.estimate_refresh_seconds = (
+            settings.list_total_estimate_refresh_seconds
+            if estimate_refresh_seconds is None else estimate_refresh_seconds
+        )
+        self._clock = clock
+        # key -> (总数, 计算时间)；过期按计算时间判断，不因读取而延长
+        self._cache = BoundedLRUCache(max_entries=max_entries or settings.list_total_cache_max_entries)
+        # 每次作废递增，计数期间表被修改时不缓存结果
+        self._generations: Dict[str, int] = {}
+        # 估算计数：name -> [总数, 校准时间]
+        self._estimates: Dict[str, List[Any]] = {}
+
+        self.hits = 0
+        self.queries = 0
+        self.invalidations = 0
+        self.estimate_refreshes = 0
+
+    @staticmethod
+    async def _count(db: AsyncSession, query: Select) -> int:
+        return await db.scalar(select(func.count()).select_from(query.order_by(None).subquery()))
+
+    async def count(
+        self,
+        db: AsyncSession,
+        query: Select,
+        table: str,
+        scope: Hashable = None,
+        key: Hashable = ()
+    ) -> int:
+        """query 的总数，缓存未过期时直接返回"""
+        cache_key = (table, scope, key)
+        entry = self._cache.get(cache_key)
+        if entry is not None and self._clock() - entry[1] <= self.ttl_seconds:
+            self.hits += 1
+            return entry[0]
+
+        generation = self._generations.get(table, 0)
+        total = await self._count(db, query)
+        self.queries += 1
+        if self._generations.get(table, 0) == generation:
+            self._cache.put(cache_key, (total, self._clock()))
+        return total
+
+    async def estimate(self, db: AsyncSession, query: Select, name: str) -> int:
+        """维护中的估算计数，首次使用或超过校准间隔时重新计数"""
+        entry = self._estimates.get(name)
+        if entry is None or self._clock() - entry[1] > self.estimate_refresh_seconds:
+            total = await self._count(db, query)
+            self.estimate_refreshes += 1
+            entry = self._estimates[name] = [total, self._clock()]
+        return entry[0]
+
+    def adjust(self, name: str, delta: int):
+        """记录增减时更新估算计数（尚未计数过时忽略）"""
+        entry = self._estimates.get(name)
+        if entry is not None:
+            entry[0] = max(0, entry[0] + delta)
+
+    def invalidate(self, table: str, scope: Hashable = ALL_SCOPES) -> int:
+        """表中有记录插入或删除，作废其缓存总数，返回作废条数"""
+        self._generations[table] = self._generations.get(table, 0) + 1
+        self.invalidations += 1
+        keys = [
+            key for key in self._cache
+            if key[0] == table and (scope is ALL_SCOPES or key[1] == scope)
+        ]
+        for key in keys:
+            self._cache.pop(key)
+        return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._cache),
+            "hits": self.hits,
+            "queries": self.queries,
+            "invalidations": self.invalidations,
+            "estimates": {name: entry[0] for name, entry in self._estimates.items()},
+            "estimate_refreshes": self.estimate_refreshes
+        }
+
+
+# 全局列表总数实例
+list_totals = ListTotals()
@@ -0,0 +1,494 @@
+"""多提供方LLM路由
+
+持有多个OpenAI兼容后端（各自的 base_url、key、模型和权重），按滚动统计的首token
+延迟（EWMA）、错误率和当前并发为每个请求挑选最健康、最快的后端。后端在产出第一个
+token之前失败（连接错误、HTTP错误、首token超时）时自动切换到下一个后端；连续失败
+的后端会被短暂熔断。
+
+可选的对冲模式：请求超过该后端首token延迟的百分位仍无内容时，向下一个候选后端（没有
+则同一后端）补发一个相同请求，先产出token的请求胜出，另一个被取消。
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Tuple
+from openai import AsyncOpenAI, RateLimitError
+from config import settings
+from context_window import token_counter
+from http_client import get_http_client
+from metrics import percentile
+from rate_limiter import RateLimitExceeded, Reservation, UpstreamRateLimiter, upstream_rate_limiter
+from replay_provider import RecordingClient, ReplayClient
+from response_cache import ResponseCache, response_cache, response_cache_key
+from single_flight import SingleFlight, single_flight
+
+logger = logging.getLogger(__name__)
+
+
+class NoBackendAvailable(Exception):
+    """没有可用的LLM后端"""
+
+
+class LLMBackend:
+    """单个OpenAI兼容后端及其滚动健康统计"""
+
+    def __init__(
+        self,
+        name: str,
+        api_key: str,
+        model: Optional[str] = None,
+        base_url: Optional[str] = None,
+        weight: float = 1.0,
+        client: Optional[Any] = None
+    ):
+        self.name = name
+        self.model = model or settings.default_ai_model
+        self.base_url = base_url
+        self.weight = weight if weight and weight > 0 else 1.0
+        # 重试由路由负责，客户端不再自行重试
+        self.client = client or AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=get_http_client(),
+            max_retries=0
+        )
+
+        self.ewma_ttft: Optional[float] = None
+        self.ttft_samples = deque(maxlen=200)
+        self.outcomes = deque(maxlen=settings.llm_router_error_window)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def score(self) -> float:
+        """越小越好；尚无延迟数据的后端得分为0，会被优先探测
+
+        错误率按首token超时折算为等效延迟，保证不断失败的后端排在健康后端之后。
+        """
+        ttft = (self.ewma_ttft or 0.0) + self.error_rate * settings.llm_first_token_timeout
+        return ttft * (1 + 0.5 * self.in_flight) / self.weight
+
+    def record_success(self, ttft: float):
+        alpha = settings.llm_router_ewma_alpha
+        self.ewma_ttft = ttft if self.ewma_ttft is None else alpha * ttft + (1 - alpha) * self.ewma_ttft
+        self.ttft_samples.append(ttft)
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+
+    def hedge_delay(self) -> float:
+        """等待多久仍无首token时补发对冲请求"""
+        if len(self.ttft_samples) < settings.llm_hedge_min_samples:
+            return settings.llm_hedge_default_delay
+        return max(
+            percentile(self.ttft_samples, settings.llm_hedge_percentile),
+            settings.llm_hedge_min_delay
+        )
+
+    def record_failure(self, now: float):
+        self.failures += 1
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= settings.llm_router_failure_threshold:
+            self.open_until = now + settings.llm_router_cooldown_seconds
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "base_url": self.base_url,
+            "weight": self.weight,
+            "ewma_ttft_ms": self.ewma_ttft * 1000 if self.ewma_ttft is not None else None,
+            "error_rate": self.error_rate,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "circuit_open": self.open_until > time.monotonic()
+        }
+
+
+def _chunk_content(chunk) -> Optional[str]:
+    if not chunk.choices:
+        return None
+    return chunk.choices[0].delta.content
+
+
+class LLMRouter:
+    """按延迟和健康度在多个后端之间路由并在首token前失败时切换"""
+
+    def __init__(
+        self,
+        backends: List[LLMBackend],
+        first_token_timeout: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        hedge: Optional[bool] = None,
+        cache: Optional[ResponseCache] = None,
+        coalescer: Optional[SingleFlight] = None,
+        rate_limiter: Optional[UpstreamRateLimiter] = None
+    ):
+        self.backends = backends
+        self.cache = cache
+        self.coalescer = coalescer
+        self.rate_limiter = rate_limiter
+        self.first_token_timeout = first_token_timeout or settings.llm_first_token_timeout
+        self.hedge_enabled = settings.llm_hedge_enabled if hedge is None else hedge
+        self._clock = clock
+        self.requests = 0
+        self.failovers = 0
+        # 对冲统计：补发次数、补发请求胜出次数、额外消耗的token
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedge_prompt_tokens = 0
+        self.hedge_completion_tokens = 0
+
+    def is_available(self) -> bool:
+        return bool(self.backends)
+
+    def ranked_backends(self) -> List[LLMBackend]:
+        """按得分排序的候选后端，熔断中的后端排除（全部熔断时仍全部尝试）"""
+        now = self._clock()
+        healthy = [backend for backend in self.backends if backend.open_until <= now]
+        return sorted(healthy or self.backends, key=lambda backend: backend.score())
+
+    async def _reserve(self, backend: LLMBackend, messages, model, params) -> Optional[Reservation]:
+        """按后端的RPM/TPM预算预留额度，未配置预算时返回 None"""
+        limit = self.rate_limiter.get(backend.name, model or backend.model) if self.rate_limiter else None
+        if limit is None:
+            return None
+        prompt_tokens = sum(token_counter.count_message(message) for message in messages)
+        completion_tokens = params.get("max_tokens") or settings.llm_rate_limit_completion_estimate
+        reservation = await limit.acquire(prompt_tokens + completion_tokens)
+        reservation.prompt_tokens = prompt_tokens
+        return reservation
+
+    def _release_on_error(self, reservation: Optional[Reservation], error: BaseException):
+        """请求失败时退回预留的token；上游429说明预算已耗尽，清空余额
+
+        被取消（对冲落败、客户端断开）时请求可能已经发出，按提示词token结算。
+        """
+        if reservation is None:
+            return
+        if isinstance(error, RateLimitError):
+            reservation.limit.drain()
+        reservation.settle(0 if isinstance(error, Exception) else reservation.prompt_tokens)
+
+    async def _open_stream(self, backend: LLMBackend, messages, model, **params):
+        """建立流式请求并等待第一个有内容的块，返回 (stream, iterator, 首块内容)"""
+        if settings.llm_stream_include_usage:
+            params.setdefault("stream_options", {"include_usage": True})
+        stream = await backend.client.chat.completions.create(
+            model=model or backend.model,
+            messages=messages,
+            stream=True,
+            **params
+        )
+        iterator = stream.__aiter__()
+        try:
+            while True:
+                try:
+                    chunk = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return stream, iterator, None
+                content = _chunk_content(chunk)
+                if content:
+                    return stream, iterator, content
+        except BaseException:
+            await stream.close()
+            raise
+
+    async def _attempt(self, backend: LLMBackend, messages, model, params):
+        """请求单个后端直到首个内容块，返回 (stream, iterator, 首块内容, 预留额度)
+
+        成功时后端的 in_flight 和预留额度由调用方在流结束后释放。
+        """
+        reservation = await self._reserve(backend, messages, model, params)
+        backend.requests += 1
+        backend.in_flight += 1
+        started = self._clock()
+        try:
+            stream, iterator, first = await self._open_stream(backend, messages, model, **dict(params))
+        except BaseException as e:
+            backend.in_flight -= 1
+            self._release_on_error(reservation, e)
+            raise
+        backend.record_success(self._clock() - started)
+        return stream, iterator, first, reservation
+
+    def _record_failure(self, backend: LLMBackend, error: BaseException):
+        # 本地预算不足不代表后端不健康，只切换不计失败
+        if not isinstance(error, RateLimitExceeded):
+            backend.record_failure(self._clock())
+        self.failovers += 1
+        logger.warning(f"LLM后端 {backend.name} 首token前失败，尝试下一个后端: {error!r}")
+
+    async def _first_chunk(
+        self,
+        messages,
+        model,
+        params
+    ) -> Tuple[LLMBackend, Any, Any, Optional[str], Optional[Reservation]]:
+        """按排名请求后端直到拿到首个内容块，返回 (后端, stream, iterator, 首块内容, 预留额度)
+
+        同一时刻只有一个请求在途；启用对冲时每次生成最多补发一个请求，两者并行等待。
+        """
+        loop = asyncio.get_running_loop()
+        candidates = self.ranked_backends()
+        pending: Dict[asyncio.Task, Tuple[LLMBackend, float]] = {}
+        launched: Dict[asyncio.Task, LLMBackend] = {}
+        hedge_task: Optional[asyncio.Task] = None
+        hedge_at: Optional[float] = None
+        last_error: Optional[BaseException] = None
+
+        def launch(backend: LLMBackend) -> asyncio.Task:
+            task = asyncio.create_task(self._attempt(backend, messages, model, params))
+            pending[task] = (backend, loop.time() + self.first_token_timeout)
+            launched[task] = backend
+            return task
+
+        try:
+            while pending or candidates:
+                if not pending:
+                    backend = candidates.pop(0)
+                    launch(backend)
+                    if self.hedge_enabled and hedge_task is None:
+                        hedge_at = loop.time() + backend.hedge_delay()
+
+                wake = min(deadline for _, deadline in pending.values())
+                if hedge_at is not None:
+                    wake = min(wake, hedge_at)
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=max(wake - loop.time(), 0),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+
+                for task in done:
+                    backend, _ = pending.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        if task is hedge_task:
+                            self.hedge_wins += 1
+                        del launched[task]
+                        return (backend, *task.result())
+                    last_error = error
+                    self._record_failure(backend, error)
+
+                now = loop.time()
+                for task, (backend, deadline) in list(pending.items()):
+                    if deadline <= now:
+                        del pending[task]
+                        task.cancel()
+                        last_error = asyncio.TimeoutError(f"LLM后端 {backend.name} 首token超时")
+                        self._record_failure(backend, last_error)
+
+                if hedge_at is not None and now >= hedge_at and len(pending) == 1:
+                    primary = next(iter(pending.values()))[0]
+                    hedge_task = launch(candidates.pop(0) if candidates else primary)
+                    hedge_at = None
+                    self.hedges += 1
+                    self.hedge_prompt_tokens += sum(token_counter.count_message(m) for m in messages)
+                elif not pending:
+                    hedge_at = None
+        finally:
+            # 取消落败或超时的请求；与胜出者几乎同时拿到首块的请求需要关闭其流
+            leftovers = list(launched)
+            for task in leftovers:
+                task.cancel()
+            results = await asyncio.gather(*leftovers, return_exceptions=True)
+            for task, result in zip(leftovers, results):
+                if isinstance(result, tuple):
+                    stream, _, first, reservation = result
+                    launched[task].in_flight -= 1
+                    wasted = token_counter.count(first or "")
+                    self.hedge_completion_tokens += wasted
+                    if reservation is not None:
+                        reservation.settle(reservation.prompt_tokens + wasted)
+                    await stream.close()
+
+        raise last_error or NoBackendAvailable("没有可用的LLM后端")
+
+    async def stream_chat(
+        self,
+        messages: List[Dict[str, str]],
+        model: Optional[str] = None,
+        **params
+    ) -> AsyncGenerator[str, None]:
+        """流式生成，逐块产出文本内容
+
+        model 为空时使用各后端配置的模型；其余参数（temperature、max_tokens等）原样透传。
+        启用回复缓存时，模型、消息列表和生成参数都相同的请求直接回放缓存的分块；启用请求合并时，
+        同一键的并发请求共用一次上游流。
+        """
+        cache = self.cache if self.cache is not None and self.cache.enabled else None
+        coalescer = self.coalescer if self.coalescer is not None and self.coalescer.enabled else None
+        if cache is None and coalescer is None:
+            async for chunk in self._stream_upstream(messages, model, **params):
+                yield chunk
+            return
+
+        key = response_cache_key(
+            model or ",".join(sorted({backend.model for backend in self.backends})),
+            messages,
+            params
+        )
+        generate = lambda: self._stream_upstream(messages, model, **params)
+        if coalescer is not None:
+            upstream = generate
+            generate = lambda: coalescer.stream(key, upstream)
+        if cache is not None:
+            stream = cache.stream(key, generate)
+        else:
+            stream = generate()
+        async for chunk in stream:
+            yield chunk
+
+    async def _stream_upstream(
+        self,
+        messages: List[Dict[str, str]],
+        model: Optional[str] = None,
+        **params
+    ) -> AsyncGenerator[str, None]:
+        self.requests += 1
+        backend, stream, iterator, first, reservation = await self._first_chunk(messages, model, params)
+        outputs: List[str] = []
+        usage_tokens: Optional[int] = None
+
+        try:
+            if first is not None:
+                outputs.append(first)
+                yield first
+            async for chunk in iterator:
+                if getattr(chunk, "usage", None) is not None:
+                    usage_tokens = chunk.usage.total_tokens
+                content = _chunk_content(chunk)
+                if content:
+                    outputs.append(content)
+                    yield content
+        except Exception:
+            # 已经输出内容后无法切换，只记录失败
+            backend.record_failure(self._clock())
+            raise
+        finally:
+            backend.in_flight -= 1
+            if reservation is not None:
+                # 上游未返回 usage 时按提示词加已输出内容估算
+                if usage_tokens is None:
+                    usage_tokens = reservation.prompt_tokens + token_counter.count("".join(outputs))
+                reservation.settle(usage_tokens)
+            await stream.close()
+
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        model: Optional[str] = None,
+        **params
+    ) -> str:
+        """非流式生成，失败时依次尝试其他后端"""
+        last_error: Optional[BaseException] = None
+
+        for backend in self.ranked_backends():
+            reservation = None
+            try:
+                reservation = await self._reserve(backend, messages, model, params)
+                backend.requests += 1
+                backend.in_flight += 1
+                started = self._clock()
+                try:
+                    response = await backend.client.chat.completions.create(
+                        model=model or backend.model,
+                        messages=messages,
+                        **params
+                    )
+                finally:
+                    backend.in_flight -= 1
+            except Exception as e:
+                self._release_on_error(reservation, e)
+                self._record_failure(backend, e)
+                last_error = e
+                continue
+            except BaseException as e:
+                self._release_on_error(reservation, e)
+                raise
+
+            backend.record_success(self._clock() - started)
+            if reservation is not None:
+                reservation.settle(response.usage.total_tokens if response.usage else None)
+            return response.choices[0].message.content or ""
+
+        raise last_error or NoBackendAvailable("没有可用的LLM后端")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "failovers": self.failovers,
+            "hedging": {
+                "enabled": self.hedge_enabled,
+                "hedges": self.hedges,
+                "hedge_rate": self.hedges / self.requests if self.requests else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "win_rate": self.hedge_wins / self.hedges if self.hedges else 0.0,
+                "extra_prompt_tokens": self.hedge_prompt_tokens,
+                "extra_completion_tokens": self.hedge_completion_tokens
+            },
+            "backends": [backend.stats() for backend in self.backends]
+        }
+
+
+def build_backends() -> List[LLMBackend]:
+    """按配置创建后端列表
+
+    配置了 llm_backends 时使用其中的多个后端，否则沿用 ai_service_provider 指定的单个提供方。
+    ai_service_provider 为 "replay" 时只使用磁带回放后端；为 "record" 时照常访问真实
+    提供方（单个提供方由 llm_record_provider 指定），并把每次调用录制到磁带。
+    """
+    if settings.ai_service_provider == "replay":
+        return [LLMBackend(name="replay", api_key="", client=ReplayClient())]
+
+    backends = []
+    for index, config in enumerate(settings.llm_backends):
+        backends.append(LLMBackend(
+            name=config.get("name") or f"backend-{index}",
+            api_key=config.get("api_key", ""),
+            model=config.get("model"),
+            base_url=config.get("base_url"),
+            weight=float(config.get("weight", 1.0))
+        ))
+
+    if not backends:
+        provider = settings.ai_service_provider
+        if provider == "record":
+            provider = settings.llm_record_provider
+        if provider == "openrouter" and settings.openrouter_api_key:
+            backends.append(LLMBackend(
+                name="openrouter",
+                api_key=settings.openrouter_api_key,
+                base_url="https://openrouter.ai/api/v1"
+            ))
+        elif provider == "openai" and settings.openai_api_key:
+            backends.append(LLMBackend(
+                name="openai",
+                api_key=settings.openai_api_key
+            ))
+
+    if settings.ai_service_provider == "record":
+        for backend in backends:
+            backend.client = RecordingClient(backend.client)
+    return backends
+
+
+# 全局路由实例
+llm_router = LLMRouter(
+    build_backends(),
+    cache=response_cache,
+    coalescer=single_flight,
+    rate_limiter=upstream_rate_limiter
+)
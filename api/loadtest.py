@@ -0,0 +1,326 @@
+"""端到端SSE压测工具
+
+在本进程内启动OpenAI兼容的模拟流式服务（可配置首token延迟、输出速度和错误率），
+以子进程方式启动本应用并指向该模拟服务，然后按目标并发数驱动
+POST /api/messages/conversations/{id}/messages，统计首token延迟、token间隔、
+总耗时分位数、吞吐量以及服务进程的CPU和内存，以JSON输出便于对比多次运行：
+
+    python loadtest.py --concurrency 50 --requests 500 --ttft 0.2 --tps 50 --output result.json
+
+每个虚拟用户创建一个游客会话并在其中连续发送消息。压测使用临时SQLite数据库，
+不会修改本地数据。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+import httpx
+from metrics import percentile
+from mock_llm_server import MockLLMConfig, MockLLMServer
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ProcessSampler:
+    """采样子进程的CPU时间和常驻内存（优先psutil，否则读取/proc）"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self._process = psutil.Process(pid) if psutil else None
+        self.rss_samples: List[int] = []
+
+    def cpu_seconds(self) -> Optional[float]:
+        if self._process is not None:
+            times = self._process.cpu_times()
+            return times.user + times.system
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def rss_bytes(self) -> Optional[int]:
+        if self._process is not None:
+            return self._process.memory_info().rss
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError):
+            return None
+        return None
+
+    def sample(self):
+        rss = self.rss_bytes()
+        if rss is not None:
+            self.rss_samples.append(rss)
+
+
+def _summary(values: List[float]) -> Dict[str, Any]:
+    """毫秒为单位的分位数"""
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) * 1000,
+        "p50": percentile(values, 50) * 1000,
+        "p90": percentile(values, 90) * 1000,
+        "p99": percentile(values, 99) * 1000,
+        "max": max(values) * 1000
+    }
+
+
+class LoadResult:
+    def __init__(self):
+        self.ttft: List[float] = []
+        self.inter_token: List[float] = []
+        self.total: List[float] = []
+        self.completed = 0
+        self.errors = 0
+        self.rejected = 0
+        self.content_events = 0
+        self.content_chars = 0
+
+
+async def _send(client: httpx.AsyncClient, conversation_id: str, content: str, result: LoadResult):
+    started = time.perf_counter()
+    last = None
+    try:
+        async with client.stream(
+            "POST",
+            f"/api/messages/conversations/{conversation_id}/messages",
+            json={"content": content}
+        ) as response:
+            if response.status_code == 429:
+                result.rejected += 1
+                return
+            if response.status_code != 200:
+                result.errors += 1
+                return
+            failed = False
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data = line[6:]
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                if event.get("type") == "content":
+                    now = time.perf_counter()
+                    if last is None:
+                        result.ttft.append(now - started)
+                    else:
+                        result.inter_token.append(now - last)
+                    last = now
+                    result.content_events += 1
+                    result.content_chars += len(event.get("content", ""))
+                elif event.get("type") == "error":
+                    failed = True
+    except httpx.HTTPError:
+        result.errors += 1
+        return
+
+    if failed:
+        result.errors += 1
+    else:
+        result.completed += 1
+        result.total.append(time.perf_counter() - started)
+
+
+async def _virtual_user(
+    client: httpx.AsyncClient,
+    user_id: int,
+    character_id: str,
+    counter: Dict[str, int],
+    total_requests: int,
+    result: LoadResult
+):
+    response = await client.post("/api/messages/conversations", json={"character_id": character_id})
+    response.raise_for_status()
+    conversation_id = response.json()["id"]
+    turn = 0
+    while counter["sent"] < total_requests:
+        counter["sent"] += 1
+        turn += 1
+        # 每条消息内容不同，避免被回复缓存或请求合并吸收
+        await _send(client, conversation_id, f"你好，我是用户{user_id}，这是第{turn}条消息。", result)
+
+
+async def _drive(base_url: str, concurrency: int, total_requests: int, sampler: ProcessSampler) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2)
+    timeout = httpx.Timeout(120.0, connect=10.0)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        characters = (await client.get("/api/characters/")).json()["characters"]
+        character_id = characters[0]["id"]
+
+        result = LoadResult()
+        counter = {"sent": 0}
+        stop = asyncio.Event()
+
+        async def sample_loop():
+            while not stop.is_set():
+                sampler.sample()
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=0.2)
+                except asyncio.TimeoutError:
+                    pass
+
+        cpu_before = sampler.cpu_seconds()
+        started = time.perf_counter()
+        sampling = asyncio.create_task(sample_loop())
+        await asyncio.gather(*[
+            _virtual_user(client, user_id, character_id, counter, total_requests, result)
+            for user_id in range(concurrency)
+        ])
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await sampling
+        cpu_after = sampler.cpu_seconds()
+
+    cpu_seconds = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    rss = sampler.rss_samples
+    return {
+        "requests": counter["sent"],
+        "completed": result.completed,
+        "errors": result.errors,
+        "rejected_429": result.rejected,
+        "elapsed_seconds": elapsed,
+        "throughput": {
+            "requests_per_second": result.completed / elapsed if elapsed else 0.0,
+            "content_events_per_second": result.content_events / elapsed if elapsed else 0.0,
+            "chars_per_second": result.content_chars / elapsed if elapsed else 0.0
+        },
+        "ttft_ms": _summary(result.ttft),
+        "inter_token_ms": _summary(result.inter_token),
+        "total_ms": _summary(result.total),
+        "server": {
+            "cpu_seconds": cpu_seconds,
+            "cpu_percent": cpu_seconds / elapsed * 100 if cpu_seconds is not None and elapsed else None,
+            "rss_mb_max": max(rss) / 1024 / 1024 if rss else None,
+            "rss_mb_end": rss[-1] / 1024 / 1024 if rss else None
+        }
+    }
+
+
+def _start_app(port: int, mock_url: str, database_path: str, concurrency: int, extra_env: Dict[str, str]):
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{database_path}",
+        "AI_SERVICE_PROVIDER": "openai",
+        "OPENAI_API_KEY": "mock",
+        "LLM_BACKENDS": json.dumps([{"name": "mock", "api_key": "mock", "base_url": mock_url, "model": "mock-model"}]),
+        "RESPONSE_CACHE_ENABLED": "false",
+        "DEBUG": "false",
+        # 所有虚拟用户来自同一IP，放开游客并发上限
+        "ADMISSION_MAX_PER_GUEST_IP": str(concurrency),
+        "ADMISSION_MAX_CONCURRENT": str(max(concurrency, 64))
+    })
+    env.update(extra_env)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=API_DIR,
+        env=env
+    )
+
+
+def _wait_ready(base_url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("应用进程启动失败")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("应用启动超时")
+
+
+def run_load_test(
+    concurrency: int = 20,
+    requests: int = 200,
+    ttft: float = 0.2,
+    tokens_per_second: float = 50.0,
+    error_rate: float = 0.0,
+    reply_repeat: int = 4,
+    extra_env: Optional[Dict[str, str]] = None
+) -> Dict[str, Any]:
+    mock_config = MockLLMConfig(
+        ttft=ttft,
+        tokens_per_second=tokens_per_second,
+        error_rate=error_rate,
+        reply="这是一条来自模拟服务的回复。This is a reply from the mock LLM server. " * reply_repeat
+    )
+    with MockLLMServer(mock_config) as mock, tempfile.TemporaryDirectory() as workdir:
+        port = _free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        process = _start_app(port, mock.base_url, os.path.join(workdir, "loadtest.db"), concurrency, extra_env or {})
+        try:
+            _wait_ready(base_url, process)
+            report = asyncio.run(_drive(base_url, concurrency, requests, ProcessSampler(process.pid)))
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    report["config"] = {
+        "concurrency": concurrency,
+        "requests": requests,
+        "mock_ttft": ttft,
+        "mock_tokens_per_second": tokens_per_second,
+        "mock_error_rate": error_rate,
+        "mock_upstream_requests": mock_config.requests
+    }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="端到端SSE压测")
+    parser.add_argument("--concurrency", type=int, default=20, help="并发虚拟用户数")
+    parser.add_argument("--requests", type=int, default=200, help="总消息数")
+    parser.add_argument("--ttft", type=float, default=0.2, help="模拟上游首token延迟（秒）")
+    parser.add_argument("--tps", type=float, default=50.0, help="模拟上游每秒输出的块数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟上游失败概率")
+    parser.add_argument("--reply-repeat", type=int, default=4, help="回复长度（基础回复重复次数）")
+    parser.add_argument("--env", action="append", default=[], help="传给应用进程的额外环境变量 KEY=VALUE")
+    parser.add_argument("--output", help="结果JSON写入的文件")
+    args = parser.parse_args()
+
+    result = run_load_test(
+        concurrency=args.concurrency,
+        requests=args.requests,
+        ttft=args.ttft,
+        tokens_per_second=args.tps,
+        error_rate=args.error_rate,
+        reply_repeat=args.reply_repeat,
+        extra_env=dict(item.split("=", 1) for item in args.env)
+    )
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
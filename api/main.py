@@ -2,22 +2,47 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 from contextlib import asynccontextmanager
-from database import init_database
+from database import AsyncSessionLocal, async_engine, init_database
+from config import settings
 from routers import auth, characters, conversations, messages
 from ai_service import ai_service
+from langchain_service import langchain_ai_service
+from context_window import token_counter
+from language_detector import language_detector
+from summarizer import conversation_summarizer
+from http_client import close_http_client, http_pool_stats
+from llm_router import llm_router
+from response_cache import response_cache
+from single_flight import single_flight
+from admission import admission_controller
+from rate_limiter import upstream_rate_limiter
+from fast_json import FastJSONResponse
+from stream_buffer import stream_registry
+from list_totals import list_totals
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 启动时初始化数据库
     init_database()
+    # 上次运行中途退出时遗留的回复占位
+    async with AsyncSessionLocal() as db:
+        await db.run_sync(messages.fail_stale_replies)
+    # 启动后台摘要工作池
+    if settings.summary_enabled:
+        await conversation_summarizer.start()
     yield
-    # 关闭时的清理工作（如果需要）
+    # 关闭时的清理工作
+    await conversation_summarizer.stop()
+    await close_http_client()
+    response_cache.close()
+    await async_engine.dispose()
 
 app = FastAPI(
     title="AI角色扮演网站API",
     description="基于FastAPI的AI角色扮演网站后端服务",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 # CORS配置
@@ -43,6 +68,25 @@ async def root():
 async def health_check():
     return {"status": "healthy", "message": "服务运行正常"}
 
+@app.get("/api/ai/stats")
+async def ai_service_stats():
+    """获取AI服务运行统计"""
+    return {
+        "memory_cache": langchain_ai_service.memory_stats(),
+        "prompt_cache": langchain_ai_service.prompt_cache_stats(),
+        "token_counter": token_counter.stats(),
+        "language_detector": language_detector.stats(),
+        "summarizer": conversation_summarizer.stats(),
+        "http_pool": http_pool_stats(),
+        "llm_router": llm_router.stats(),
+        "response_cache": response_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "admission": admission_controller.stats(),
+        "rate_limits": upstream_rate_limiter.stats(),
+        "sse_streams": stream_registry.stats(),
+        "list_totals": list_totals.stats()
+    }
+
 @app.get("/api/ai/test")
 async def test_ai_service():
     """测试AI服务连接"""
@@ -64,7 +108,7 @@ async def test_ai_service():
         return {
             "status": "success",
             "message": "AI服务连接正常",
-            "provider": "openrouter",
+            "provider": ",".join(backend.name for backend in llm_router.backends),
             "test_response": full_response
         }
     except Exception as e:
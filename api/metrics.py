@@ -0,0 +1,36 @@
+"""运行时统计用的小工具"""
+
+import bisect
+from typing import Any, Dict, Iterable, Sequence
+
+
+def percentile(values: Iterable[float], percent: float) -> float:
+    """最近邻法求百分位数，空序列返回0"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Histogram:
+    """固定分桶直方图，桶计数为累计值（小于等于上界的样本数），与Prometheus一致"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self._counts[bisect.bisect_left(self.buckets, value)] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative = 0
+        buckets = []
+        for bound, count in zip(self.buckets + [float("inf")], self._counts):
+            cumulative += count
+            buckets.append({"le": bound if bound != float("inf") else "+Inf", "count": cumulative})
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
@@ -0,0 +1,199 @@
+"""OpenAI兼容的本地模拟流式服务
+
+用于路由、压测等离线测试，可配置首token延迟、输出速度和错误率：
+    python mock_llm_server.py --port 9001 --ttft 0.2 --tps 50 --error-rate 0.1
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from typing import Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+DEFAULT_REPLY = "这是一条来自模拟服务的回复。This is a reply from the mock LLM server."
+
+
+class MockLLMConfig:
+    """模拟服务的行为参数（运行中可修改）"""
+
+    def __init__(
+        self,
+        ttft: float = 0.05,
+        tokens_per_second: float = 100.0,
+        error_rate: float = 0.0,
+        reply: str = DEFAULT_REPLY,
+        chunk_size: int = 2,
+        seed: Optional[int] = None
+    ):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.reply = reply
+        self.chunk_size = chunk_size
+        self.requests = 0
+        self.completed = 0
+        self.cancelled = 0
+        self._random = random.Random(seed)
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and self._random.random() < self.error_rate
+
+
+def _usage(completion_tokens: int) -> dict:
+    return {"prompt_tokens": 10, "completion_tokens": completion_tokens, "total_tokens": 10 + completion_tokens}
+
+
+def _chunk(
+    model: str,
+    content: Optional[str] = None,
+    finish_reason: Optional[str] = None,
+    usage: Optional[dict] = None
+) -> str:
+    delta = {"content": content} if content is not None else {}
+    payload = {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    if usage:
+        payload["usage"] = usage
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def create_mock_app(config: Optional[MockLLMConfig] = None) -> FastAPI:
+    """创建模拟服务应用"""
+    config = config or MockLLMConfig()
+    app = FastAPI(title="Mock LLM")
+    app.state.config = config
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "mock-model")
+        config.requests += 1
+
+        if config.should_fail():
+            await asyncio.sleep(config.ttft)
+            return JSONResponse(
+                status_code=503,
+                content={"error": {"message": "mock upstream unavailable", "type": "server_error"}}
+            )
+
+        reply = config.reply
+        chunks = [reply[i:i + config.chunk_size] for i in range(0, len(reply), config.chunk_size)]
+
+        if not body.get("stream"):
+            await asyncio.sleep(config.ttft + len(chunks) / config.tokens_per_second)
+            config.completed += 1
+            return {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply},
+                    "finish_reason": "stop"
+                }],
+                "usage": _usage(len(chunks))
+            }
+
+        async def stream():
+            try:
+                await asyncio.sleep(config.ttft)
+                interval = 1 / config.tokens_per_second
+                for index, text in enumerate(chunks):
+                    if index:
+                        await asyncio.sleep(interval)
+                    yield _chunk(model, text)
+                yield _chunk(model, finish_reason="stop")
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    yield _chunk(model, usage=_usage(len(chunks)))
+                yield "data: [DONE]\n\n"
+                config.completed += 1
+            except asyncio.CancelledError:
+                config.cancelled += 1
+                raise
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+class MockLLMServer:
+    """在后台线程中运行的模拟服务，port=0 时自动分配端口
+
+    with MockLLMServer(MockLLMConfig(ttft=0.1)) as server:
+        client = AsyncOpenAI(base_url=server.base_url, api_key="mock")
+    """
+
+    def __init__(self, config: Optional[MockLLMConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or MockLLMConfig()
+        self.host = host
+        self.port = port
+        self._server: Optional[uvicorn.Server] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self):
+        uvicorn_config = uvicorn.Config(
+            create_mock_app(self.config),
+            host=self.host,
+            port=self.port,
+            log_level="warning",
+            lifespan="off"
+        )
+        self._server = uvicorn.Server(uvicorn_config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+
+        deadline = time.time() + 10
+        while not self._server.started:
+            if time.time() > deadline:
+                raise RuntimeError("模拟LLM服务启动超时")
+            time.sleep(0.01)
+        self.port = self._server.servers[0].sockets[0].getsockname()[1]
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=5)
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI兼容的模拟流式服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--ttft", type=float, default=0.05, help="首token延迟（秒）")
+    parser.add_argument("--tps", type=float, default=100.0, help="每秒输出的块数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="请求失败概率")
+    args = parser.parse_args()
+
+    uvicorn.run(
+        create_mock_app(MockLLMConfig(
+            ttft=args.ttft,
+            tokens_per_second=args.tps,
+            error_rate=args.error_rate
+        )),
+        host=args.host,
+        port=args.port,
+        log_level="info"
+    )
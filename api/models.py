@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Text, Boolean, Integer, DateTime, ForeignKey, CheckConstraint
+from sqlalchemy import Column, String, Text, Boolean, Integer, DateTime, ForeignKey, CheckConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -30,17 +30,30 @@ class Character(Base):
     __tablename__ = "characters"
     
     id = Column(String(16), primary_key=True, default=generate_id)
-    name = Column(String(100), nullable=False, index=True)
+    name = Column(String(100), nullable=False)
     description = Column(Text, nullable=False)
     system_prompt = Column(Text, nullable=False)
     greeting = Column(Text, nullable=False)
     avatar_url = Column(String(500))
     creator_id = Column(String(16), ForeignKey("users.id"), nullable=False)
-    is_public = Column(Boolean, default=True, index=True)
-    chat_count = Column(Integer, default=0, index=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    is_public = Column(Boolean, default=True)
+    chat_count = Column(Integer, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
+    # 列表的每种排序（键集分页按 (排序键, id)）都有对应的索引，公开角色列表按前缀
+    # is_public 定位后直接按索引顺序读取；登录用户的列表（公开或自己创建）按排序索引
+    # 顺序扫描，"我的角色"按 creator_id 定位
+    __table_args__ = (
+        Index("ix_characters_public_latest", "is_public", "created_at", "id"),
+        Index("ix_characters_public_popular", "is_public", "chat_count", "id"),
+        Index("ix_characters_public_alphabetical", "is_public", "name", "id"),
+        Index("ix_characters_latest", "created_at", "id"),
+        Index("ix_characters_popular", "chat_count", "id"),
+        Index("ix_characters_alphabetical", "name", "id"),
+        Index("ix_characters_creator_latest", "creator_id", "created_at", "id"),
+    )
+    
     # 关系
     creator = relationship("User", back_populates="characters")
     conversations = relationship("Conversation", back_populates="character")
@@ -50,13 +63,19 @@ class Conversation(Base):
     __tablename__ = "conversations"
     
     id = Column(String(16), primary_key=True, default=generate_id)
-    user_id = Column(String(16), ForeignKey("users.id"), nullable=True, index=True)
+    user_id = Column(String(16), ForeignKey("users.id"), nullable=True)
     character_id = Column(String(16), ForeignKey("characters.id"), nullable=False, index=True)
     summary = Column(Text)
+    summary_checkpoint_tokens = Column(Integer)  # 摘要已覆盖到的消息token前缀和
     session_prompt = Column(Text)
-    last_message_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    last_message_at = Column(DateTime(timezone=True), server_default=func.now())
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
+    # 用户的会话列表按最近消息时间倒序
+    __table_args__ = (
+        Index("ix_conversations_user_last_message", "user_id", "last_message_at", "id"),
+    )
+    
     # 关系
     user = relationship("User", back_populates="conversations")
     character = relationship("Character", back_populates="conversations")
@@ -67,14 +86,22 @@ class Message(Base):
     __tablename__ = "messages"
     
     id = Column(String(16), primary_key=True, default=generate_id)
-    conversation_id = Column(String(16), ForeignKey("conversations.id"), nullable=False, index=True)
+    conversation_id = Column(String(16), ForeignKey("conversations.id"), nullable=False)
     role = Column(String(20), nullable=False)
     content = Column(Text, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    token_count = Column(Integer)  # 内容token数
+    cumulative_tokens = Column(Integer)  # 会话内截至本条消息的token前缀和
+    truncated = Column(Boolean, default=False, nullable=False)  # 客户端断开后提前终止，内容不完整
+    status = Column(String(20), default="completed", nullable=False)  # AI回复：generating / completed / failed
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
     
-    # 添加角色检查约束
+    # 添加角色检查约束；会话内的消息按时间顺序读取，按token前缀和选取最近的历史
     __table_args__ = (
         CheckConstraint("role IN ('user', 'assistant', 'system')", name="check_message_role"),
+        Index("ix_messages_conversation_created", "conversation_id", "created_at", "id"),
+        Index("ix_messages_conversation_cumulative", "conversation_id", "cumulative_tokens"),
+        # 查找生成中断（进程退出）后遗留的回复占位
+        Index("ix_messages_status_created", "status", "created_at"),
     )
     
     # 关系
@@ -0,0 +1,126 @@
+"""键集（游标）分页
+
+按 (排序键, id) 定位分页边界：下一页取排在本页最后一条之后的记录，上一页取排在第一条
+之前的记录，查询沿排序索引直接定位到边界，深页与首页的开销相同。
+
+游标是不透明的字符串，编码了排序方式、翻页方向和边界记录的排序键值。DateTime 键保存
+数据库中的原始文本并按原样比较：服务端默认值（无微秒）和Python写入的值（有微秒）
+格式不同，转换成datetime再绑定会导致边界记录重复或遗漏。
+
+原有的 page/limit 参数保持不变：不带游标时按页码偏移查询，响应中同样返回游标，客户端
+可以从任意一页切换到游标翻页。
+"""
+
+import base64
+import binascii
+import json
+from typing import Any, List, Optional, Sequence
+from fastapi import HTTPException, status
+from sqlalchemy import DateTime, String, tuple_, type_coerce
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+NEXT = "next"
+PREV = "prev"
+
+
+def _invalid_cursor() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="分页游标无效"
+    )
+
+
+class KeysetOrder:
+    """一种排序方式：若干同方向的排序列，最后一列必须唯一（通常是id）"""
+
+    def __init__(self, name: str, *columns, descending: bool = False):
+        self.name = name
+        self.columns = columns
+        self.descending = descending
+        # 游标中的键值按数据库中的原始形式读取和比较（不产生CAST，仍可走索引）
+        self.keys = [
+            type_coerce(column, String) if isinstance(column.type, DateTime) else column
+            for column in columns
+        ]
+
+    def order_by(self, reverse: bool = False) -> list:
+        descending = self.descending != reverse
+        return [column.desc() if descending else column.asc() for column in self.columns]
+
+    def beyond(self, values: Sequence[Any], reverse: bool = False):
+        """排在 values 之后（reverse 时为之前）的记录"""
+        keys = tuple_(*self.keys)
+        if self.descending != reverse:
+            return keys < tuple(values)
+        return keys > tuple(values)
+
+    def encode(self, direction: str, values: Sequence[Any]) -> str:
+        raw = json.dumps([self.name, direction, list(values)], ensure_ascii=False, separators=(",", ":"))
+        return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+    def decode(self, cursor: str):
+        """游标 -> (方向, 键值)；格式不对或不属于当前排序方式时返回400"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            name, direction, values = json.loads(raw)
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+            raise _invalid_cursor()
+        if (
+            name != self.name
+            or direction not in (NEXT, PREV)
+            or not isinstance(values, list)
+            or len(values) != len(self.columns)
+        ):
+            raise _invalid_cursor()
+        return direction, values
+
+
+class Page:
+    """一页记录及前后页游标（没有更多记录时为 None）"""
+    __slots__ = ("items", "next_cursor", "prev_cursor")
+
+    def __init__(self, items: List[Any], next_cursor: Optional[str], prev_cursor: Optional[str]):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+async def paginate(
+    db: AsyncSession,
+    query: Select,
+    order: KeysetOrder,
+    limit: int,
+    page: int = 1,
+    cursor: Optional[str] = None
+) -> Page:
+    """取一页记录：有游标时按键集定位，否则按页码偏移
+
+    query 为只选择一个实体、尚未排序的查询。多取一条判断是否还有下一页（向后翻页时
+    为上一页）。
+    """
+    direction, values = order.decode(cursor) if cursor else (NEXT, None)
+    reverse = direction == PREV
+
+    # 排序键单独选出（加标签，避免与实体的同名列混淆），用于生成游标
+    stmt = query.add_columns(
+        *(key.label(f"cursor_key_{i}") for i, key in enumerate(order.keys))
+    ).order_by(*order.order_by(reverse))
+    if values is not None:
+        stmt = stmt.where(order.beyond(values, reverse))
+    elif page > 1:
+        stmt = stmt.offset((page - 1) * limit)
+    rows = (await db.execute(stmt.limit(limit + 1))).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if reverse:
+        rows.reverse()
+        # 从某条记录往前翻，它本身及其后的记录都还在
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, values is not None or page > 1
+
+    next_cursor = order.encode(NEXT, rows[-1][1:]) if rows and has_next else None
+    prev_cursor = order.encode(PREV, rows[0][1:]) if rows and has_prev else None
+    return Page([row[0] for row in rows], next_cursor, prev_cursor)
@@ -0,0 +1,212 @@
+"""上游RPM/TPM预算的客户端令牌桶限流
+
+按提供方（及模型）分别维护请求数桶和token桶。每次调用前按提示词token数加预计输出
+预留额度，额度不足时延迟发送；等待超过上限则抛出 RateLimitExceeded，由路由切换到
+其他后端。响应结束后用返回的 usage 结算实际消耗，多退少补。
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+from config import settings
+
+
+class RateLimitExceeded(Exception):
+    """预算内无法在允许的等待时间内发出请求"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """容量为 capacity、每秒补充 rate 的令牌桶，余额可为负（超额使用后需要先还清）"""
+
+    def __init__(self, capacity: float, rate: float, now: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.level = capacity
+        self._updated = now
+
+    def _refill(self, now: float):
+        if now > self._updated:
+            self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """余额达到 amount 还需等待的秒数"""
+        self._refill(now)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float, now: float):
+        self._refill(now)
+        self.level -= amount
+
+    def give(self, amount: float, now: float):
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+    def drain(self, now: float):
+        self._refill(now)
+        self.level = min(self.level, 0)
+
+
+class Reservation:
+    """一次调用预留的额度，拿到实际用量后 settle()"""
+
+    def __init__(self, limit: "ModelRateLimit", tokens: int):
+        self.limit = limit
+        self.tokens = tokens
+        # 其中提示词部分，由调用方填写，用于没有 usage 时估算实际用量
+        self.prompt_tokens = 0
+        self.settled = False
+
+    def settle(self, actual_tokens: Optional[int]):
+        if self.settled:
+            return
+        self.settled = True
+        if actual_tokens is not None:
+            self.limit.adjust(actual_tokens - self.tokens)
+
+
+class ModelRateLimit:
+    """单个提供方/模型的请求数和token预算"""
+
+    def __init__(
+        self,
+        name: str,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep
+    ):
+        self.name = name
+        self._clock = clock
+        self._sleep = sleep
+        now = clock()
+        self.requests = TokenBucket(rpm, rpm / 60, now) if rpm else None
+        self.tokens = TokenBucket(tpm, tpm / 60, now) if tpm else None
+
+        self.admitted = 0
+        self.delayed = 0
+        self.rejected = 0
+        self.total_delay = 0.0
+        self.tokens_reserved = 0
+        self.tokens_used = 0
+
+    def _wait_time(self, tokens: int, now: float) -> float:
+        wait = 0.0
+        if self.requests is not None:
+            wait = self.requests.wait_time(1, now)
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+
+    async def acquire(self, tokens: int, max_wait: Optional[float] = None) -> Reservation:
+        """预留一次请求和 tokens 个token，额度不足时等待"""
+        max_wait = settings.llm_rate_limit_max_wait if max_wait is None else max_wait
+        if self.tokens is not None:
+            # 单次请求超过整个桶容量时按容量预留，避免永远等不到
+            tokens = min(tokens, int(self.tokens.capacity))
+        deadline = self._clock() + max_wait
+        delayed = False
+
+        while True:
+            now = self._clock()
+            wait = self._wait_time(tokens, now)
+            if wait <= 0:
+                if self.requests is not None:
+                    self.requests.take(1, now)
+                if self.tokens is not None:
+                    self.tokens.take(tokens, now)
+                self.admitted += 1
+                self.tokens_reserved += tokens
+                return Reservation(self, tokens)
+
+            if now + wait > deadline:
+                self.rejected += 1
+                raise RateLimitExceeded(f"{self.name} 超出RPM/TPM预算", retry_after=wait)
+            if not delayed:
+                delayed = True
+                self.delayed += 1
+            self.total_delay += wait
+            await self._sleep(wait)
+
+    def adjust(self, delta_tokens: int):
+        """按实际用量修正预留：用多了继续扣减，用少了退回"""
+        self.tokens_used += delta_tokens
+        if self.tokens is None or not delta_tokens:
+            return
+        now = self._clock()
+        if delta_tokens > 0:
+            self.tokens.take(delta_tokens, now)
+        else:
+            self.tokens.give(-delta_tokens, now)
+
+    def drain(self):
+        """上游返回429时清空余额，让后续请求等待下一轮补充"""
+        now = self._clock()
+        for bucket in (self.requests, self.tokens):
+            if bucket is not None:
+                bucket.drain(now)
+
+    def stats(self) -> Dict[str, Any]:
+        now = self._clock()
+        for bucket in (self.requests, self.tokens):
+            if bucket is not None:
+                bucket.wait_time(0, now)
+        return {
+            "rpm": self.requests.capacity if self.requests else None,
+            "tpm": self.tokens.capacity if self.tokens else None,
+            "requests_available": self.requests.level if self.requests else None,
+            "tokens_available": self.tokens.level if self.tokens else None,
+            "admitted": self.admitted,
+            "delayed": self.delayed,
+            "rejected": self.rejected,
+            "total_delay_seconds": self.total_delay,
+            "tokens_reserved": self.tokens_reserved,
+            "tokens_used": self.tokens_reserved + self.tokens_used
+        }
+
+
+class UpstreamRateLimiter:
+    """按配置为提供方/模型创建限流器
+
+    配置键为 "提供方:模型" 或 "提供方"，前者优先；同一键下的模型共享预算。
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, Dict[str, float]]] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep
+    ):
+        self.limits = settings.llm_rate_limits if limits is None else limits
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets: Dict[str, ModelRateLimit] = {}
+
+    def get(self, provider: str, model: str) -> Optional[ModelRateLimit]:
+        """没有配置预算时返回 None（不限流）"""
+        for key in (f"{provider}:{model}", provider):
+            config = self.limits.get(key)
+            if config is None:
+                continue
+            limit = self._buckets.get(key)
+            if limit is None:
+                limit = ModelRateLimit(
+                    key, rpm=config.get("rpm"), tpm=config.get("tpm"),
+                    clock=self._clock, sleep=self._sleep
+                )
+                self._buckets[key] = limit
+            return limit
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {key: limit.stats() for key, limit in self._buckets.items()}
+
+
+# 全局限流实例
+upstream_rate_limiter = UpstreamRateLimiter()
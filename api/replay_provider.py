@@ -0,0 +1,154 @@
+"""LLM调用的录制/回放
+
+ai_service_provider 设为 "record" 时，真实提供方（llm_record_provider）的每次调用
+连同流式分块之间的时间间隔写入磁带文件；设为 "replay" 时不访问上游，按请求找到对应
+磁带回放。回放速度由 llm_replay_speed 控制：1 为原速，大于1为加速，0 为无延迟。
+
+磁带按模型、消息列表和生成参数的哈希命名，一个请求对应一个JSON文件，可以提交到仓库里
+作为离线测试和性能回归的固定输入。
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from config import settings
+from response_cache import response_cache_key
+
+
+class CassetteNotFound(Exception):
+    """回放模式下没有与请求对应的磁带"""
+
+
+def cassette_path(directory: str, model: str, messages: List[Dict[str, Any]], params: Dict[str, Any], stream: bool) -> str:
+    key = response_cache_key(model, messages, params)
+    prefix = "stream" if stream else "complete"
+    return os.path.join(directory, f"{prefix}-{key[:32]}.json")
+
+
+def _write_cassette(path: str, cassette: Dict[str, Any]):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(cassette, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+class ReplayStream:
+    """按录制时的间隔（除以回放速度）逐块产出"""
+
+    def __init__(self, chunks: List[Dict[str, Any]], speed: float):
+        self._chunks = chunks
+        self._speed = speed
+        self._index = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> ChatCompletionChunk:
+        if self._index >= len(self._chunks):
+            raise StopAsyncIteration
+        recorded = self._chunks[self._index]
+        self._index += 1
+        if self._speed > 0 and recorded["delay"] > 0:
+            await asyncio.sleep(recorded["delay"] / self._speed)
+        return ChatCompletionChunk.model_validate(recorded["chunk"])
+
+    async def close(self):
+        self._index = len(self._chunks)
+
+
+class RecordingStream:
+    """透传上游流并记录每个分块及其与上一块的间隔，完整结束后写入磁带"""
+
+    def __init__(self, stream, path: str, request: Dict[str, Any], started: float):
+        self._stream = stream
+        self._iterator = stream.__aiter__()
+        self._path = path
+        self._request = request
+        self._last = started
+        self._chunks: List[Dict[str, Any]] = []
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> ChatCompletionChunk:
+        try:
+            chunk = await self._iterator.__anext__()
+        except StopAsyncIteration:
+            _write_cassette(self._path, {"request": self._request, "stream": True, "chunks": self._chunks})
+            raise
+        now = time.perf_counter()
+        self._chunks.append({"delay": round(now - self._last, 4), "chunk": chunk.model_dump(exclude_none=True)})
+        self._last = now
+        return chunk
+
+    async def close(self):
+        await self._stream.close()
+
+
+class _ReplayCompletions:
+    def __init__(self, directory: str, speed: float):
+        self._directory = directory
+        self._speed = speed
+
+    async def create(self, model: str, messages: List[Dict[str, Any]], stream: bool = False, **params):
+        path = cassette_path(self._directory, model, messages, params, stream)
+        if not os.path.exists(path):
+            raise CassetteNotFound(f"没有对应的录制: {path}")
+        with open(path, encoding="utf-8") as f:
+            cassette = json.load(f)
+
+        if stream:
+            return ReplayStream(cassette["chunks"], self._speed)
+        if self._speed > 0 and cassette.get("latency", 0) > 0:
+            await asyncio.sleep(cassette["latency"] / self._speed)
+        return ChatCompletion.model_validate(cassette["response"])
+
+
+class _RecordingCompletions:
+    def __init__(self, client, directory: str):
+        self._client = client
+        self._directory = directory
+
+    async def create(self, model: str, messages: List[Dict[str, Any]], stream: bool = False, **params):
+        path = cassette_path(self._directory, model, messages, params, stream)
+        request = {"model": model, "messages": messages, "params": params}
+        started = time.perf_counter()
+        result = await self._client.chat.completions.create(
+            model=model, messages=messages, stream=stream, **params
+        )
+        if stream:
+            return RecordingStream(result, path, request, started)
+
+        _write_cassette(path, {
+            "request": request,
+            "stream": False,
+            "latency": round(time.perf_counter() - started, 4),
+            "response": result.model_dump(exclude_none=True)
+        })
+        return result
+
+
+class _Chat:
+    def __init__(self, completions):
+        self.completions = completions
+
+
+class ReplayClient:
+    """从磁带回放的客户端，接口与 AsyncOpenAI 的 chat.completions.create 一致"""
+
+    def __init__(self, directory: Optional[str] = None, speed: Optional[float] = None):
+        self.directory = directory or settings.llm_cassette_dir
+        self.speed = settings.llm_replay_speed if speed is None else speed
+        self.chat = _Chat(_ReplayCompletions(self.directory, self.speed))
+
+
+class RecordingClient:
+    """包装真实客户端，把每次调用录制到磁带"""
+
+    def __init__(self, client, directory: Optional[str] = None):
+        self.directory = directory or settings.llm_cassette_dir
+        self.chat = _Chat(_RecordingCompletions(client, self.directory))
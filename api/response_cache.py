@@ -0,0 +1,259 @@
+"""LLM回复的精确匹配缓存
+
+键为模型、完整构建后的消息列表和生成参数的哈希，命中时把缓存的回复按原始分块重新
+作为流输出，SSE客户端看到的与真实生成没有区别。内存层为LRU+TTL，可选的SQLite
+磁盘层让缓存跨进程重启保留。只缓存完整结束的生成，出错或被中断的流不会写入。
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional
+from cache_utils import BoundedLRUCache
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+# 只影响传输、不影响生成内容的参数，不计入缓存键
+TRANSPORT_PARAMS = frozenset({"stream", "stream_options", "timeout", "extra_headers", "extra_query", "user"})
+
+
+def response_cache_key(
+    model: Optional[str],
+    messages: List[Dict[str, Any]],
+    params: Optional[Dict[str, Any]] = None
+) -> str:
+    """模型、消息列表和生成参数（temperature、max_tokens、top_p、stop 等）的稳定哈希"""
+    generation = {
+        name: value for name, value in (params or {}).items()
+        if name not in TRANSPORT_PARAMS and value is not None
+    }
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": generation},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CachedResponse:
+    """一次完整生成的分块和原始耗时"""
+
+    __slots__ = ("chunks", "latency", "created_at")
+
+    def __init__(self, chunks: List[str], latency: float, created_at: float):
+        self.chunks = chunks
+        self.latency = latency
+        self.created_at = created_at
+
+    @property
+    def size(self) -> int:
+        return sum(len(chunk.encode("utf-8")) for chunk in self.chunks)
+
+
+class DiskResponseStore:
+    """SQLite磁盘层，按最近访问时间保留最多 max_entries 条"""
+
+    def __init__(self, path: str, max_entries: int = 10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                chunks TEXT NOT NULL,
+                latency REAL NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_response_cache_accessed_at ON response_cache (accessed_at)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str, ttl_seconds: Optional[float], now: float) -> Optional[CachedResponse]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT chunks, latency, created_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if ttl_seconds is not None and now - row[2] > ttl_seconds:
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE response_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return CachedResponse(json.loads(row[0]), row[1], row[2])
+
+    def put(self, key: str, response: CachedResponse, now: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, chunks, latency, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(response.chunks, ensure_ascii=False), response.latency,
+                 response.created_at, now)
+            )
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE key IN ("
+                "SELECT key FROM response_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache")
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """内存LRU + 可选磁盘层的回复缓存"""
+
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        path: Optional[str] = None,
+        disk_max_entries: Optional[int] = None,
+        clock: Callable[[], float] = time.time
+    ):
+        self.enabled = settings.response_cache_enabled if enabled is None else enabled
+        self.ttl_seconds = settings.response_cache_ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._clock = clock
+        self.memory = BoundedLRUCache(
+            max_entries=max_entries or settings.response_cache_max_entries,
+            sizeof=lambda response: response.size
+        )
+        path = settings.response_cache_path if path is None else path
+        self._path = path if self.enabled else ""
+        self._disk_max_entries = disk_max_entries or settings.response_cache_disk_max_entries
+        self._disk: Optional[DiskResponseStore] = None
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.latency_saved = 0.0
+
+    @property
+    def disk(self) -> Optional[DiskResponseStore]:
+        """磁盘层在首次使用时打开，path 为空时不启用"""
+        if self._disk is None and self._path:
+            try:
+                self._disk = DiskResponseStore(self._path, self._disk_max_entries)
+            except sqlite3.Error as e:
+                logger.warning(f"回复缓存磁盘层打开失败，仅使用内存缓存: {e}")
+                self._path = ""
+        return self._disk
+
+    def _is_fresh(self, response: CachedResponse) -> bool:
+        return self.ttl_seconds is None or self._clock() - response.created_at <= self.ttl_seconds
+
+    async def lookup(self, key: str) -> Optional[CachedResponse]:
+        response = self.memory.get(key)
+        if response is not None:
+            if self._is_fresh(response):
+                self.memory_hits += 1
+                return response
+            self.memory.pop(key)
+
+        disk = self.disk
+        if disk is not None:
+            try:
+                response = await asyncio.to_thread(disk.get, key, self.ttl_seconds, self._clock())
+            except sqlite3.Error as e:
+                logger.warning(f"读取回复缓存失败: {e}")
+                response = None
+            if response is not None:
+                self.disk_hits += 1
+                self.memory.put(key, response)
+                return response
+
+        self.misses += 1
+        return None
+
+    async def store(self, key: str, chunks: List[str], latency: float):
+        response = CachedResponse(chunks, latency, self._clock())
+        self.memory.put(key, response)
+        self.stores += 1
+        disk = self.disk
+        if disk is not None:
+            try:
+                await asyncio.to_thread(disk.put, key, response, response.created_at)
+            except sqlite3.Error as e:
+                logger.warning(f"写入回复缓存失败: {e}")
+
+    async def stream(
+        self,
+        key: str,
+        generate: Callable[[], AsyncGenerator[str, None]]
+    ) -> AsyncGenerator[str, None]:
+        """命中时回放缓存的分块，否则透传 generate() 的输出并在完整结束后写入缓存"""
+        cached = await self.lookup(key)
+        if cached is not None:
+            self.latency_saved += cached.latency
+            for chunk in cached.chunks:
+                yield chunk
+                # 让出事件循环，保持与真实流一致的逐块发送
+                await asyncio.sleep(0)
+            return
+
+        started = time.perf_counter()
+        chunks: List[str] = []
+        async for chunk in generate():
+            chunks.append(chunk)
+            yield chunk
+        if chunks:
+            await self.store(key, chunks, time.perf_counter() - started)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self.memory),
+            "bytes": self.memory.total_bytes,
+            "disk_enabled": bool(self._path),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "latency_saved_ms": self.latency_saved * 1000
+        }
+
+
+# 全局回复缓存实例
+response_cache = ResponseCache()
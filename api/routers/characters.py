@@ -1,97 +1,104 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import desc, asc, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import or_, select
 from typing import Optional
-from database import get_db
+from database import get_async_db, unindexed
 from models import User, Character
 from schemas import (
     CharacterCreate, CharacterUpdate, CharacterResponse, CharacterListResponse,
     SuccessResponse
 )
 from auth_utils import get_current_user, get_current_user_optional
+from langchain_service import langchain_ai_service
+from pagination import KeysetOrder, paginate
+from list_totals import COUNT_MODES, list_totals
+from character_search import apply_search, character_tags
 
 router = APIRouter()
 
+# 列表排序方式，id 作为同值时的次序（游标分页需要唯一的排序键）
+CHARACTER_ORDERS = {
+    "latest": KeysetOrder("latest", Character.created_at, Character.id, descending=True),
+    "popular": KeysetOrder("popular", Character.chat_count, Character.id, descending=True),
+    "name": KeysetOrder("name", Character.name, Character.id)
+}
+
+def _character_response(char: Character) -> CharacterResponse:
+    """转换为响应模型，并基于角色名称和描述生成简单的标签"""
+    response = CharacterResponse.model_validate(char)
+    response.tags = character_tags(char.name, char.description)
+    return response
+
 @router.get("/", response_model=CharacterListResponse)
 async def get_characters(
     page: int = Query(1, ge=1, description="页码"),
     limit: int = Query(20, ge=1, le=100, description="每页数量"),
     search: Optional[str] = Query(None, description="搜索关键词"),
-    sort: str = Query("latest", regex="^(latest|popular|name)$", description="排序方式"),
-    db: Session = Depends(get_db),
+    sort: Optional[str] = Query(None, regex="^(latest|popular|name|relevance)$", description="排序方式（默认：搜索时按相关度，否则按最新）"),
+    cursor: Optional[str] = Query(None, description="分页游标（上次响应的 next_cursor 或 prev_cursor，优先于页码）"),
+    count: str = Query("exact", regex=COUNT_MODES, description="总数：exact 精确（短时缓存）、estimated 估算（仅未登录且未搜索时）、none 不计算"),
+    db: AsyncSession = Depends(get_async_db),
     current_user: Optional[User] = Depends(get_current_user_optional)
 ):
     """获取角色列表"""
-    query = db.query(Character)
+    query = select(Character)
     
     # 只显示公开角色，除非是角色创建者
     if current_user:
-        query = query.filter(
+        # 翻页查询中两个条件都不走索引：否则SQLite会合并 is_public 和 creator_id 两个
+        # 索引的结果再整体排序，而可见角色绝大多数是公开的，沿排序索引顺序读取、过滤到
+        # 够一页即可停止。计数仍按两个索引合并
+        page_query = query.where(
+            or_(unindexed(Character.is_public) == True, unindexed(Character.creator_id) == current_user.id)
+        )
+        query = query.where(
             or_(Character.is_public == True, Character.creator_id == current_user.id)
         )
     else:
-        query = query.filter(Character.is_public == True)
+        query = page_query = query.where(Character.is_public == True)
     
-    # 搜索过滤
+    # 搜索过滤：全文索引，结果可以按相关度排序
+    relevance = None
     if search:
-        search_term = f"%{search}%"
-        query = query.filter(
-            or_(
-                Character.name.ilike(search_term),
-                Character.description.ilike(search_term)
-            )
-        )
+        query, relevance = apply_search(query, search)
+        page_query, _ = apply_search(page_query, search, ordered=True)
+    if sort is None or sort == "relevance":
+        order = relevance or CHARACTER_ORDERS["latest"]
+    else:
+        order = CHARACTER_ORDERS[sort]
     
-    # 排序
-    if sort == "latest":
-        query = query.order_by(desc(Character.created_at))
-    elif sort == "popular":
-        query = query.order_by(desc(Character.chat_count))
-    elif sort == "name":
-        query = query.order_by(asc(Character.name))
+    # 总数：未过滤的公开角色列表可以使用估算值
+    total, estimated = None, False
+    if count == "estimated" and not current_user and not search:
+        total, estimated = await list_totals.estimate(db, query, "public_characters"), True
+    elif count != "none":
+        total = await list_totals.count(
+            db, query, "characters", key=(current_user.id if current_user else None, search)
+        )
     
-    # 分页
-    total = query.count()
-    characters = query.offset((page - 1) * limit).limit(limit).all()
+    # 排序并分页
+    result = await paginate(db, page_query, order, limit, page=page, cursor=cursor)
     
-    # 为角色添加tags字段
-    character_responses = []
-    for char in characters:
-        char_dict = CharacterResponse.from_orm(char).dict()
-        # 基于角色名称和描述生成简单的标签
-        tags = []
-        if "魔法" in char.description or "法师" in char.name:
-            tags.append("魔法")
-        if "战士" in char.description or "骑士" in char.name:
-            tags.append("战斗")
-        if "精灵" in char.description or "精灵" in char.name:
-            tags.append("精灵")
-        if "可爱" in char.description or "萌" in char.description:
-            tags.append("可爱")
-        if "智慧" in char.description or "聪明" in char.description:
-            tags.append("智慧")
-        if "冒险" in char.description:
-            tags.append("冒险")
-        if not tags:  # 如果没有匹配的标签，添加默认标签
-            tags = ["角色扮演", "对话"]
-        char_dict['tags'] = tags
-        character_responses.append(CharacterResponse(**char_dict))
+    character_responses = [_character_response(char) for char in result.items]
     
     return CharacterListResponse(
         characters=character_responses,
         total=total,
+        total_estimated=estimated,
         page=page,
-        limit=limit
+        limit=limit,
+        next_cursor=result.next_cursor,
+        prev_cursor=result.prev_cursor
     )
 
 @router.get("/{character_id}", response_model=CharacterResponse)
 async def get_character(
     character_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: Optional[User] = Depends(get_current_user_optional)
 ):
     """获取角色详情"""
-    character = db.query(Character).filter(Character.id == character_id).first()
+    character = await db.get(Character, character_id)
     
     if not character:
         raise HTTPException(
@@ -107,30 +114,12 @@ async def get_character(
                 detail="无权访问此角色"
             )
     
-    # 为角色添加tags字段
-    char_dict = CharacterResponse.from_orm(character).dict()
-    tags = []
-    if "魔法" in character.description or "法师" in character.name:
-        tags.append("魔法")
-    if "战士" in character.description or "骑士" in character.name:
-        tags.append("战斗")
-    if "精灵" in character.description or "精灵" in character.name:
-        tags.append("精灵")
-    if "可爱" in character.description or "萌" in character.description:
-        tags.append("可爱")
-    if "智慧" in character.description or "聪明" in character.description:
-        tags.append("智慧")
-    if "冒险" in character.description:
-        tags.append("冒险")
-    if not tags:
-        tags = ["角色扮演", "对话"]
-    char_dict['tags'] = tags
-    return CharacterResponse(**char_dict)
+    return _character_response(character)
 
 @router.post("/", response_model=CharacterResponse)
 async def create_character(
     character_data: CharacterCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """创建角色"""
@@ -146,31 +135,16 @@ async def create_character(
         )
         
         db.add(db_character)
-        db.commit()
-        db.refresh(db_character)
+        await db.commit()
+        await db.refresh(db_character)
+        list_totals.invalidate("characters")
+        if db_character.is_public:
+            list_totals.adjust("public_characters", 1)
         
-        # 为角色添加tags字段
-        char_dict = CharacterResponse.from_orm(db_character).dict()
-        tags = []
-        if "魔法" in db_character.description or "法师" in db_character.name:
-            tags.append("魔法")
-        if "战士" in db_character.description or "骑士" in db_character.name:
-            tags.append("战斗")
-        if "精灵" in db_character.description or "精灵" in db_character.name:
-            tags.append("精灵")
-        if "可爱" in db_character.description or "萌" in db_character.description:
-            tags.append("可爱")
-        if "智慧" in db_character.description or "聪明" in db_character.description:
-            tags.append("智慧")
-        if "冒险" in db_character.description:
-            tags.append("冒险")
-        if not tags:
-            tags = ["角色扮演", "对话"]
-        char_dict['tags'] = tags
-        return CharacterResponse(**char_dict)
+        return _character_response(db_character)
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="创建角色失败，请稍后重试"
@@ -180,11 +154,11 @@ async def create_character(
 async def update_character(
     character_id: str,
     character_data: CharacterUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """更新角色"""
-    character = db.query(Character).filter(Character.id == character_id).first()
+    character = await db.get(Character, character_id)
     
     if not character:
         raise HTTPException(
@@ -202,34 +176,25 @@ async def update_character(
     try:
         # 更新字段
         update_data = character_data.dict(exclude_unset=True)
+        was_public = character.is_public
         for field, value in update_data.items():
             setattr(character, field, value)
         
-        db.commit()
-        db.refresh(character)
+        await db.commit()
+        await db.refresh(character)
+        
+        # 公开状态和名称/描述会影响列表总数
+        list_totals.invalidate("characters")
+        if character.is_public != was_public:
+            list_totals.adjust("public_characters", 1 if character.is_public else -1)
+        
+        # 角色设定可能已变化，清除其提示词模板缓存
+        langchain_ai_service.invalidate_character(character_id)
         
-        # 为角色添加tags字段
-        char_dict = CharacterResponse.from_orm(character).dict()
-        tags = []
-        if "魔法" in character.description or "法师" in character.name:
-            tags.append("魔法")
-        if "战士" in character.description or "骑士" in character.name:
-            tags.append("战斗")
-        if "精灵" in character.description or "精灵" in character.name:
-            tags.append("精灵")
-        if "可爱" in character.description or "萌" in character.description:
-            tags.append("可爱")
-        if "智慧" in character.description or "聪明" in character.description:
-            tags.append("智慧")
-        if "冒险" in character.description:
-            tags.append("冒险")
-        if not tags:
-            tags = ["角色扮演", "对话"]
-        char_dict['tags'] = tags
-        return CharacterResponse(**char_dict)
+        return _character_response(character)
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="更新角色失败，请稍后重试"
@@ -238,11 +203,11 @@ async def update_character(
 @router.delete("/{character_id}", response_model=SuccessResponse)
 async def delete_character(
     character_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """删除角色"""
-    character = db.query(Character).filter(Character.id == character_id).first()
+    character = await db.get(Character, character_id)
     
     if not character:
         raise HTTPException(
@@ -258,13 +223,18 @@ async def delete_character(
         )
     
     try:
-        db.delete(character)
-        db.commit()
+        was_public = character.is_public
+        await db.delete(character)
+        await db.commit()
+        langchain_ai_service.invalidate_character(character_id)
+        list_totals.invalidate("characters")
+        if was_public:
+            list_totals.adjust("public_characters", -1)
         
         return SuccessResponse(message="角色删除成功")
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="删除角色失败，请稍后重试"
@@ -274,41 +244,26 @@ async def delete_character(
 async def get_my_characters(
     page: int = Query(1, ge=1, description="页码"),
     limit: int = Query(20, ge=1, le=100, description="每页数量"),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="分页游标（上次响应的 next_cursor 或 prev_cursor，优先于页码）"),
+    count: str = Query("exact", regex=COUNT_MODES, description="总数：exact 精确（短时缓存）、estimated 同 exact、none 不计算"),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """获取我的角色列表"""
-    query = db.query(Character).filter(Character.creator_id == current_user.id)
-    query = query.order_by(desc(Character.created_at))
+    query = select(Character).where(Character.creator_id == current_user.id)
     
-    total = query.count()
-    characters = query.offset((page - 1) * limit).limit(limit).all()
+    total = None
+    if count != "none":
+        total = await list_totals.count(db, query, "characters", key=("creator", current_user.id))
+    result = await paginate(db, query, CHARACTER_ORDERS["latest"], limit, page=page, cursor=cursor)
     
-    # 为角色添加tags字段
-    character_responses = []
-    for char in characters:
-        char_dict = CharacterResponse.from_orm(char).dict()
-        tags = []
-        if "魔法" in char.description or "法师" in char.name:
-            tags.append("魔法")
-        if "战士" in char.description or "骑士" in char.name:
-            tags.append("战斗")
-        if "精灵" in char.description or "精灵" in char.name:
-            tags.append("精灵")
-        if "可爱" in char.description or "萌" in char.description:
-            tags.append("可爱")
-        if "智慧" in char.description or "聪明" in char.description:
-            tags.append("智慧")
-        if "冒险" in char.description:
-            tags.append("冒险")
-        if not tags:
-            tags = ["角色扮演", "对话"]
-        char_dict['tags'] = tags
-        character_responses.append(CharacterResponse(**char_dict))
+    character_responses = [_character_response(char) for char in result.items]
     
     return CharacterListResponse(
         characters=character_responses,
         total=total,
         page=page,
-        limit=limit
+        limit=limit,
+        next_cursor=result.next_cursor,
+        prev_cursor=result.prev_cursor
     )
\ No newline at end of file
@@ -1,58 +1,70 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import desc
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from sqlalchemy import select
 from typing import Optional
-from database import get_db
+from database import get_async_db
 from models import User, Conversation, Character
 from schemas import ConversationListResponse, ConversationResponse, SuccessResponse
 from auth_utils import get_current_user
+from pagination import KeysetOrder, paginate
+from list_totals import COUNT_MODES, list_totals
 
 router = APIRouter()
 
+# 按最后消息时间倒序
+CONVERSATION_ORDER = KeysetOrder("recent", Conversation.last_message_at, Conversation.id, descending=True)
+
 @router.get("/", response_model=ConversationListResponse)
 async def get_conversations(
     page: int = Query(1, ge=1, description="页码"),
     limit: int = Query(20, ge=1, le=100, description="每页数量"),
     character_id: Optional[str] = Query(None, description="角色ID过滤"),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="分页游标（上次响应的 next_cursor 或 prev_cursor，优先于页码）"),
+    count: str = Query("exact", regex=COUNT_MODES, description="总数：exact 精确（短时缓存）、estimated 同 exact、none 不计算"),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """获取用户的会话列表"""
-    query = db.query(Conversation).options(
-        joinedload(Conversation.character)
-    ).filter(Conversation.user_id == current_user.id)
+    query = select(Conversation).where(Conversation.user_id == current_user.id)
     
     # 按角色过滤
     if character_id:
-        query = query.filter(Conversation.character_id == character_id)
+        query = query.where(Conversation.character_id == character_id)
     
-    # 按最后消息时间排序
-    query = query.order_by(desc(Conversation.last_message_at))
+    # 总数（按用户和角色过滤条件缓存）
+    total = None
+    if count != "none":
+        total = await list_totals.count(db, query, "conversations", scope=current_user.id, key=character_id)
     
-    # 分页
-    total = query.count()
-    conversations = query.offset((page - 1) * limit).limit(limit).all()
+    # 按最后消息时间排序
+    result = await paginate(
+        db, query.options(joinedload(Conversation.character)), CONVERSATION_ORDER, limit,
+        page=page, cursor=cursor
+    )
     
     return ConversationListResponse(
-        conversations=[ConversationResponse.from_orm(conv) for conv in conversations],
+        conversations=[ConversationResponse.from_orm(conv) for conv in result.items],
         total=total,
         page=page,
-        limit=limit
+        limit=limit,
+        next_cursor=result.next_cursor,
+        prev_cursor=result.prev_cursor
     )
 
 @router.get("/{conversation_id}", response_model=ConversationResponse)
 async def get_conversation(
     conversation_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """获取会话详情"""
-    conversation = db.query(Conversation).options(
+    conversation = await db.scalar(select(Conversation).options(
         joinedload(Conversation.character)
-    ).filter(
+    ).where(
         Conversation.id == conversation_id,
         Conversation.user_id == current_user.id
-    ).first()
+    ))
     
     if not conversation:
         raise HTTPException(
@@ -65,14 +77,14 @@ async def get_conversation(
 @router.delete("/{conversation_id}", response_model=SuccessResponse)
 async def delete_conversation(
     conversation_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """删除会话"""
-    conversation = db.query(Conversation).filter(
+    conversation = await db.scalar(select(Conversation).where(
         Conversation.id == conversation_id,
         Conversation.user_id == current_user.id
-    ).first()
+    ))
     
     if not conversation:
         raise HTTPException(
@@ -81,13 +93,15 @@ async def delete_conversation(
         )
     
     try:
-        db.delete(conversation)
-        db.commit()
+        await db.delete(conversation)
+        await db.commit()
+        list_totals.invalidate("conversations", scope=current_user.id)
+        list_totals.invalidate("messages", scope=conversation_id)
         
         return SuccessResponse(message="会话删除成功")
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="删除会话失败，请稍后重试"
@@ -97,14 +111,14 @@ async def delete_conversation(
 async def update_conversation_summary(
     conversation_id: str,
     summary: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """更新会话摘要"""
-    conversation = db.query(Conversation).filter(
+    conversation = await db.scalar(select(Conversation).where(
         Conversation.id == conversation_id,
         Conversation.user_id == current_user.id
-    ).first()
+    ))
     
     if not conversation:
         raise HTTPException(
@@ -114,12 +128,12 @@ async def update_conversation_summary(
     
     try:
         conversation.summary = summary
-        db.commit()
+        await db.commit()
         
         return SuccessResponse(message="会话摘要更新成功")
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="更新会话摘要失败，请稍后重试"
@@ -1,13 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
 from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import desc
-from typing import List, Optional
-from datetime import datetime
-import json
+from sqlalchemy import select
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
+from functools import partial
+import asyncio
+import logging
 import uuid
 
-from database import get_db
+from database import AsyncSessionLocal, get_async_db
 from models import User, Character, Conversation, Message, generate_id
 from schemas import (
     MessageCreate, MessageResponse, MessageListResponse,
@@ -16,20 +19,35 @@ from schemas import (
 )
 from auth_utils import get_current_user, get_current_user_optional
 from langchain_service import langchain_ai_service
+from history_window import (
+    assign_token_counts, last_cumulative_tokens, shift_cumulative_after_delete, update_token_counts
+)
+from context_window import token_counter
+from summarizer import conversation_summarizer
+from admission import AdmissionRejected, AdmissionTicket, admission_controller, client_ip
+from sse_coalescer import coalesce_chunks
+from fast_json import sse_event
+from stream_buffer import StreamBuffer, stream_registry
+from pagination import KeysetOrder, paginate
+from list_totals import COUNT_MODES, list_totals
+from config import settings
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# 消息按时间正序
+MESSAGE_ORDER = KeysetOrder("time", Message.created_at, Message.id)
+
 @router.post("/conversations", response_model=ConversationResponse)
 async def create_conversation(
     conversation_data: ConversationCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: Optional[User] = Depends(get_current_user_optional)
 ):
     """创建新会话"""
     # 检查角色是否存在
-    character = db.query(Character).filter(
-        Character.id == conversation_data.character_id
-    ).first()
+    character = await db.get(Character, conversation_data.character_id)
     
     if not character:
         raise HTTPException(
@@ -50,7 +68,7 @@ async def create_conversation(
         )
         
         db.add(conversation)
-        db.flush()  # 获取ID但不提交
+        await db.flush()  # 获取ID但不提交
         
         # 如果角色有开场白，创建第一条消息
         if character.greeting:
@@ -61,19 +79,22 @@ async def create_conversation(
                 content=character.greeting,
                 created_at=datetime.utcnow()
             )
+            await db.run_sync(assign_token_counts, greeting_message, previous_cumulative=0)
             db.add(greeting_message)
         
-        db.commit()
+        await db.commit()
+        list_totals.invalidate("conversations", scope=conversation.user_id)
+        list_totals.invalidate("messages", scope=conversation.id)
         
         # 重新查询以获取关联数据
-        conversation = db.query(Conversation).options(
+        conversation = await db.scalar(select(Conversation).options(
             joinedload(Conversation.character)
-        ).filter(Conversation.id == conversation.id).first()
+        ).where(Conversation.id == conversation.id).execution_options(populate_existing=True))
         
         return ConversationResponse.from_orm(conversation)
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"创建会话失败: {str(e)}")
         import traceback
         traceback.print_exc()
@@ -87,22 +108,24 @@ async def get_messages(
     conversation_id: str,
     page: int = 1,
     limit: int = 50,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    count: str = Query("exact", regex=COUNT_MODES, description="总数：exact 精确（短时缓存）、estimated 同 exact、none 不计算"),
+    db: AsyncSession = Depends(get_async_db),
     current_user: Optional[User] = Depends(get_current_user_optional)
 ):
     """获取会话消息列表"""
     # 验证会话权限
     if current_user:
-        conversation = db.query(Conversation).filter(
+        conversation = await db.scalar(select(Conversation).where(
             Conversation.id == conversation_id,
             Conversation.user_id == current_user.id
-        ).first()
+        ))
     else:
         # 游客只能访问游客会话
-        conversation = db.query(Conversation).filter(
+        conversation = await db.scalar(select(Conversation).where(
             Conversation.id == conversation_id,
             Conversation.user_id.is_(None)
-        ).first()
+        ))
     
     if not conversation:
         raise HTTPException(
@@ -111,44 +134,212 @@ async def get_messages(
         )
     
     # 查询消息
-    query = db.query(Message).filter(
-        Message.conversation_id == conversation_id
-    ).order_by(Message.created_at)
+    query = select(Message).where(Message.conversation_id == conversation_id)
     
-    total = query.count()
-    messages = query.offset((page - 1) * limit).limit(limit).all()
+    total = None
+    if count != "none":
+        total = await list_totals.count(db, query, "messages", scope=conversation_id)
+    result = await paginate(db, query, MESSAGE_ORDER, limit, page=page, cursor=cursor)
     
     return MessageListResponse(
-        messages=[MessageResponse.from_orm(msg) for msg in messages],
+        messages=[MessageResponse.from_orm(msg) for msg in result.items],
         total=total,
         page=page,
-        limit=limit
+        limit=limit,
+        next_cursor=result.next_cursor,
+        prev_cursor=result.prev_cursor
     )
 
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "Content-Type": "text/event-stream"
+}
+
+async def _load_reply(message_id: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """数据库中保存的回复内容及其结束事件（回复缓冲不可用时续传）
+    
+    回复仍在生成时结束事件为 None；生成失败时内容是错误提示，作为 error 事件发送。
+    """
+    async with AsyncSessionLocal() as db:
+        message = await db.get(Message, message_id)
+    if message is None:
+        return "", {'type': 'error', 'message': "回复不存在"}
+    if message.status == "generating":
+        return "", None
+    if message.status == "failed":
+        return "", {'type': 'error', 'message': message.content}
+    final_event = {'type': 'message_end', 'message_id': message_id}
+    if message.truncated:
+        final_event['truncated'] = True
+    return message.content, final_event
+
+def _save_reply(
+    db: Session,
+    conversation_id: str,
+    ai_message_id: str,
+    content: str,
+    summary_checkpoint: Optional[int],
+    failed: bool = False,
+    truncated: bool = False
+):
+    """更新数据库中的回复（会话可能已在生成期间被删除）"""
+    try:
+        ai_message = db.query(Message).filter(Message.id == ai_message_id).first()
+        conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+        if not ai_message or not conversation:
+            return
+        
+        if truncated and not content:
+            # 首token前客户端就已断开：删除空的回复占位
+            shift_cumulative_after_delete(db, ai_message)
+            db.delete(ai_message)
+            db.commit()
+            list_totals.invalidate("messages", scope=conversation_id)
+            return
+        
+        update_token_counts(db, ai_message, content)
+        ai_message.truncated = truncated
+        ai_message.status = "failed" if failed else "completed"
+        if not failed:
+            conversation.last_message_at = datetime.utcnow()
+        db.commit()
+        
+        # 达到阈值时在后台更新滚动摘要
+        if not failed and not truncated:
+            conversation_summarizer.maybe_schedule(
+                db, conversation_id, last_cumulative_tokens(db, conversation_id), summary_checkpoint
+            )
+    except Exception as e:
+        logger.error(f"保存回复失败: {e}")
+        db.rollback()
+
+STALE_REPLY_MESSAGE = "回复生成中断，请重新发送。"
+
+def fail_stale_replies(db: Session, message_id: Optional[str] = None) -> int:
+    """结束超过 sse_stale_reply_seconds 仍为 generating 的回复，返回处理的条数
+    
+    生成回复的进程中途退出时占位消息会一直停留在生成中：已保存了部分内容的作为截断的
+    回复，否则以提示语标记为失败。传入 message_id 时只处理这一条。
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.sse_stale_reply_seconds)
+    query = db.query(Message).filter(Message.status == "generating", Message.created_at < cutoff)
+    if message_id is not None:
+        query = query.filter(Message.id == message_id)
+    stale = query.all()
+    for message in stale:
+        if message.content:
+            message.truncated = True
+            message.status = "completed"
+        else:
+            update_token_counts(db, message, STALE_REPLY_MESSAGE)
+            message.status = "failed"
+    if stale:
+        db.commit()
+        logger.warning(f"已结束 {len(stale)} 条生成中断的回复")
+    return len(stale)
+
+async def _store_reply(*args, **kwargs):
+    """在独立的短会话中保存回复，生成期间不占用数据库连接"""
+    async with AsyncSessionLocal() as db:
+        await db.run_sync(_save_reply, *args, **kwargs)
+
+async def _generate_reply(
+    buffer: StreamBuffer,
+    ticket: Optional[AdmissionTicket],
+    conversation_id: str,
+    user_input: str,
+    system_prompt: str,
+    session_prompt: Optional[str],
+    character_id: str,
+    user_message_id: str,
+    ai_message_id: str,
+    summary: Optional[str],
+    summary_checkpoint: Optional[int]
+):
+    """后台生成AI回复：内容块写入回复缓冲，结束后保存到数据库
+    
+    所有订阅者断开后由回复流注册表取消本任务，取消会一直传递到上游流式请求并关闭连接，
+    已生成的部分作为截断的回复保存。数据库只在生成前加载记忆、生成后保存回复时短暂使用，
+    流式生成期间不占用连接。
+    """
+    response_parts = []
+    final_event = {'type': 'message_end', 'message_id': ai_message_id}
+    try:
+        async with AsyncSessionLocal() as db:
+            await langchain_ai_service.prepare_memory(
+                conversation_id,
+                db,
+                exclude_message_ids=(user_message_id, ai_message_id),
+                summary_checkpoint=summary_checkpoint if summary else None
+            )
+        
+        # 获取AI流式响应（首块立即发送，之后按时间窗口合并小块）
+        async for chunk in coalesce_chunks(langchain_ai_service.generate_response(
+            conversation_id=conversation_id,
+            user_input=user_input,
+            system_prompt=system_prompt,
+            session_prompt=session_prompt,
+            character_id=character_id,
+            user_message_id=user_message_id,
+            ai_message_id=ai_message_id,
+            summary=summary,
+            summary_checkpoint=summary_checkpoint
+        )):
+            response_parts.append(chunk)
+            buffer.append(chunk)
+    except asyncio.CancelledError:
+        content = "".join(response_parts)
+        stream_registry.record_truncated(token_counter.count(content))
+        await _store_reply(
+            conversation_id, ai_message_id, content, summary_checkpoint,
+            truncated=True
+        )
+        final_event['truncated'] = True
+        raise
+    except Exception as e:
+        logger.error(f"生成回复失败: {e}")
+        content = "抱歉，AI服务出现错误，请稍后重试。"
+        final_event = {'type': 'error', 'message': content}
+        await _store_reply(
+            conversation_id, ai_message_id, content, summary_checkpoint,
+            failed=True
+        )
+    else:
+        content = "".join(response_parts)
+        stream_registry.record_completed(token_counter.count(content))
+        await _store_reply(conversation_id, ai_message_id, content, summary_checkpoint)
+    finally:
+        if not buffer.done:
+            stream_registry.finish(buffer, final_event)
+        if ticket is not None:
+            ticket.release()
+
 @router.post("/conversations/{conversation_id}/messages")
 async def send_message(
     conversation_id: str,
     message_data: MessageCreate,
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
     current_user: Optional[User] = Depends(get_current_user_optional)
 ):
     """发送消息并获取AI回复（流式响应）"""
     # 验证会话权限
     if current_user:
-        conversation = db.query(Conversation).options(
+        conversation = await db.scalar(select(Conversation).options(
             joinedload(Conversation.character)
-        ).filter(
+        ).where(
             Conversation.id == conversation_id,
             Conversation.user_id == current_user.id
-        ).first()
+        ))
     else:
         # 游客只能访问游客会话
-        conversation = db.query(Conversation).options(
+        conversation = await db.scalar(select(Conversation).options(
             joinedload(Conversation.character)
-        ).filter(
+        ).where(
             Conversation.id == conversation_id,
             Conversation.user_id.is_(None)
-        ).first()
+        ))
     
     if not conversation:
         raise HTTPException(
@@ -156,44 +347,47 @@ async def send_message(
             detail="会话不存在"
         )
     
+    # 准入控制：限制全局、每用户和每游客IP同时进行的生成数
+    ticket = None
+    if settings.admission_enabled:
+        if current_user:
+            principal, limit = f"user:{current_user.id}", settings.admission_max_per_user
+        else:
+            principal, limit = f"guest:{client_ip(request)}", settings.admission_max_per_guest_ip
+        try:
+            ticket = await admission_controller.acquire(principal, limit)
+        except AdmissionRejected as e:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="当前请求过多，请稍后重试",
+                headers={"Retry-After": str(e.retry_after)}
+            )
+    
     try:
         # 保存用户消息
+        user_message_id = generate_id()
         user_message = Message(
-            id=generate_id(),
+            id=user_message_id,
             conversation_id=conversation_id,
             role="user",
             content=message_data.content,
             created_at=datetime.utcnow()
         )
+        await db.run_sync(assign_token_counts, user_message)
         db.add(user_message)
         
         # 更新会话最后消息时间
         conversation.last_message_at = datetime.utcnow()
-        db.commit()
-        
-        # 获取历史消息用于构建上下文
-        history_messages = db.query(Message).filter(
-            Message.conversation_id == conversation_id
-        ).order_by(Message.created_at).all()
-        
-        # 构建消息历史
-        message_history = []
-        for msg in history_messages[:-1]:  # 排除刚添加的用户消息
-            message_history.append({
-                "role": msg.role,
-                "content": msg.content
-            })
+        await db.commit()
         
-        # 添加当前用户消息
-        message_history.append({
-            "role": "user",
-            "content": message_data.content
-        })
-        
-        # 构建系统提示词
+        # 系统提示词（角色设定与会话设定由AI服务组合并缓存模板）
+        character_id = conversation.character_id
         system_prompt = conversation.character.system_prompt
-        if conversation.session_prompt:
-            system_prompt += f"\n\n{conversation.session_prompt}"
+        session_prompt = conversation.session_prompt
+        
+        # 滚动摘要（有检查点时才是模型生成的摘要）代替检查点之前的历史
+        summary_checkpoint = conversation.summary_checkpoint_tokens
+        summary = conversation.summary if summary_checkpoint is not None else None
         
         # 创建AI回复消息记录
         ai_message_id = generate_id()
@@ -202,78 +396,139 @@ async def send_message(
             conversation_id=conversation_id,
             role="assistant",
             content="",  # 初始为空，流式更新
+            status="generating",
             created_at=datetime.utcnow()
         )
+        await db.run_sync(assign_token_counts, ai_message)
         db.add(ai_message)
-        db.commit()
+        await db.commit()
+        list_totals.invalidate("messages", scope=conversation_id)
+        
+        # 回复在后台任务中生成并写入回复缓冲，响应只是缓冲的订阅者：
+        # 客户端断线后可凭 Last-Event-ID 续传，不需要重新生成
+        buffer = stream_registry.start(ai_message_id)
+        task = asyncio.create_task(_generate_reply(
+            buffer,
+            ticket,
+            conversation_id=conversation_id,
+            user_input=message_data.content,
+            system_prompt=system_prompt,
+            session_prompt=session_prompt,
+            character_id=character_id,
+            user_message_id=user_message_id,
+            ai_message_id=ai_message_id,
+            summary=summary,
+            summary_checkpoint=summary_checkpoint
+        ))
+        # 客户端在响应开始读取前断开时不会订阅缓冲，由超时取消生成、释放准入名额
+        stream_registry.attach(buffer, task)
         
-        # 流式响应生成器
         async def generate_response():
-            full_response = ""
-            
             # 发送初始消息信息
-            yield f"data: {json.dumps({'type': 'message_start', 'message_id': ai_message_id})}\n\n"
-            
+            yield sse_event({'type': 'message_start', 'message_id': ai_message_id}, event_id=0)
+            # 客户端断开时立即关闭订阅，最后一个订阅者离开会取消上游生成
+            stream = stream_registry.follow(buffer, 0, partial(_load_reply, ai_message_id))
             try:
-                # 获取AI流式响应
-                async for chunk in langchain_ai_service.generate_response(
-                    conversation_id=conversation_id,
-                    user_input=message_data.content,
-                    system_prompt=system_prompt
-                ):
-                    full_response += chunk
-                    
-                    # 发送内容块
-                    yield f"data: {json.dumps({'type': 'content', 'content': chunk})}\n\n"
-                
-                # 更新数据库中的完整回复
-                ai_message.content = full_response
-                conversation.last_message_at = datetime.utcnow()
-                db.commit()
-                
-                # 发送完成信号
-                yield f"data: {json.dumps({'type': 'message_end', 'message_id': ai_message_id})}\n\n"
-                
-            except Exception as e:
-                # 发送错误信息
-                error_msg = "抱歉，AI服务出现错误，请稍后重试。"
-                ai_message.content = error_msg
-                db.commit()
-                
-                yield f"data: {json.dumps({'type': 'error', 'message': error_msg})}\n\n"
-            
-            # 结束流
-            yield "data: [DONE]\n\n"
+                async for frame in stream:
+                    yield frame
+            finally:
+                await stream.aclose()
         
         return StreamingResponse(
             generate_response(),
             media_type="text/plain",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Content-Type": "text/event-stream"
-            }
+            headers=SSE_HEADERS
         )
         
     except Exception as e:
-        db.rollback()
+        if ticket is not None:
+            ticket.release()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="发送消息失败，请稍后重试"
         )
 
+@router.get("/conversations/{conversation_id}/messages/{message_id}/stream")
+async def resume_message_stream(
+    conversation_id: str,
+    message_id: str,
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Optional[User] = Depends(get_current_user_optional)
+):
+    """断线重连：从 Last-Event-ID 之后继续接收AI回复（不会重新生成）"""
+    # 验证会话权限
+    if current_user:
+        conversation = await db.scalar(select(Conversation).where(
+            Conversation.id == conversation_id,
+            Conversation.user_id == current_user.id
+        ))
+    else:
+        # 游客只能访问游客会话
+        conversation = await db.scalar(select(Conversation).where(
+            Conversation.id == conversation_id,
+            Conversation.user_id.is_(None)
+        ))
+    
+    if not conversation:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="会话不存在"
+        )
+    
+    message_status = await db.scalar(select(Message.status).where(
+        Message.id == message_id,
+        Message.conversation_id == conversation_id,
+        Message.role == "assistant"
+    ))
+    if not message_status:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="消息不存在"
+        )
+    
+    # 回复缓冲只在生成它的进程中：其他进程上仍在生成的回复无法续传；生成中途进程已
+    # 退出的回复超时后标记为失败，返回已保存的内容
+    buffer = stream_registry.get(message_id)
+    if buffer is None and message_status == "generating":
+        if not await db.run_sync(fail_stale_replies, message_id):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="回复尚未生成完成，请稍后重试"
+            )
+    
+    # 事件ID为客户端已收到的回复字符数
+    try:
+        offset = int(last_event_id) if last_event_id else 0
+    except ValueError:
+        offset = -1
+    if offset < 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Last-Event-ID无效"
+        )
+    
+    return StreamingResponse(
+        stream_registry.follow(
+            buffer, offset, partial(_load_reply, message_id), resume=True
+        ),
+        media_type="text/plain",
+        headers=SSE_HEADERS
+    )
+
 @router.delete("/messages/{message_id}", response_model=SuccessResponse)
 async def delete_message(
     message_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """删除消息"""
     # 查找消息并验证权限
-    message = db.query(Message).join(Conversation).filter(
+    message = await db.scalar(select(Message).join(Conversation).where(
         Message.id == message_id,
         Conversation.user_id == current_user.id
-    ).first()
+    ))
     
     if not message:
         raise HTTPException(
@@ -282,13 +537,18 @@ async def delete_message(
         )
     
     try:
-        db.delete(message)
-        db.commit()
+        await db.run_sync(shift_cumulative_after_delete, message)
+        conversation_id = message.conversation_id
+        await db.delete(message)
+        await db.commit()
+        list_totals.invalidate("messages", scope=conversation_id)
+        # 进程内记忆中还有被删除的消息，下一轮从数据库重建
+        langchain_ai_service.forget_memory(conversation_id)
         
         return SuccessResponse(message="消息删除成功")
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="删除消息失败，请稍后重试"
@@ -59,9 +59,14 @@ class CharacterResponse(CharacterBase):
 
 class CharacterListResponse(BaseModel):
     characters: List[CharacterResponse]
-    total: int
+    # count=none 时为空；total_estimated 表示总数为估算值
+    total: Optional[int] = None
+    total_estimated: bool = False
     page: int
     limit: int
+    # 游标分页：传回 cursor 参数取下一页/上一页，没有更多时为空
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
 
 # 会话相关模式
 class ConversationBase(BaseModel):
@@ -86,9 +91,14 @@ class ConversationResponse(BaseModel):
 
 class ConversationListResponse(BaseModel):
     conversations: List[ConversationResponse]
-    total: int
+    # count=none 时为空；total_estimated 表示总数为估算值
+    total: Optional[int] = None
+    total_estimated: bool = False
     page: int
     limit: int
+    # 游标分页：传回 cursor 参数取下一页/上一页，没有更多时为空
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
 
 # 消息相关模式
 class MessageBase(BaseModel):
@@ -108,6 +118,8 @@ class ConversationMessageCreate(BaseModel):
 class MessageResponse(MessageBase):
     id: str
     conversation_id: str
+    truncated: bool = False
+    status: str = "completed"
     created_at: datetime
     
     class Config:
@@ -115,9 +127,14 @@ class MessageResponse(MessageBase):
 
 class MessageListResponse(BaseModel):
     messages: List[MessageResponse]
-    total: int
+    # count=none 时为空；total_estimated 表示总数为估算值
+    total: Optional[int] = None
+    total_estimated: bool = False
     page: int
     limit: int
+    # 游标分页：传回 cursor 参数取下一页/上一页，没有更多时为空
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
 
 # 聊天响应模式
 class ChatResponse(BaseModel):
@@ -0,0 +1,158 @@
+"""相同在途生成请求的合并（single-flight）
+
+同一提示键的并发请求只向上游发起一次流式调用，产出的分块通过每个订阅者自己的
+有界队列分发。晚加入的订阅者先补读已产出的分块；消费过慢导致队列写满的订阅者
+不会阻塞上游，而是转为从共享的已产出分块中追赶。最后一个订阅者离开时取消上游请求。
+"""
+
+import asyncio
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Set
+from config import settings
+
+_END = object()
+
+
+class _Flight:
+    """一次在途的上游生成"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.chunks: List[str] = []
+        self.subscribers: Set["_Subscriber"] = set()
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.task: Optional[asyncio.Task] = None
+        # 每产出一个分块替换一次，供追赶中的订阅者等待
+        self.progress = asyncio.Event()
+
+    def notify(self):
+        self.progress.set()
+        self.progress = asyncio.Event()
+
+
+class _Subscriber:
+    def __init__(self, flight: _Flight, queue_size: int):
+        self.flight = flight
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        # 加入前已产出的分块直接从共享列表读取
+        self.backlog = len(flight.chunks)
+        self.lagging = False
+
+    def offer(self, item: Any) -> bool:
+        """非阻塞投递，队列写满时转为追赶模式"""
+        if self.lagging:
+            return False
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            self.lagging = True
+            return False
+
+    async def __aiter__(self):
+        flight = self.flight
+        position = 0
+        while position < self.backlog:
+            yield flight.chunks[position]
+            position += 1
+
+        while True:
+            if not self.lagging or not self.queue.empty():
+                item = await self.queue.get()
+                if item is _END:
+                    break
+                position += 1
+                yield item
+                continue
+
+            # 追赶模式：队列已清空，直接读取共享分块
+            if position < len(flight.chunks):
+                yield flight.chunks[position]
+                position += 1
+            elif flight.done:
+                break
+            else:
+                await flight.progress.wait()
+
+        if flight.error is not None:
+            raise flight.error
+
+
+class SingleFlight:
+    """按提示键合并并发的流式生成"""
+
+    def __init__(self, enabled: Optional[bool] = None, queue_size: Optional[int] = None):
+        self.enabled = settings.single_flight_enabled if enabled is None else enabled
+        self.queue_size = queue_size or settings.single_flight_queue_size
+        self._flights: Dict[str, _Flight] = {}
+        self.flights = 0
+        self.coalesced = 0
+        self.lagging = 0
+        self.abandoned = 0
+
+    async def _produce(self, flight: _Flight, generate: Callable[[], AsyncGenerator[str, None]]):
+        try:
+            async for chunk in generate():
+                flight.chunks.append(chunk)
+                for subscriber in list(flight.subscribers):
+                    was_lagging = subscriber.lagging
+                    subscriber.offer(chunk)
+                    if subscriber.lagging and not was_lagging:
+                        self.lagging += 1
+                flight.notify()
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            for subscriber in list(flight.subscribers):
+                subscriber.offer(_END)
+            flight.notify()
+
+    async def stream(
+        self,
+        key: str,
+        generate: Callable[[], AsyncGenerator[str, None]]
+    ) -> AsyncGenerator[str, None]:
+        """订阅 key 对应的在途生成，没有时以 generate() 发起一个"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(key)
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._produce(flight, generate))
+            self.flights += 1
+        else:
+            self.coalesced += 1
+
+        subscriber = _Subscriber(flight, self.queue_size)
+        flight.subscribers.add(subscriber)
+        try:
+            async for chunk in subscriber:
+                yield chunk
+        finally:
+            flight.subscribers.discard(subscriber)
+            if not flight.subscribers and not flight.done:
+                # 没有订阅者了，取消上游请求
+                self.abandoned += 1
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "subscribers": sum(len(flight.subscribers) for flight in self._flights.values()),
+            "flights": self.flights,
+            "coalesced": self.coalesced,
+            "lagging_subscribers": self.lagging,
+            "abandoned": self.abandoned
+        }
+
+
+# 全局single-flight实例
+single_flight = SingleFlight()
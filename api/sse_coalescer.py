@@ -0,0 +1,82 @@
+"""SSE输出前的分块合并
+
+上游每个块往往只有一两个字符，逐块序列化和写出的开销很大。这里把上游块按时间窗口
+（interval_ms）或字节数（max_bytes）合并后再交给SSE写出：第一个块总是立即发出，
+保证首token延迟不变；之后窗口到期时即使上游暂时没有新块也会把缓冲发出去。
+"""
+
+import asyncio
+import time
+from typing import AsyncGenerator, AsyncIterable, Callable, List, Optional
+from config import settings
+
+
+async def coalesce_chunks(
+    source: AsyncIterable[str],
+    interval_ms: Optional[float] = None,
+    max_bytes: Optional[int] = None,
+    clock: Callable[[], float] = time.monotonic
+) -> AsyncGenerator[str, None]:
+    """合并上游文本块，interval_ms 和 max_bytes 都为0时原样透传"""
+    interval = (settings.sse_coalesce_interval_ms if interval_ms is None else interval_ms) / 1000
+    max_bytes = settings.sse_coalesce_max_bytes if max_bytes is None else max_bytes
+    if interval <= 0 and max_bytes <= 0:
+        async for chunk in source:
+            yield chunk
+        return
+
+    iterator = source.__aiter__()
+    buffer: List[str] = []
+    size = 0
+    deadline: Optional[float] = None
+    first = True
+    pending: Optional[asyncio.Future] = None
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = None if deadline is None else max(deadline - clock(), 0)
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # 窗口到期而上游暂时没有新块：先把缓冲发出去
+                yield "".join(buffer)
+                buffer, size, deadline = [], 0, None
+                continue
+
+            task, pending = pending, None
+            try:
+                chunk = task.result()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                if buffer:
+                    yield "".join(buffer)
+                    buffer = []
+                raise
+
+            if first:
+                first = False
+                yield chunk
+                continue
+
+            buffer.append(chunk)
+            size += len(chunk.encode("utf-8"))
+            if deadline is None and interval > 0:
+                deadline = clock() + interval
+            if (max_bytes > 0 and size >= max_bytes) or (deadline is not None and clock() >= deadline):
+                yield "".join(buffer)
+                buffer, size, deadline = [], 0, None
+
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None:
+            pending.cancel()
+            try:
+                await pending
+            except BaseException:
+                pass
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
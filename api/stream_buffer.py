@@ -0,0 +1,265 @@
+"""可续传的SSE回复流
+
+每条AI回复的生成在后台任务中进行，产出的内容块写入该消息的有界环形缓冲，HTTP响应
+只是缓冲的一个订阅者。内容帧的事件ID是截至该帧的回复字符数，客户端断线后带
+Last-Event-ID 重连即可从该位置续传：缓冲中还保留着的部分直接补发；已被环形缓冲
+挤出时等待生成结束，再从数据库中保存的内容截取，不会重新调用LLM。
+
+等待期间（例如首token前）按 sse_heartbeat_interval 发送注释行心跳，避免代理因
+连接空闲而断开。
+
+最后一个订阅者断开后等待 sse_cancel_grace_seconds 宽限期，期间没有重连才取消生成任务，上游请求随之取消，
+不再为没人接收的token付费；按近期完整回复的平均长度估算因此节省的token数。
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+from cache_utils import BoundedLRUCache
+from config import settings
+from fast_json import SSE_DONE, SSE_HEARTBEAT, sse_content, sse_event
+
+# 任务创建后响应最晚开始读取的时间（秒），宽限期更长时按宽限期
+UNCLAIMED_TIMEOUT_SECONDS = 1.0
+
+
+class StreamBuffer:
+    """单条AI回复的内容缓冲"""
+
+    def __init__(self, message_id: str, max_frames: int):
+        self.message_id = message_id
+        # (截至该帧的字符数, 文本)，只保留最近 max_frames 帧
+        self.frames: Deque[Tuple[int, str]] = deque(maxlen=max_frames)
+        self.length = 0
+        self.done = False
+        # 结束事件（message_end 或 error），续传时总是补发
+        self.final_event: Optional[Dict[str, Any]] = None
+        self.task: Optional[asyncio.Task] = None
+        self.subscribers = 0
+        # 宽限期内等待重连的取消定时器
+        self.cancel_handle: Optional[asyncio.TimerHandle] = None
+        # 每次有新内容或结束时替换，供订阅者等待
+        self.progress = asyncio.Event()
+
+    def _notify(self):
+        self.progress.set()
+        self.progress = asyncio.Event()
+
+    def append(self, chunk: str):
+        if not chunk:
+            return
+        self.length += len(chunk)
+        self.frames.append((self.length, chunk))
+        self._notify()
+
+    def finish(self, final_event: Dict[str, Any]):
+        self.done = True
+        self.final_event = final_event
+        self._notify()
+
+    def frames_after(self, offset: int) -> Optional[List[Tuple[int, str]]]:
+        """offset 之后的内容帧；所需内容已被挤出缓冲时返回 None"""
+        if offset >= self.length:
+            return []
+        if not self.frames:
+            return None
+        first_end, first_text = self.frames[0]
+        if offset < first_end - len(first_text):
+            return None
+
+        result = []
+        for end, text in self.frames:
+            if end <= offset:
+                continue
+            start = end - len(text)
+            result.append((end, text[offset - start:] if start < offset else text))
+        return result
+
+
+class StreamRegistry:
+    """进行中和刚结束的回复缓冲"""
+
+    def __init__(
+        self,
+        max_frames: Optional[int] = None,
+        retention_seconds: Optional[float] = None,
+        max_finished: Optional[int] = None,
+        heartbeat_interval: Optional[float] = None,
+        cancel_on_disconnect: Optional[bool] = None,
+        cancel_grace_seconds: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_frames = max_frames or settings.sse_resume_buffer_frames
+        self.heartbeat_interval = (
+            settings.sse_heartbeat_interval if heartbeat_interval is None else heartbeat_interval
+        )
+        self.cancel_on_disconnect = (
+            settings.sse_cancel_on_disconnect if cancel_on_disconnect is None else cancel_on_disconnect
+        )
+        self.cancel_grace_seconds = (
+            settings.sse_cancel_grace_seconds if cancel_grace_seconds is None else cancel_grace_seconds
+        )
+        self._active: Dict[str, StreamBuffer] = {}
+        # 已结束的缓冲保留一段时间，供稍晚的重连补发
+        self._finished = BoundedLRUCache(
+            max_entries=max_finished or settings.sse_resume_max_finished,
+            ttl_seconds=settings.sse_resume_retention_seconds if retention_seconds is None else retention_seconds,
+            clock=clock
+        )
+
+        self.streams = 0
+        self.resumes = 0
+        self.resumed_from_buffer = 0
+        self.resumed_from_storage = 0
+        self.heartbeats = 0
+        self.cancelled = 0
+        self.truncated = 0
+        self.truncated_tokens = 0
+        self.tokens_saved = 0
+        # 完整回复的平均token数，用于估算取消节省的token
+        self._avg_reply_tokens = float(settings.llm_rate_limit_completion_estimate)
+
+    def start(self, message_id: str) -> StreamBuffer:
+        buffer = StreamBuffer(message_id, self.max_frames)
+        self._active[message_id] = buffer
+        self.streams += 1
+        return buffer
+
+    def finish(self, buffer: StreamBuffer, final_event: Dict[str, Any]):
+        buffer.finish(final_event)
+        if self._active.get(buffer.message_id) is buffer:
+            del self._active[buffer.message_id]
+        self._finished.put(buffer.message_id, buffer)
+
+    def get(self, message_id: str) -> Optional[StreamBuffer]:
+        return self._active.get(message_id) or self._finished.get(message_id)
+
+    def attach(self, buffer: StreamBuffer, task: asyncio.Task):
+        """关联生成任务；响应开始读取前就断开的客户端不会订阅，同样按超时取消"""
+        buffer.task = task
+        if buffer.subscribers == 0:
+            self._schedule_cancel(buffer, max(self.cancel_grace_seconds, UNCLAIMED_TIMEOUT_SECONDS))
+
+    def _join(self, buffer: StreamBuffer):
+        buffer.subscribers += 1
+        if buffer.cancel_handle is not None:
+            # 宽限期内重连，不再取消
+            buffer.cancel_handle.cancel()
+            buffer.cancel_handle = None
+
+    def _leave(self, buffer: StreamBuffer):
+        buffer.subscribers -= 1
+        if buffer.subscribers == 0:
+            self._schedule_cancel(buffer, self.cancel_grace_seconds)
+
+    def _schedule_cancel(self, buffer: StreamBuffer, delay: float):
+        if buffer.done or buffer.task is None or not self.cancel_on_disconnect:
+            return
+        if delay > 0:
+            buffer.cancel_handle = asyncio.get_running_loop().call_later(delay, self._cancel, buffer)
+        else:
+            self._cancel(buffer)
+
+    def _cancel(self, buffer: StreamBuffer):
+        buffer.cancel_handle = None
+        if buffer.subscribers == 0 and not buffer.done and not buffer.task.done():
+            self.cancelled += 1
+            buffer.task.cancel()
+
+    def record_completed(self, tokens: int):
+        """完整生成的回复"""
+        self._avg_reply_tokens = 0.9 * self._avg_reply_tokens + 0.1 * tokens
+
+    def record_truncated(self, tokens: int):
+        """因断开被取消的回复，tokens 为取消前已生成的token数"""
+        self.truncated += 1
+        self.truncated_tokens += tokens
+        self.tokens_saved += max(0, round(self._avg_reply_tokens) - tokens)
+
+    async def _wait(self, buffer: StreamBuffer, progress: asyncio.Event) -> bool:
+        """等待新内容，超过心跳间隔返回 False"""
+        timeout = self.heartbeat_interval if self.heartbeat_interval > 0 else None
+        try:
+            await asyncio.wait_for(progress.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.heartbeats += 1
+            return False
+
+    async def follow(
+        self,
+        buffer: Optional[StreamBuffer],
+        offset: int,
+        load_content: Callable[[], Awaitable[Tuple[str, Dict[str, Any]]]],
+        resume: bool = False
+    ) -> AsyncGenerator[bytes, None]:
+        """从 offset 处开始输出SSE帧直到回复结束
+
+        await load_content() 返回数据库中保存的回复内容和结束事件，在缓冲不存在或已不含
+        所需内容时使用；结束事件为 None 表示回复尚未生成完成，此时不发送结束事件，客户端
+        稍后重连。
+        """
+        if resume:
+            self.resumes += 1
+        if buffer is not None:
+            self._join(buffer)
+        try:
+            while buffer is not None:
+                progress = buffer.progress
+                frames = buffer.frames_after(offset)
+                if frames is None:
+                    # 续传位置已被挤出缓冲：等生成结束后从数据库补发
+                    while not buffer.done:
+                        if not await self._wait(buffer, buffer.progress):
+                            yield SSE_HEARTBEAT
+                    break
+
+                for end, text in frames:
+                    yield sse_content(text, end)
+                    offset = end
+                if buffer.done and offset >= buffer.length:
+                    if resume:
+                        self.resumed_from_buffer += 1
+                    yield sse_event(buffer.final_event)
+                    yield SSE_DONE
+                    return
+                if not frames and not await self._wait(buffer, progress):
+                    yield SSE_HEARTBEAT
+        finally:
+            if buffer is not None:
+                self._leave(buffer)
+
+        if resume:
+            self.resumed_from_storage += 1
+        content, final_event = await load_content()
+        if buffer is not None:
+            # 生成已在本进程结束，以缓冲中的结束事件为准
+            final_event = buffer.final_event
+        if final_event is None:
+            return
+        if offset < len(content):
+            yield sse_content(content[offset:], len(content))
+        yield sse_event(final_event)
+        yield SSE_DONE
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": len(self._active),
+            "retained": len(self._finished),
+            "subscribers": sum(buffer.subscribers for buffer in self._active.values()),
+            "streams": self.streams,
+            "resumes": self.resumes,
+            "resumed_from_buffer": self.resumed_from_buffer,
+            "resumed_from_storage": self.resumed_from_storage,
+            "heartbeats": self.heartbeats,
+            "cancelled": self.cancelled,
+            "truncated": self.truncated,
+            "truncated_tokens": self.truncated_tokens,
+            "tokens_saved": self.tokens_saved,
+            "avg_reply_tokens": self._avg_reply_tokens
+        }
+
+
+# 全局回复流实例
+stream_registry = StreamRegistry()
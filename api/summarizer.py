@@ -0,0 +1,199 @@
+"""后台滚动会话摘要
+
+每隔若干轮或若干token，把"旧摘要 + 检查点之后的新消息"交给模型合并成新摘要，
+写回 Conversation.summary 并推进 summary_checkpoint_tokens。积压超过
+summary_max_input_tokens 时按该长度分段依次合并，每段完成后推进检查点。摘要在有界的异步
+工作池中生成，不占用聊天请求路径；构建上下文时用摘要替代检查点之前的历史。
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+from sqlalchemy import func, select, update
+from config import settings
+from database import AsyncSessionLocal
+from models import Conversation, Message
+from ai_service import ai_service
+from langchain_service import langchain_ai_service
+
+logger = logging.getLogger(__name__)
+
+SummarizeFn = Callable[[List[Dict[str, str]], int, Optional[str]], Awaitable[str]]
+
+
+class ConversationSummarizer:
+    """有界异步工作池驱动的增量摘要器"""
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        trigger_turns: Optional[int] = None,
+        trigger_tokens: Optional[int] = None,
+        max_input_tokens: Optional[int] = None,
+        summarize: Optional[SummarizeFn] = None,
+        session_factory: Callable = AsyncSessionLocal,
+        on_summarized: Optional[Callable[[str], None]] = None
+    ):
+        self.workers = workers or settings.summary_workers
+        self.queue_size = queue_size or settings.summary_queue_size
+        self.trigger_turns = trigger_turns or settings.summary_trigger_turns
+        self.trigger_tokens = trigger_tokens or settings.summary_trigger_tokens
+        self.max_input_tokens = max_input_tokens or settings.summary_max_input_tokens
+        self._summarize = summarize or ai_service.summarize
+        self._session_factory = session_factory
+        self._on_summarized = on_summarized
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._pending = set()
+        self.scheduled = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        """启动工作协程"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """停止工作协程，丢弃尚未处理的任务"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._pending.clear()
+
+    async def join(self):
+        """等待队列中的任务全部完成（测试用）"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    def maybe_schedule(
+        self,
+        db,
+        conversation_id: str,
+        head_tokens: Optional[int],
+        checkpoint_tokens: Optional[int]
+    ) -> bool:
+        """每轮对话结束后调用，达到轮数或token阈值时排队生成摘要"""
+        if not self.running or head_tokens is None or conversation_id in self._pending:
+            return False
+
+        checkpoint_tokens = checkpoint_tokens or 0
+        if head_tokens - checkpoint_tokens < self.trigger_tokens:
+            # 检查点之后的消息数（索引范围计数，最多约 2*trigger_turns 行）
+            new_messages = db.query(func.count(Message.id)).filter(
+                Message.conversation_id == conversation_id,
+                Message.cumulative_tokens > checkpoint_tokens
+            ).scalar()
+            if new_messages < self.trigger_turns * 2:
+                return False
+
+        return self.schedule(conversation_id)
+
+    def schedule(self, conversation_id: str) -> bool:
+        """把会话放入摘要队列，队列已满时放弃（下一轮会再次触发）"""
+        if not self.running or conversation_id in self._pending:
+            return False
+        try:
+            self._queue.put_nowait(conversation_id)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self._pending.add(conversation_id)
+        self.scheduled += 1
+        return True
+
+    async def _worker(self):
+        while True:
+            conversation_id = await self._queue.get()
+            try:
+                await self.summarize_conversation(conversation_id)
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"生成会话摘要失败 {conversation_id}: {e}")
+            finally:
+                self._pending.discard(conversation_id)
+                self._queue.task_done()
+
+    async def summarize_conversation(self, conversation_id: str) -> bool:
+        """把检查点之后的新消息分段合并进摘要，返回摘要是否有更新"""
+        summarized = False
+        while await self._summarize_next_chunk(conversation_id):
+            summarized = True
+
+        if summarized and self._on_summarized:
+            self._on_summarized(conversation_id)
+        return summarized
+
+    async def _summarize_next_chunk(self, conversation_id: str) -> bool:
+        """合并检查点之后最多 max_input_tokens 的消息（至少一条）并推进检查点"""
+        async with self._session_factory() as db:
+            conversation = await db.get(Conversation, conversation_id)
+            if not conversation:
+                return False
+
+            checkpoint = conversation.summary_checkpoint_tokens
+            previous_summary = conversation.summary if checkpoint is not None else None
+            checkpoint = checkpoint or 0
+
+            first = await db.scalar(select(func.min(Message.cumulative_tokens)).where(
+                Message.conversation_id == conversation_id,
+                Message.cumulative_tokens > checkpoint
+            ))
+            if first is None:
+                return False
+
+            # 控制单次摘要的输入长度，单条消息超过上限时也要整条纳入
+            end = max(checkpoint + self.max_input_tokens, first)
+            rows = (await db.execute(
+                select(Message.role, Message.content, Message.cumulative_tokens).where(
+                    Message.conversation_id == conversation_id,
+                    Message.cumulative_tokens > checkpoint,
+                    Message.cumulative_tokens <= end,
+                    Message.content != ""
+                ).order_by(Message.cumulative_tokens)
+            )).all()
+        if not rows:
+            return False
+
+        messages = [{"role": row.role, "content": row.content} for row in rows]
+        # 生成摘要期间不持有数据库连接
+        summary = await self._summarize(messages, settings.summary_max_length, previous_summary)
+        if not summary:
+            return False
+
+        async with self._session_factory() as db:
+            await db.execute(update(Conversation).where(Conversation.id == conversation_id).values(
+                summary=summary,
+                summary_checkpoint_tokens=rows[-1].cumulative_tokens
+            ))
+            await db.commit()
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": self.running,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "scheduled": self.scheduled,
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped
+        }
+
+
+# 全局摘要器实例（在应用生命周期中启动/停止）
+# 摘要推进后丢弃进程内记忆，下一轮只从检查点之后重建
+conversation_summarizer = ConversationSummarizer(on_summarized=langchain_ai_service.forget_memory)
@@ -0,0 +1,101 @@
+import asyncio
+from starlette.requests import Request
+from admission import AdmissionController, AdmissionRejected, client_ip
+
+
+def test_per_principal_cap_and_fair_order():
+    async def run():
+        controller = AdmissionController(max_concurrent=1, queue_size=10, max_wait=5)
+        holder = await controller.acquire("user:a", 2)
+        order = []
+
+        async def request(principal):
+            ticket = await controller.acquire(principal, 2)
+            order.append(principal)
+            ticket.release()
+
+        # 用户a先突发3个请求，b、c各1个：轮转出队，b、c不必等a的全部请求
+        tasks = [asyncio.create_task(request(p)) for p in ["user:a", "user:a", "user:a", "user:b", "user:c"]]
+        await asyncio.sleep(0)
+        assert controller.waiting == 5
+        holder.release()
+        await asyncio.gather(*tasks)
+        return order, controller
+
+    order, controller = asyncio.run(run())
+    assert order == ["user:a", "user:b", "user:c", "user:a", "user:a"]
+    assert controller.active == 0 and controller.waiting == 0
+    assert controller.wait_seconds.count == 6
+
+
+def test_queue_full_and_timeout_reject_with_retry_after():
+    async def run():
+        controller = AdmissionController(max_concurrent=1, queue_size=1, max_wait=0.05)
+        ticket = await controller.acquire("guest:1.1.1.1", 1)
+        waiting = asyncio.create_task(controller.acquire("guest:2.2.2.2", 1))
+        await asyncio.sleep(0)
+
+        try:
+            await controller.acquire("guest:3.3.3.3", 1)
+        except AdmissionRejected as e:
+            assert e.reason == "queue_full" and e.retry_after >= 1
+        else:
+            raise AssertionError("队列已满时应拒绝")
+
+        try:
+            await waiting
+        except AdmissionRejected as e:
+            assert e.reason == "timeout"
+        else:
+            raise AssertionError("等待超时应拒绝")
+        ticket.release()
+        return controller
+
+    controller = asyncio.run(run())
+    assert controller.rejected_queue_full == 1 and controller.rejected_timeout == 1
+    assert controller.waiting == 0 and controller.active == 0
+
+
+def test_same_guest_ip_waits_for_its_own_slot():
+    async def run():
+        controller = AdmissionController(max_concurrent=10, queue_size=10, max_wait=5)
+        first = await controller.acquire("guest:1.1.1.1", 1)
+        second = asyncio.create_task(controller.acquire("guest:1.1.1.1", 1))
+        # 其他IP不受影响
+        other = await controller.acquire("guest:2.2.2.2", 1)
+        await asyncio.sleep(0)
+        assert not second.done()
+        first.release()
+        (await second).release()
+        other.release()
+        return controller
+
+    controller = asyncio.run(run())
+    assert controller.active == 0
+    assert controller.queue_depth.count == 3
+
+
+def make_request(peer, forwarded=None):
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "headers": headers, "client": (peer, 50000)})
+
+
+def test_client_ip_behind_trusted_proxies():
+    # 不信任代理时使用对端地址，客户端填写的 X-Forwarded-For 被忽略
+    assert client_ip(make_request("10.0.0.2", "6.6.6.6"), trusted_proxy_hops=0) == "10.0.0.2"
+    # 一层代理：最右边的地址是代理看到的客户端，左边伪造的部分不使用
+    assert client_ip(make_request("10.0.0.2", "6.6.6.6, 1.2.3.4"), trusted_proxy_hops=1) == "1.2.3.4"
+    # 两层代理（CDN + nginx）
+    assert client_ip(make_request("10.0.0.2", "6.6.6.6, 1.2.3.4, 10.0.0.9"), trusted_proxy_hops=2) == "1.2.3.4"
+    # 没有经过代理的请求
+    assert client_ip(make_request("1.2.3.4"), trusted_proxy_hops=1) == "1.2.3.4"
+    # 地址数少于代理层数：头部可能整段伪造，使用对端地址
+    assert client_ip(make_request("10.0.0.2", "6.6.6.6"), trusted_proxy_hops=2) == "10.0.0.2"
+
+
+if __name__ == "__main__":
+    test_per_principal_cap_and_fair_order()
+    test_queue_full_and_timeout_reject_with_retry_after()
+    test_same_guest_ip_waits_for_its_own_slot()
+    test_client_ip_behind_trusted_proxies()
+    print("✅ 准入控制测试通过")
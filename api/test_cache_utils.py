@@ -0,0 +1,63 @@
+from cache_utils import BoundedLRUCache
+
+
+class FakeClock:
+    """可手动推进的时钟"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_lru_eviction_by_entries():
+    cache = BoundedLRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # a 变为最近使用
+    cache.put("c", 3)
+
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_eviction_by_bytes_and_resize():
+    cache = BoundedLRUCache(max_entries=10, max_bytes=10, sizeof=len)
+    cache.put("a", ["x"] * 4)
+    cache.put("b", ["x"] * 4)
+    assert cache.total_bytes == 8
+
+    # 原地增长后重新计量，超出预算时淘汰最旧的条目
+    value = cache.get("b")
+    value.extend(["x"] * 4)
+    cache.resize("b")
+
+    assert "a" not in cache
+    assert cache.total_bytes == 8
+
+
+def test_ttl_expiration_and_counters():
+    clock = FakeClock()
+    cache = BoundedLRUCache(max_entries=10, ttl_seconds=5, clock=clock)
+    cache.put("a", 1)
+
+    clock.now = 4
+    assert cache.get("a") == 1
+    clock.now = 10
+    assert cache.get("a") is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["expirations"] == 1
+    assert stats["entries"] == 0
+
+
+if __name__ == "__main__":
+    test_lru_eviction_by_entries()
+    test_eviction_by_bytes_and_resize()
+    test_ttl_expiration_and_counters()
+    print("✅ 缓存测试通过")
@@ -0,0 +1,119 @@
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import sessionmaker
+from database import Base
+from models import Character
+from character_search import (
+    apply_search, character_tags, ensure_search_index, rebuild_search_index, search_index, split_terms
+)
+
+CHARACTERS = [
+    ("elf", "精灵法师艾琳", "居住在森林深处的精灵，擅长治愈魔法"),
+    ("knight", "王城骑士", "守卫王城的年轻战士，向往冒险"),
+    ("forest", "守林人", "在森林里长大的猎人，熟悉精灵法师的传说"),
+    ("mage", "Elaine", "an elven mage who loves adventure"),
+    ("cute", "小萌", "可爱又聪明的女孩"),
+]
+
+
+def make_session(index_first=True):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    if index_first:
+        with engine.begin() as conn:
+            ensure_search_index(conn)
+    db = sessionmaker(bind=engine)()
+    for character_id, name, description in CHARACTERS:
+        db.add(Character(
+            id=character_id, name=name, description=description,
+            system_prompt="设定", greeting="你好", creator_id="user1"
+        ))
+    db.commit()
+    return db
+
+
+def search(db, keywords):
+    """按相关度（没有时按id）排序的结果；计数和翻页两种查询方式结果相同"""
+    results = []
+    for ordered in (False, True):
+        query, relevance = apply_search(select(Character.id), keywords, ordered=ordered)
+        if relevance is not None:
+            query = query.order_by(*relevance.order_by())
+        else:
+            query = query.order_by(Character.id)
+        results.append([row[0] for row in db.execute(query)])
+    assert results[0] == results[1]
+    return results[0]
+
+
+def indexed_tags(db):
+    rows = db.execute(select(search_index.c.rowid, search_index.c.tags)).all()
+    ids = dict(db.execute(text("SELECT rowid, id FROM characters")).all())
+    return {ids[rowid]: tags.split() for rowid, tags in rows}
+
+
+def test_indexed_tags_match_response_tags():
+    db = make_session()
+    expected = {
+        character_id: character_tags(name, description)
+        for character_id, name, description in CHARACTERS
+    }
+    assert indexed_tags(db) == expected
+    assert expected["elf"] == ["魔法", "精灵"]
+    assert expected["mage"] == ["角色扮演", "对话"]
+
+
+def test_full_text_search_ranks_name_matches_first():
+    db = make_session()
+    # 名称中出现的角色排在只有描述中出现的角色之前
+    assert search(db, "精灵法师") == ["elf", "forest"]
+    # 子串和前缀，不区分大小写
+    assert search(db, "ELV*") == ["mage"]
+    # 多个词都需出现
+    assert search(db, "精灵法师 猎人") == ["forest"]
+    # FTS5 语法字符按原文匹配
+    assert search(db, 'elven AND "mage') == []
+
+
+def test_short_terms_match_names_descriptions_and_tags():
+    db = make_session()
+    assert split_terms("精灵 法师艾琳 萌") == (["法师艾琳"], ["精灵", "萌"])
+    assert search(db, "冒险") == ["knight"]
+    # "战斗" 只出现在标签中
+    assert search(db, "战斗") == ["knight"]
+    assert search(db, "精灵 猎人") == ["forest"]
+    assert search(db, "EL") == ["mage"]
+    assert search(db, "%") == []
+
+
+def test_triggers_keep_index_in_sync():
+    db = make_session()
+    knight = db.get(Character, "knight")
+    knight.name = "精灵骑士"
+    db.delete(db.get(Character, "elf"))
+    db.commit()
+
+    assert search(db, "精灵法师") == ["forest"]
+    assert search(db, "精灵骑") == ["knight"]
+    assert indexed_tags(db)["knight"] == ["战斗", "精灵", "冒险"]
+
+    # 与 characters 表重建的结果一致
+    before = indexed_tags(db)
+    assert rebuild_search_index(db.connection()) == len(CHARACTERS) - 1
+    assert indexed_tags(db) == before
+
+
+def test_existing_characters_are_backfilled():
+    db = make_session(index_first=False)
+    assert ensure_search_index(db.connection())
+    assert not ensure_search_index(db.connection())
+    db.commit()
+    assert search(db, "精灵法师") == ["elf", "forest"]
+
+
+if __name__ == "__main__":
+    test_indexed_tags_match_response_tags()
+    test_full_text_search_ranks_name_matches_first()
+    test_short_terms_match_names_descriptions_and_tags()
+    test_triggers_keep_index_in_sync()
+    test_existing_characters_are_backfilled()
+    print("✅ 角色全文搜索测试通过")
@@ -0,0 +1,57 @@
+from context_window import (
+    CachedTokenCounter, ContextBudget, EstimateTokenCounter,
+    MESSAGE_OVERHEAD_TOKENS, build_context_window
+)
+
+
+class CountingEstimator(EstimateTokenCounter):
+    """记录调用次数的估算器"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def count(self, text: str) -> int:
+        self.calls += 1
+        return super().count(text)
+
+
+def test_estimator_counts_cjk_higher_than_chars_per_token():
+    counter = EstimateTokenCounter()
+    assert counter.count("") == 0
+    assert counter.count("hello world!") == 3
+    # 中文按字符计数而非4字符一个token
+    assert counter.count("你好世界") >= 4
+
+
+def test_window_keeps_newest_messages_within_budget():
+    counter = CachedTokenCounter(EstimateTokenCounter())
+    system = [{"role": "system", "content": "sys"}]
+    history = [{"role": "user", "content": f"m{i}" * 4} for i in range(10)]
+    per_message = counter.count_message(history[0])
+
+    budget = ContextBudget(context_tokens=100, reply_tokens=50)
+    available = budget.history_budget(counter.count_message(system[0]))
+    context = build_context_window(system, history, budget, counter)
+
+    assert context[0] is system[0]
+    assert context[1:] == history[-(available // per_message):]
+
+
+def test_token_counts_are_cached_per_message():
+    estimator = CountingEstimator()
+    counter = CachedTokenCounter(estimator)
+    history = [{"role": "user", "content": "同样的内容"} for _ in range(5)]
+
+    build_context_window([], history, ContextBudget(context_tokens=1000, reply_tokens=0), counter)
+    build_context_window([], history, ContextBudget(context_tokens=1000, reply_tokens=0), counter)
+
+    assert estimator.calls == 1
+    # 预先计算好的token_count直接复用
+    assert counter.count_message({"content": "x", "token_count": 7}) == 7 + MESSAGE_OVERHEAD_TOKENS
+
+
+if __name__ == "__main__":
+    test_estimator_counts_cjk_higher_than_chars_per_token()
+    test_window_keeps_newest_messages_within_budget()
+    test_token_counts_are_cached_per_message()
+    print("✅ 上下文窗口测试通过")
@@ -0,0 +1,45 @@
+import json
+import fast_json
+from fast_json import FastJSONResponse, SSE_DONE, dumps, sse_content, sse_event
+
+PAYLOAD = {"characters": [{"name": "精灵法师", "tags": ["魔法"], "chat_count": 3}], "total": 1, "score": 0.5}
+
+
+def without_orjson(func):
+    orjson_module, fast_json.orjson = fast_json.orjson, None
+    try:
+        return func()
+    finally:
+        fast_json.orjson = orjson_module
+
+
+def test_dumps_matches_stdlib_with_and_without_orjson():
+    expected = json.dumps(PAYLOAD, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    assert dumps(PAYLOAD) == expected
+    assert without_orjson(lambda: dumps(PAYLOAD)) == expected
+
+
+def test_response_renders_utf8_json():
+    response = FastJSONResponse(PAYLOAD)
+    assert response.media_type == "application/json"
+    assert json.loads(response.body) == PAYLOAD
+    assert "精灵法师".encode("utf-8") in response.body
+
+
+def test_sse_frames_parse_like_legacy_frames():
+    for chunk in ["你好", 'quote " and \\ backslash', "line\nbreak", ""]:
+        frame = sse_content(chunk)
+        assert frame.startswith(b"data: ") and frame.endswith(b"\n\n")
+        assert json.loads(frame[6:]) == {"type": "content", "content": chunk}
+        assert without_orjson(lambda: sse_content(chunk)) == frame
+
+    event = sse_event({"type": "message_end", "message_id": "m1"})
+    assert json.loads(event[6:]) == {"type": "message_end", "message_id": "m1"}
+    assert SSE_DONE == b"data: [DONE]\n\n"
+
+
+if __name__ == "__main__":
+    test_dumps_matches_stdlib_with_and_without_orjson()
+    test_response_renders_utf8_json()
+    test_sse_frames_parse_like_legacy_frames()
+    print("✅ 快速JSON序列化测试通过")
@@ -0,0 +1,195 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from database import Base
+from models import Conversation, Message
+from history_window import (
+    assign_token_counts, backfill_token_counts, load_history_window,
+    message_cost, shift_cumulative_after_delete, update_token_counts
+)
+
+
+def make_session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)()
+
+
+def add_messages(db, count, conversation_id="conv1"):
+    start = datetime.utcnow()
+    messages = []
+    for i in range(count):
+        message = Message(
+            id=f"m{i:04d}",
+            conversation_id=conversation_id,
+            role="user" if i % 2 == 0 else "assistant",
+            content=f"message number {i}",
+            created_at=start + timedelta(seconds=i)
+        )
+        assign_token_counts(db, message)
+        db.add(message)
+        db.flush()
+        messages.append(message)
+    db.commit()
+    return messages
+
+
+def test_prefix_sums_are_maintained_at_insert():
+    db = make_session()
+    messages = add_messages(db, 5)
+
+    running = 0
+    for message in messages:
+        running += message_cost(message.token_count)
+        assert message.cumulative_tokens == running
+
+
+def test_window_matches_linear_selection():
+    db = make_session()
+    messages = add_messages(db, 200)
+    budget = 100
+
+    # 线性方式从最新消息往前累加作为对照
+    expected, used = [], 0
+    for message in reversed(messages):
+        cost = message_cost(message.token_count)
+        if used + cost > budget:
+            break
+        expected.insert(0, message.id)
+        used += cost
+
+    rows = load_history_window(db, "conv1", budget)
+    assert [row.id for row in rows] == expected
+
+
+def test_window_excludes_ids_and_tracks_deletes():
+    db = make_session()
+    messages = add_messages(db, 10)
+
+    rows = load_history_window(db, "conv1", 10_000, exclude_message_ids=[messages[-1].id])
+    assert rows[-1].id == messages[-2].id
+
+    deleted = messages[3]
+    shift_cumulative_after_delete(db, deleted)
+    db.delete(deleted)
+    db.commit()
+
+    total = sum(message_cost(m.token_count) for m in messages if m is not deleted)
+    assert db.get(Message, messages[-1].id).cumulative_tokens == total
+
+
+def test_backfill_legacy_rows():
+    db = make_session()
+    messages = add_messages(db, 4)
+    for message in messages:
+        message.token_count = None
+        message.cumulative_tokens = None
+    db.commit()
+
+    assert len(load_history_window(db, "conv1", 10_000, fallback_limit=2)) == 2
+    assert backfill_token_counts(db) == 1
+    assert len(load_history_window(db, "conv1", 10_000)) == 4
+
+
+def test_delete_before_checkpoint_moves_checkpoint():
+    db = make_session()
+    db.add(Conversation(id="conv1", character_id="char1"))
+    messages = add_messages(db, 10)
+    # 前6条已被摘要
+    conversation = db.get(Conversation, "conv1")
+    conversation.summary_checkpoint_tokens = messages[5].cumulative_tokens
+    db.commit()
+
+    deleted = messages[2]
+    shift_cumulative_after_delete(db, deleted)
+    db.delete(deleted)
+    db.commit()
+
+    db.expire_all()
+    checkpoint = db.get(Conversation, "conv1").summary_checkpoint_tokens
+    assert checkpoint == db.get(Message, messages[5].id).cumulative_tokens
+    # 检查点之后尚未摘要的消息仍在上下文中
+    rows = load_history_window(db, "conv1", 10_000, after_tokens=checkpoint)
+    assert [row.id for row in rows] == [message.id for message in messages[6:]]
+
+    # 检查点之后的删除不影响检查点
+    deleted = messages[8]
+    shift_cumulative_after_delete(db, deleted)
+    db.delete(deleted)
+    db.commit()
+    db.expire_all()
+    assert db.get(Conversation, "conv1").summary_checkpoint_tokens == checkpoint
+
+
+def test_reply_finalized_after_interleaved_send():
+    db = make_session()
+    db.add(Conversation(id="conv1", character_id="char1"))
+    start = datetime.utcnow()
+
+    def write(message_id, role, content, seconds):
+        message = Message(
+            id=message_id, conversation_id="conv1", role=role, content=content,
+            created_at=start + timedelta(seconds=seconds)
+        )
+        assign_token_counts(db, message)
+        db.add(message)
+        db.commit()
+        return message
+
+    # 第一条回复生成期间又发送了一条消息
+    write("u1", "user", "first question", 0)
+    reply1 = write("a1", "assistant", "", 1)
+    write("u2", "user", "second question", 2)
+    reply2 = write("a2", "assistant", "", 3)
+
+    update_token_counts(db, reply1, "a much longer first answer " * 20)
+    db.commit()
+    update_token_counts(db, reply2, "short")
+    db.commit()
+
+    db.expire_all()
+    rows = db.query(Message).order_by(Message.created_at).all()
+    running = 0
+    for row in rows:
+        running += message_cost(row.token_count)
+        assert row.cumulative_tokens == running
+    rows = load_history_window(db, "conv1", 10_000)
+    assert [row.id for row in rows] == ["u1", "a1", "u2", "a2"]
+
+
+def test_concurrent_inserts_get_distinct_prefix_sums():
+    with tempfile.TemporaryDirectory() as workdir:
+        engine = create_engine(f"sqlite:///{os.path.join(workdir, 'history.db')}")
+        Base.metadata.create_all(bind=engine)
+        first, second = sessionmaker(bind=engine)(), sessionmaker(bind=engine)()
+        add_messages(first, 3)
+
+        # 两个请求都在对方写入之前计算前缀和
+        a = Message(id="a", conversation_id="conv1", role="user", content="from request a")
+        b = Message(id="b", conversation_id="conv1", role="user", content="from request b")
+        assign_token_counts(first, a)
+        assign_token_counts(second, b)
+        first.add(a)
+        first.commit()
+        second.add(b)
+        second.commit()
+
+        values = sorted(row[0] for row in first.query(Message.cumulative_tokens).filter(Message.id.in_(["a", "b"])))
+        head = first.query(Message).filter(Message.id == "m0002").one().cumulative_tokens
+        assert values == [head + message_cost(a.token_count), head + 2 * message_cost(a.token_count)]
+        first.close()
+        second.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    test_prefix_sums_are_maintained_at_insert()
+    test_window_matches_linear_selection()
+    test_window_excludes_ids_and_tracks_deletes()
+    test_backfill_legacy_rows()
+    test_delete_before_checkpoint_moves_checkpoint()
+    test_reply_finalized_after_interleaved_send()
+    test_concurrent_inserts_get_distinct_prefix_sums()
+    print("✅ 历史窗口测试通过")
@@ -0,0 +1,69 @@
+import asyncio
+import http.server
+import socketserver
+import threading
+import httpx
+from http_client import InstrumentedTransport
+
+
+class OkHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+
+def open_sockets(transport):
+    inner = transport._transport
+    return [
+        connection._connection._network_stream.get_extra_info("socket")
+        for connection in inner._pool.connections
+    ]
+
+
+def test_loop_change_closes_previous_pool():
+    server = LocalServer(("127.0.0.1", 0), OkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    transport = InstrumentedTransport()
+
+    async def fetch():
+        client = httpx.AsyncClient(transport=transport)
+        response = await client.get(url)
+        return response.text
+
+    try:
+        assert asyncio.run(fetch()) == "ok"
+        stale = transport._transport
+        sockets = open_sockets(transport)
+        assert len(sockets) == 1
+
+        # 第二个事件循环里的请求会换掉连接池，旧循环已关闭，旧连接要被直接释放
+        assert asyncio.run(fetch()) == "ok"
+        assert transport._transport is not stale
+        assert stale._pool.connections == []
+        assert all(sock.fileno() == -1 for sock in sockets)
+        assert transport.metrics.connections_opened == 2
+
+        # 应用关闭时同样可能已不在创建连接池的事件循环上
+        sockets = open_sockets(transport)
+        asyncio.run(transport.aclose())
+        assert all(sock.fileno() == -1 for sock in sockets)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    test_loop_change_closes_previous_pool()
+    print("✅ HTTP连接池测试通过")
@@ -0,0 +1,38 @@
+from bench_language_detector import SAMPLES, legacy_detect_language
+from language_detector import ConversationLanguageDetector, count_scripts, detect_language
+
+
+def test_matches_legacy_detector():
+    texts = list(SAMPLES.values()) + [
+        "", "Привет, как дела?", "مرحبا كيف حالك", "안녕하세요 반갑습니다",
+        "今日は晴れです", "hello 你好 👋", "ok"
+    ]
+    for text in texts:
+        assert detect_language(text) == legacy_detect_language(text), text
+
+
+def test_counts_all_scripts_in_one_pass():
+    counts = count_scripts("你好こんにちは안녕Приветabc")
+    assert counts == {"zh": 2, "ja": 5, "ko": 2, "ru": 6, "ar": 0}
+
+
+def test_conversation_detection_uses_full_text():
+    detector = ConversationLanguageDetector()
+    chinese = "这是一段足够长的中文消息内容"
+    # 以英文开头、主体是中文的长消息，以及相反的情况
+    mixed_zh = "By the way, " + "我想聊聊昨天看的那部电影，情节非常精彩" * 5
+    mixed_en = "你好！" + "I would like to talk about the movie we watched yesterday. " * 5
+
+    for text in (chinese, mixed_zh, mixed_en, "ok", chinese):
+        assert detector.detect("conv", text) == legacy_detect_language(text), text
+    stats = detector.stats()
+    assert stats["detections"] == 5
+    # zh -> zh -> en -> en -> zh
+    assert stats["language_switches"] == 2
+
+
+if __name__ == "__main__":
+    test_matches_legacy_detector()
+    test_counts_all_scripts_in_one_pass()
+    test_conversation_detection_uses_full_text()
+    print("✅ 语言检测测试通过")
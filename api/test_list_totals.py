@@ -0,0 +1,123 @@
+import asyncio
+import os
+import tempfile
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from database import Base
+from list_totals import ListTotals
+from models import Message
+
+
+def run_with_db(scenario):
+    """在临时SQLite库上执行 scenario(session)"""
+    async def main(path):
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        try:
+            async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+                return await scenario(db)
+        finally:
+            await engine.dispose()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        return asyncio.run(main(os.path.join(workdir, "test.db")))
+
+
+async def add_messages(db, conversation_id, count):
+    for i in range(count):
+        db.add(Message(id=f"{conversation_id}-{i}", conversation_id=conversation_id, role="user", content="hi"))
+    await db.commit()
+
+
+def messages_of(conversation_id):
+    return select(Message).where(Message.conversation_id == conversation_id)
+
+
+def test_cached_total_until_ttl_or_invalidation():
+    now = [0.0]
+
+    async def scenario(db):
+        totals = ListTotals(ttl_seconds=10, clock=lambda: now[0])
+        await add_messages(db, "a", 3)
+        results = [await totals.count(db, messages_of("a"), "messages", scope="a")]
+
+        # 缓存期内新增的记录不可见
+        await add_messages(db, "b", 1)
+        db.add(Message(id="a-new", conversation_id="a", role="user", content="hi"))
+        await db.commit()
+        results.append(await totals.count(db, messages_of("a"), "messages", scope="a"))
+
+        # 作废后重新计数
+        totals.invalidate("messages", scope="a")
+        results.append(await totals.count(db, messages_of("a"), "messages", scope="a"))
+
+        # 过期后重新计数（即使一直在读取）
+        db.add(Message(id="a-late", conversation_id="a", role="user", content="hi"))
+        await db.commit()
+        now[0] = 11.0
+        results.append(await totals.count(db, messages_of("a"), "messages", scope="a"))
+        return results, totals.stats()
+
+    results, stats = run_with_db(scenario)
+    assert results == [3, 3, 4, 5]
+    assert stats["queries"] == 3 and stats["hits"] == 1
+
+
+def test_invalidation_is_scoped():
+    totals = ListTotals(ttl_seconds=60)
+
+    async def scenario(db):
+        await add_messages(db, "a", 2)
+        await add_messages(db, "b", 5)
+        for scope in ("a", "b"):
+            await totals.count(db, messages_of(scope), "messages", scope=scope)
+        return totals.invalidate("messages", scope="a")
+
+    assert run_with_db(scenario) == 1
+    assert totals.stats()["entries"] == 1
+
+
+def test_count_racing_with_write_is_not_cached():
+    totals = ListTotals(ttl_seconds=60)
+    counted = []
+
+    async def racing_count(db, query):
+        # 计数期间有写入并作废了缓存
+        totals.invalidate("messages", scope="a")
+        counted.append(1)
+        return 7
+
+    totals._count = racing_count
+
+    async def scenario(db):
+        await totals.count(db, messages_of("a"), "messages", scope="a")
+        await totals.count(db, messages_of("a"), "messages", scope="a")
+
+    run_with_db(scenario)
+    assert len(counted) == 2
+
+
+def test_estimate_is_adjusted_and_recalibrated():
+    now = [0.0]
+
+    async def scenario(db):
+        totals = ListTotals(estimate_refresh_seconds=300, clock=lambda: now[0])
+        await add_messages(db, "a", 4)
+        results = [await totals.estimate(db, messages_of("a"), "a_messages")]
+        totals.adjust("a_messages", 2)
+        totals.adjust("a_messages", -1)
+        results.append(await totals.estimate(db, messages_of("a"), "a_messages"))
+        now[0] = 301.0
+        results.append(await totals.estimate(db, messages_of("a"), "a_messages"))
+        return results
+
+    assert run_with_db(scenario) == [4, 5, 4]
+
+
+if __name__ == "__main__":
+    test_cached_total_until_ttl_or_invalidation()
+    test_invalidation_is_scoped()
+    test_count_racing_with_write_is_not_cached()
+    test_estimate_is_adjusted_and_recalibrated()
+    print("✅ 列表总数缓存测试通过")
@@ -0,0 +1,100 @@
+import asyncio
+from llm_router import LLMBackend, LLMRouter, NoBackendAvailable
+from mock_llm_server import MockLLMConfig, MockLLMServer
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+async def collect(router: LLMRouter) -> str:
+    return "".join([chunk async for chunk in router.stream_chat(MESSAGES)])
+
+
+def make_backend(name: str, server: MockLLMServer, weight: float = 1.0) -> LLMBackend:
+    return LLMBackend(name=name, api_key="mock", model="mock-model", base_url=server.base_url, weight=weight)
+
+
+def test_failover_before_first_token():
+    with MockLLMServer(MockLLMConfig(error_rate=1.0, ttft=0.0)) as broken, \
+            MockLLMServer(MockLLMConfig(reply="ok from healthy", ttft=0.0)) as healthy:
+        router = LLMRouter([make_backend("broken", broken), make_backend("healthy", healthy)])
+
+        assert asyncio.run(collect(router)) == "ok from healthy"
+        assert router.failovers == 1
+        assert router.backends[0].failures == 1
+        # 失败过的后端得分变差后优先选择健康后端
+        assert router.ranked_backends()[0].name == "healthy"
+
+
+def test_routes_to_fastest_backend():
+    with MockLLMServer(MockLLMConfig(reply="slow", ttft=0.3)) as slow, \
+            MockLLMServer(MockLLMConfig(reply="fast", ttft=0.01)) as fast:
+        router = LLMRouter([make_backend("slow", slow), make_backend("fast", fast)])
+
+        async def run():
+            # 前两次分别探测两个后端，之后应稳定选择更快的后端
+            return [await collect(router) for _ in range(6)]
+
+        replies = asyncio.run(run())
+        assert set(replies[:2]) == {"slow", "fast"}
+        assert replies[2:] == ["fast"] * 4
+
+
+def test_first_token_timeout_fails_over():
+    with MockLLMServer(MockLLMConfig(reply="stalled", ttft=2.0)) as stalled, \
+            MockLLMServer(MockLLMConfig(reply="fallback", ttft=0.0)) as fallback:
+        router = LLMRouter(
+            [make_backend("stalled", stalled, weight=10), make_backend("fallback", fallback)],
+            first_token_timeout=0.3
+        )
+        assert asyncio.run(collect(router)) == "fallback"
+
+
+def test_all_backends_failing_raises():
+    with MockLLMServer(MockLLMConfig(error_rate=1.0, ttft=0.0)) as broken:
+        router = LLMRouter([make_backend("broken", broken)])
+        try:
+            asyncio.run(collect(router))
+        except Exception as e:
+            assert not isinstance(e, NoBackendAvailable)
+        else:
+            raise AssertionError("应当抛出上游错误")
+
+
+def test_hedge_wins_against_stalled_backend():
+    with MockLLMServer(MockLLMConfig(reply="stalled", ttft=2.0)) as stalled, \
+            MockLLMServer(MockLLMConfig(reply="hedged", ttft=0.0)) as fast:
+        router = LLMRouter(
+            [make_backend("stalled", stalled, weight=10), make_backend("fast", fast)],
+            hedge=True
+        )
+        # 以往首token约50ms，超过其百分位即补发
+        router.backends[0].ttft_samples.extend([0.05] * 20)
+
+        assert asyncio.run(collect(router)) == "hedged"
+        stats = router.stats()["hedging"]
+        assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+        assert stats["hedge_rate"] == 1.0 and stats["win_rate"] == 1.0
+        assert stats["extra_prompt_tokens"] > 0
+        # 落败请求被取消，不计为后端失败
+        assert router.backends[0].failures == 0
+        assert router.backends[0].in_flight == 0 and router.backends[1].in_flight == 0
+
+
+def test_no_hedge_when_first_token_is_fast():
+    with MockLLMServer(MockLLMConfig(reply="quick", ttft=0.0)) as quick:
+        router = LLMRouter([make_backend("quick", quick)], hedge=True)
+        router.backends[0].ttft_samples.extend([0.5] * 20)
+
+        assert asyncio.run(collect(router)) == "quick"
+        assert router.hedges == 0
+        assert quick.config.requests == 1
+
+
+if __name__ == "__main__":
+    test_failover_before_first_token()
+    test_routes_to_fastest_backend()
+    test_first_token_timeout_fails_over()
+    test_all_backends_failing_raises()
+    test_hedge_wins_against_stalled_backend()
+    test_no_hedge_when_first_token_is_fast()
+    print("✅ LLM路由测试通过")
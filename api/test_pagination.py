@@ -0,0 +1,143 @@
+import asyncio
+import os
+import tempfile
+from datetime import datetime, timedelta
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from database import Base
+from models import Character, Message
+from pagination import KeysetOrder, paginate
+from routers.characters import CHARACTER_ORDERS
+
+MESSAGE_ORDER = KeysetOrder("time", Message.created_at, Message.id)
+
+
+def run_with_db(scenario):
+    """在临时SQLite库上执行 scenario(session)"""
+    async def main(path):
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        try:
+            async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+                return await scenario(db)
+        finally:
+            await engine.dispose()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        return asyncio.run(main(os.path.join(workdir, "test.db")))
+
+
+async def add_characters(db, count=23):
+    # created_at 使用服务端默认值（不含微秒），chat_count 有大量重复值
+    for i in range(count):
+        db.add(Character(
+            id=f"c{i:03d}", name=f"角色{i % 7}", description="描述", system_prompt="设定", greeting="你好",
+            creator_id="u1", is_public=True, chat_count=i % 4
+        ))
+    await db.commit()
+
+
+async def walk(db, query, order, limit, direction="next_cursor", cursor=None):
+    """沿游标翻到尽头，返回每页的id列表"""
+    pages = []
+    while True:
+        page = await paginate(db, query, order, limit, cursor=cursor)
+        pages.append([item.id for item in page.items])
+        cursor = getattr(page, direction)
+        if cursor is None:
+            return pages
+
+
+def expected_ids(items, order):
+    keys = [column.key for column in order.columns]
+    return [item.id for item in sorted(items, key=lambda item: [getattr(item, key) for key in keys], reverse=order.descending)]
+
+
+def test_cursor_walk_matches_full_sort_for_every_order():
+    async def scenario(db):
+        await add_characters(db)
+        everything = (await db.scalars(select(Character))).all()
+        results = {}
+        for name, order in CHARACTER_ORDERS.items():
+            results[name] = (await walk(db, select(Character), order, 5), expected_ids(everything, order))
+        return results
+
+    for name, (pages, expected) in run_with_db(scenario).items():
+        assert [len(page) for page in pages] == [5, 5, 5, 5, 3], name
+        assert sum(pages, []) == expected, name
+
+
+def test_backward_walk_returns_same_pages():
+    async def scenario(db):
+        await add_characters(db)
+        order = CHARACTER_ORDERS["popular"]
+        forward = await walk(db, select(Character), order, 5)
+        # 从最后一页往前翻
+        last = await paginate(db, select(Character), order, 5, page=5)
+        backward = await walk(db, select(Character), order, 5, direction="prev_cursor", cursor=last.prev_cursor)
+        return forward, [item.id for item in last.items], backward
+
+    forward, last, backward = run_with_db(scenario)
+    assert last == forward[-1]
+    assert list(reversed(backward)) == forward[:-1]
+
+
+def test_page_mode_returns_cursor_to_continue():
+    async def scenario(db):
+        await add_characters(db)
+        order = CHARACTER_ORDERS["latest"]
+        second = await paginate(db, select(Character), order, 5, page=2)
+        third = await paginate(db, select(Character), order, 5, cursor=second.next_cursor)
+        by_page = await paginate(db, select(Character), order, 5, page=3)
+        first = await paginate(db, select(Character), order, 5)
+        return second, third, by_page, first
+
+    second, third, by_page, first = run_with_db(scenario)
+    assert [c.id for c in third.items] == [c.id for c in by_page.items]
+    assert second.prev_cursor is not None
+    assert first.prev_cursor is None and first.next_cursor is not None
+
+
+def test_microsecond_timestamps_do_not_repeat_or_skip():
+    async def scenario(db):
+        start = datetime(2024, 1, 1, 12, 0, 0)
+        for i in range(12):
+            # 两条消息共用一个时间戳，需要按id区分
+            db.add(Message(
+                id=f"m{i:02d}", conversation_id="conv", role="user", content="hi",
+                created_at=start + timedelta(microseconds=(i // 2) * 250)
+            ))
+        await db.commit()
+        return await walk(db, select(Message), MESSAGE_ORDER, 4)
+
+    pages = run_with_db(scenario)
+    assert sum(pages, []) == [f"m{i:02d}" for i in range(12)]
+
+
+def test_invalid_or_foreign_cursor_is_rejected():
+    async def scenario(db):
+        await add_characters(db, count=6)
+        page = await paginate(db, select(Character), CHARACTER_ORDERS["name"], 2)
+        errors = []
+        for order, cursor in [
+            (CHARACTER_ORDERS["name"], "not-a-cursor"),
+            (CHARACTER_ORDERS["latest"], page.next_cursor)
+        ]:
+            with pytest.raises(HTTPException) as exc_info:
+                await paginate(db, select(Character), order, 2, cursor=cursor)
+            errors.append(exc_info.value.status_code)
+        return errors
+
+    assert run_with_db(scenario) == [400, 400]
+
+
+if __name__ == "__main__":
+    test_cursor_walk_matches_full_sort_for_every_order()
+    test_backward_walk_returns_same_pages()
+    test_page_mode_returns_cursor_to_continue()
+    test_microsecond_timestamps_do_not_repeat_or_skip()
+    test_invalid_or_foreign_cursor_is_rejected()
+    print("✅ 游标分页测试通过")
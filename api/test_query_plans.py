@@ -0,0 +1,223 @@
+"""查询计划回归测试
+
+在带示例数据的临时库上直接调用各路由处理函数和它们使用的数据库辅助函数，记录实际
+执行的每条SQL，再用相同的参数执行 EXPLAIN QUERY PLAN：任何一条退化为全表扫描或
+需要临时B树排序（USE TEMP B-TREE）都视为失败。新增或修改查询后若缺少合适的索引，
+这里会指出具体的语句和计划。
+
+全文搜索（MATCH）只对命中的记录排序，不检查临时B树。
+"""
+
+import asyncio
+import os
+import re
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from auth_utils import authenticate_user
+from character_search import ensure_search_index
+from database import Base
+from history_window import last_cumulative_tokens, load_history_window
+from langchain_service import langchain_ai_service
+from models import Character, Conversation, Message, User
+from routers import characters, conversations, messages
+from schemas import CharacterCreate, CharacterUpdate, ConversationCreate
+
+DESCRIPTION = "居住在森林深处的一位精灵法师"
+SYSTEM_PROMPT = "你是一位温和而博学的精灵法师"
+GREETING = "你好，旅行者"
+
+USERS = 20
+CHARACTERS = 400
+CONVERSATIONS = 200
+MESSAGES_PER_CONVERSATION = 12
+
+# 全表扫描："SCAN 表名"（不带 USING INDEX）
+FULL_SCAN = re.compile(r"^SCAN (\w+)(?: AS \w+)?$")
+
+
+def seed(conn):
+    now = datetime.utcnow()
+    conn.execute(insert(User), [
+        {"id": f"u{i:03d}", "email": f"user{i}@example.com", "username": f"用户{i}",
+         "password_hash": "x"}
+        for i in range(USERS)
+    ])
+    conn.execute(insert(Character), [
+        {"id": f"c{i:04d}", "name": f"角色{i % 37}", "description": DESCRIPTION if i % 3 else "守卫王城的年轻骑士，忠诚而勇敢",
+         "system_prompt": SYSTEM_PROMPT, "greeting": GREETING, "creator_id": f"u{i % USERS:03d}",
+         "is_public": i % 5 != 0, "chat_count": i % 17, "created_at": now - timedelta(minutes=i)}
+        for i in range(CHARACTERS)
+    ])
+    conn.execute(insert(Conversation), [
+        {"id": f"v{i:04d}", "user_id": f"u{i % USERS:03d}" if i % 4 else None,
+         "character_id": f"c{i % CHARACTERS:04d}", "summary": "对话",
+         "last_message_at": now - timedelta(minutes=i), "created_at": now - timedelta(hours=1, minutes=i)}
+        for i in range(CONVERSATIONS)
+    ])
+    conn.execute(insert(Message), [
+        {"id": f"m{i:04d}-{j:02d}", "conversation_id": f"v{i:04d}",
+         "role": "user" if j % 2 == 0 else "assistant", "content": f"消息{j}",
+         "token_count": 3, "cumulative_tokens": (j + 1) * 7,
+         "created_at": now - timedelta(minutes=i, seconds=MESSAGES_PER_CONVERSATION - j)}
+        for i in range(CONVERSATIONS)
+        for j in range(MESSAGES_PER_CONVERSATION)
+    ])
+
+
+async def exercise(db):
+    """按用户可触发的方式调用各个查询"""
+    user = await db.get(User, "u001")
+    guest_conversation, user_conversation = "v0000", "v0001"
+
+    # 登录时按邮箱查找用户（不存在的邮箱，不涉及密码校验）
+    await authenticate_user(db, "nobody@example.com", "secret")
+
+    # 角色列表：三种排序 × 游客/登录用户，页码、游标和搜索
+    for sort in characters.CHARACTER_ORDERS:
+        for current_user in (None, user):
+            first = await characters.get_characters(
+                page=1, limit=20, search=None, sort=sort, cursor=None, count="exact",
+                db=db, current_user=current_user
+            )
+            await characters.get_characters(
+                page=1, limit=20, search=None, sort=sort, cursor=first.next_cursor, count="none",
+                db=db, current_user=current_user
+            )
+            await characters.get_characters(
+                page=3, limit=20, search=None, sort=sort, cursor=None, count="none",
+                db=db, current_user=current_user
+            )
+        for search in ("精灵法师", "精灵"):
+            await characters.get_characters(
+                page=1, limit=20, search=search, sort=sort, cursor=None, count="exact",
+                db=db, current_user=None
+            )
+    for current_user in (None, user):
+        found = await characters.get_characters(
+            page=1, limit=5, search="精灵法师 森林", sort=None, cursor=None, count="exact",
+            db=db, current_user=current_user
+        )
+        await characters.get_characters(
+            page=1, limit=5, search="精灵法师 森林", sort="relevance", cursor=found.next_cursor, count="none",
+            db=db, current_user=current_user
+        )
+    await characters.get_characters(
+        page=1, limit=20, search=None, sort="latest", cursor=None, count="estimated",
+        db=db, current_user=None
+    )
+    mine = await characters.get_my_characters(page=1, limit=5, cursor=None, count="exact", db=db, current_user=user)
+    await characters.get_my_characters(page=1, limit=5, cursor=mine.next_cursor, count="none", db=db, current_user=user)
+
+    # 角色增删改查
+    created = await characters.create_character(
+        CharacterCreate(name="新角色", description=DESCRIPTION, system_prompt=SYSTEM_PROMPT, greeting=GREETING),
+        db=db, current_user=user
+    )
+    await characters.get_character(created.id, db=db, current_user=user)
+    await characters.update_character(created.id, CharacterUpdate(is_public=False), db=db, current_user=user)
+    await characters.delete_character(created.id, db=db, current_user=user)
+
+    # 会话
+    listed = await conversations.get_conversations(
+        page=1, limit=3, character_id=None, cursor=None, count="exact", db=db, current_user=user
+    )
+    await conversations.get_conversations(
+        page=1, limit=3, character_id=None, cursor=listed.next_cursor, count="none", db=db, current_user=user
+    )
+    await conversations.get_conversations(
+        page=1, limit=3, character_id="c0001", cursor=None, count="exact", db=db, current_user=user
+    )
+    await conversations.get_conversation(user_conversation, db=db, current_user=user)
+    await conversations.update_conversation_summary(user_conversation, "新摘要", db=db, current_user=user)
+    new_conversation = await messages.create_conversation(
+        ConversationCreate(character_id="c0002"), db=db, current_user=user
+    )
+    await conversations.delete_conversation(new_conversation.id, db=db, current_user=user)
+
+    # 消息列表、续传校验、记忆重建、保存回复和删除消息（维护累计token数）
+    for conversation_id, current_user in ((guest_conversation, None), (user_conversation, user)):
+        page = await messages.get_messages(
+            conversation_id, page=1, limit=5, cursor=None, count="exact", db=db, current_user=current_user
+        )
+        await messages.get_messages(
+            conversation_id, page=1, limit=5, cursor=page.next_cursor, count="none",
+            db=db, current_user=current_user
+        )
+        await messages.resume_message_stream(
+            conversation_id, page.messages[1].id, last_event_id=None, db=db, current_user=current_user
+        )
+
+    langchain_ai_service.forget_memory(user_conversation)
+    await langchain_ai_service.prepare_memory(user_conversation, db, exclude_message_ids=("m0001-11",))
+    await langchain_ai_service.prepare_memory(user_conversation, db, exclude_message_ids=("m0001-11",))
+    await db.run_sync(lambda session: load_history_window(session, user_conversation, 10, after_tokens=14))
+    await db.run_sync(last_cumulative_tokens, user_conversation)
+    await db.run_sync(
+        messages._save_reply, user_conversation, "m0001-11", "较长的一段回复内容", None
+    )
+    await messages.delete_message("m0001-03", db=db, current_user=user)
+    await db.run_sync(messages.fail_stale_replies)
+    await db.run_sync(messages.fail_stale_replies, "m0001-09")
+
+
+def capture_queries(path):
+    """执行所有查询，返回 [(SQL, 参数)]"""
+    statements = []
+
+    async def main():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(ensure_search_index)
+            await conn.run_sync(seed)
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if not executemany and statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                statements.append((statement, tuple(parameters)))
+
+        event.listen(engine.sync_engine, "before_cursor_execute", record)
+        try:
+            async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+                await exercise(db)
+        finally:
+            await engine.dispose()
+
+    asyncio.run(main())
+    return statements
+
+
+def plan_problems(path, statements):
+    """[(SQL, 计划中的问题行)]"""
+    problems = []
+    conn = sqlite3.connect(path)
+    try:
+        for statement, parameters in statements:
+            plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + statement, parameters)]
+            full_text = " MATCH " in statement
+            bad = [
+                detail for detail in plan
+                if ("USE TEMP B-TREE" in detail and not full_text) or FULL_SCAN.match(detail)
+            ]
+            if bad:
+                problems.append((" ".join(statement.split()), bad))
+    finally:
+        conn.close()
+    return problems
+
+
+def test_router_queries_use_indexes():
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "plans.db")
+        statements = capture_queries(path)
+        problems = plan_problems(path, statements)
+
+    assert len(statements) > 50
+    assert not problems, "\n\n".join(f"{sql}\n  -> {bad}" for sql, bad in problems)
+
+
+if __name__ == "__main__":
+    test_router_queries_use_indexes()
+    print("✅ 查询计划回归测试通过")
@@ -0,0 +1,154 @@
+import asyncio
+from context_window import token_counter
+from llm_router import LLMBackend, LLMRouter
+from mock_llm_server import MockLLMConfig, MockLLMServer
+from rate_limiter import ModelRateLimit, RateLimitExceeded, UpstreamRateLimiter
+
+
+class FakeClock:
+    """假时钟：sleep 只推进时间并记录等待时长"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def make_limit(clock, **limits):
+    return ModelRateLimit("test", clock=clock, sleep=clock.sleep, **limits)
+
+
+def test_rpm_delays_until_refill():
+    clock = FakeClock()
+    limit = make_limit(clock, rpm=2)
+
+    async def run():
+        for _ in range(3):
+            await limit.acquire(0, max_wait=60)
+
+    asyncio.run(run())
+    # 每分钟2次，第3次需等待30秒补充1次
+    assert clock.sleeps == [30.0]
+    assert limit.admitted == 3 and limit.delayed == 1
+
+
+def test_usage_refunds_unused_reservation():
+    clock = FakeClock()
+    limit = make_limit(clock, tpm=1000)
+
+    async def run():
+        reservation = await limit.acquire(800, max_wait=0)
+        # 实际只用了300，退回500
+        reservation.settle(300)
+        await limit.acquire(600, max_wait=0)
+
+    asyncio.run(run())
+    assert clock.sleeps == []
+    assert limit.tokens.level == 100
+
+
+def test_overuse_creates_debt_and_rejects_beyond_max_wait():
+    clock = FakeClock()
+    limit = make_limit(clock, tpm=600)
+
+    async def run():
+        reservation = await limit.acquire(100, max_wait=0)
+        reservation.settle(1200)
+        # 余额为 600-1200=-600，需等待 (100+600)/10 = 70 秒
+        try:
+            await limit.acquire(100, max_wait=10)
+        except RateLimitExceeded as e:
+            assert e.retry_after == 70
+        else:
+            raise AssertionError("超过最长等待应拒绝")
+        await limit.acquire(100, max_wait=70)
+
+    asyncio.run(run())
+    assert clock.sleeps == [70]
+    assert limit.rejected == 1
+
+
+def test_limits_resolve_by_model_then_provider():
+    clock = FakeClock()
+    limiter = UpstreamRateLimiter(
+        limits={"openrouter": {"rpm": 10}, "openrouter:big-model": {"tpm": 1000}},
+        clock=clock, sleep=clock.sleep
+    )
+    assert limiter.get("openrouter", "big-model").name == "openrouter:big-model"
+    assert limiter.get("openrouter", "other") is limiter.get("openrouter", "another")
+    assert limiter.get("openai", "gpt") is None
+
+
+def test_router_fails_over_when_budget_exhausted_and_settles_usage():
+    with MockLLMServer(MockLLMConfig(reply="first", ttft=0.0)) as first, \
+            MockLLMServer(MockLLMConfig(reply="second", ttft=0.0)) as second:
+        limiter = UpstreamRateLimiter(limits={"first": {"rpm": 1, "tpm": 100000}})
+        router = LLMRouter(
+            [
+                LLMBackend(name="first", api_key="mock", model="m", base_url=first.base_url, weight=10),
+                LLMBackend(name="second", api_key="mock", model="m", base_url=second.base_url)
+            ],
+            rate_limiter=limiter
+        )
+        # 让 second 明显更慢，正常情况下总是先选 first
+        router.backends[1].ewma_ttft = 10.0
+
+        async def run():
+            return [
+                "".join([chunk async for chunk in router.stream_chat([{"role": "user", "content": "hi"}])])
+                for _ in range(2)
+            ]
+
+        assert asyncio.run(run()) == ["first", "second"]
+        # 本地预算不足不计为后端失败
+        assert router.backends[0].failures == 0
+        stats = limiter.stats()["first"]
+        assert stats["rejected"] == 1
+        # 以上游返回的 usage 结算：10个提示词token + 3个输出块
+        assert stats["tokens_used"] == 13
+
+
+def test_cancelled_attempt_settles_reservation():
+    with MockLLMServer(MockLLMConfig(reply="slow", ttft=2.0)) as slow:
+        limiter = UpstreamRateLimiter(limits={"slow": {"tpm": 100000}})
+        router = LLMRouter(
+            [LLMBackend(name="slow", api_key="mock", model="m", base_url=slow.base_url)],
+            rate_limiter=limiter
+        )
+        backend = router.backends[0]
+
+        async def run():
+            attempt = asyncio.create_task(router._attempt(backend, [{"role": "user", "content": "hi"}], None, {}))
+            await asyncio.sleep(0.2)
+            assert limiter.stats()["slow"]["tokens_reserved"] > 0
+            attempt.cancel()
+            try:
+                await attempt
+            except asyncio.CancelledError:
+                pass
+            else:
+                raise AssertionError("应当被取消")
+
+        asyncio.run(run())
+        stats = limiter.stats()["slow"]
+        # 首块之前被取消：只按提示词结算，其余预留退回
+        assert stats["tokens_used"] == token_counter.count_message({"role": "user", "content": "hi"})
+        assert stats["tokens_used"] < stats["tokens_reserved"]
+        assert stats["tokens_available"] >= 100000 - stats["tokens_used"]
+        assert backend.in_flight == 0
+
+
+if __name__ == "__main__":
+    test_rpm_delays_until_refill()
+    test_usage_refunds_unused_reservation()
+    test_overuse_creates_debt_and_rejects_beyond_max_wait()
+    test_limits_resolve_by_model_then_provider()
+    test_router_fails_over_when_budget_exhausted_and_settles_usage()
+    test_cancelled_attempt_settles_reservation()
+    print("✅ 限流测试通过")
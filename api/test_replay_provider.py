@@ -0,0 +1,87 @@
+import asyncio
+import glob
+import json
+import os
+import tempfile
+import time
+from openai import AsyncOpenAI
+from ai_service import AIService
+from llm_router import LLMBackend, LLMRouter
+from mock_llm_server import MockLLMConfig, MockLLMServer
+from replay_provider import CassetteNotFound, RecordingClient, ReplayClient
+
+MESSAGES = [{"role": "system", "content": "你是小明"}, {"role": "user", "content": "你好"}]
+
+
+def make_service(client) -> AIService:
+    service = AIService()
+    service.router = LLMRouter([LLMBackend(name="test", api_key="", model="mock-model", client=client)])
+    return service
+
+
+async def collect(service: AIService) -> str:
+    return "".join([chunk async for chunk in service.generate_response(MESSAGES)])
+
+
+def record(directory: str, reply: str, ttft: float):
+    with MockLLMServer(MockLLMConfig(reply=reply, ttft=ttft, tokens_per_second=200)) as server:
+        upstream = AsyncOpenAI(api_key="mock", base_url=server.base_url)
+        service = make_service(RecordingClient(upstream, directory))
+
+        async def run():
+            return await collect(service), await service.summarize(MESSAGES, max_length=50)
+
+        return asyncio.run(run())
+
+
+def timed_replay(directory: str, speed: float):
+    service = make_service(ReplayClient(directory, speed=speed))
+    started = time.perf_counter()
+    text = asyncio.run(collect(service))
+    return text, time.perf_counter() - started
+
+
+def test_record_then_replay_at_different_speeds():
+    with tempfile.TemporaryDirectory() as directory:
+        recorded, summary = record(directory, reply="录制下来的回复", ttft=0.3)
+        assert recorded == "录制下来的回复"
+
+        paths = glob.glob(os.path.join(directory, "stream-*.json"))
+        assert len(paths) == 1
+        with open(paths[0], encoding="utf-8") as f:
+            cassette = json.load(f)
+        # 首块的间隔即首token延迟
+        assert cassette["chunks"][0]["delay"] >= 0.25
+
+        original, original_seconds = timed_replay(directory, speed=1)
+        fast, fast_seconds = timed_replay(directory, speed=10)
+        instant, instant_seconds = timed_replay(directory, speed=0)
+        assert original == fast == instant == recorded
+        assert original_seconds >= 0.25
+        assert fast_seconds < original_seconds / 2
+        assert instant_seconds < 0.1
+
+        # 非流式调用（摘要）同样可以回放
+        replay_service = make_service(ReplayClient(directory, speed=0))
+        assert asyncio.run(replay_service.summarize(MESSAGES, max_length=50)) == summary
+
+
+def test_missing_cassette_raises():
+    with tempfile.TemporaryDirectory() as directory:
+        router = LLMRouter([LLMBackend(name="replay", api_key="", model="mock-model", client=ReplayClient(directory))])
+
+        async def run():
+            return [chunk async for chunk in router.stream_chat(MESSAGES)]
+
+        try:
+            asyncio.run(run())
+        except CassetteNotFound:
+            pass
+        else:
+            raise AssertionError("没有录制时应报错")
+
+
+if __name__ == "__main__":
+    test_record_then_replay_at_different_speeds()
+    test_missing_cassette_raises()
+    print("✅ 录制回放测试通过")
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import tempfile
+from llm_router import LLMBackend, LLMRouter
+from mock_llm_server import MockLLMConfig, MockLLMServer
+from response_cache import ResponseCache, response_cache_key
+
+MESSAGES = [{"role": "system", "content": "你是小明"}, {"role": "user", "content": "你好"}]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+async def collect(stream) -> list:
+    return [chunk async for chunk in stream]
+
+
+def test_key_covers_model_messages_and_generation_params():
+    params = {"temperature": 0.7, "max_tokens": 1000}
+    key = response_cache_key("m", MESSAGES, params)
+    assert key == response_cache_key("m", [dict(m) for m in MESSAGES], dict(params))
+    assert key != response_cache_key("m", MESSAGES, {"temperature": 0.0, "max_tokens": 1000})
+    assert key != response_cache_key("other", MESSAGES, params)
+    assert key != response_cache_key("m", MESSAGES + [{"role": "user", "content": "?"}], params)
+    # 截断长度、采样和停止词不同的请求不能共用回复
+    assert key != response_cache_key("m", MESSAGES, {**params, "max_tokens": 50})
+    assert key != response_cache_key("m", MESSAGES, {**params, "top_p": 0.5})
+    assert key != response_cache_key("m", MESSAGES, {**params, "stop": ["\n"]})
+    # 只影响传输的参数不计入
+    assert key == response_cache_key("m", MESSAGES, {**params, "stream_options": {"include_usage": True}})
+
+
+def test_replays_cached_chunks_and_expires():
+    clock = FakeClock()
+    cache = ResponseCache(enabled=True, path="", ttl_seconds=60, clock=clock)
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        for chunk in ["你", "好", "呀"]:
+            yield chunk
+
+    async def run():
+        first = await collect(cache.stream("k", generate))
+        second = await collect(cache.stream("k", generate))
+        clock.now += 61
+        third = await collect(cache.stream("k", generate))
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    # 命中时按原始分块回放
+    assert first == second == third == ["你", "好", "呀"]
+    assert len(calls) == 2
+    stats = cache.stats()
+    assert stats["memory_hits"] == 1 and stats["misses"] == 2
+    assert stats["hit_ratio"] == 1 / 3
+
+
+def test_failed_stream_is_not_cached():
+    cache = ResponseCache(enabled=True, path="")
+
+    async def broken():
+        yield "半"
+        raise RuntimeError("upstream reset")
+
+    async def run():
+        try:
+            await collect(cache.stream("k", broken))
+        except RuntimeError:
+            pass
+        return await cache.lookup("k")
+
+    assert asyncio.run(run()) is None
+    assert cache.stores == 0
+
+
+def test_disk_tier_survives_restart():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.db")
+
+        async def generate():
+            yield "persisted"
+
+        first = ResponseCache(enabled=True, path=path)
+        asyncio.run(collect(first.stream("k", generate)))
+        first.close()
+
+        second = ResponseCache(enabled=True, path=path)
+        assert asyncio.run(collect(second.stream("k", generate))) == ["persisted"]
+        assert second.disk_hits == 1
+        second.close()
+
+
+def test_router_serves_repeated_prompt_from_cache():
+    with MockLLMServer(MockLLMConfig(reply="cached reply", ttft=0.05)) as server:
+        backend = LLMBackend(name="mock", api_key="mock", model="mock-model", base_url=server.base_url)
+        router = LLMRouter([backend], cache=ResponseCache(enabled=True, path=""))
+
+        async def run():
+            replies = [
+                "".join(await collect(router.stream_chat(MESSAGES, temperature=0.0)))
+                for _ in range(3)
+            ]
+            # 参数不同（例如限制了长度）的请求不命中
+            replies.append("".join(await collect(router.stream_chat(MESSAGES, temperature=0.0, max_tokens=50))))
+            return replies
+
+        assert asyncio.run(run()) == ["cached reply"] * 4
+        assert server.config.requests == 2
+        assert router.cache.stats()["latency_saved_ms"] > 0
+
+
+if __name__ == "__main__":
+    test_key_covers_model_messages_and_generation_params()
+    test_replays_cached_chunks_and_expires()
+    test_failed_stream_is_not_cached()
+    test_disk_tier_survives_restart()
+    test_router_serves_repeated_prompt_from_cache()
+    print("✅ 回复缓存测试通过")
@@ -0,0 +1,117 @@
+import asyncio
+from single_flight import SingleFlight
+
+
+def make_source(chunks, calls, delay=0.01, started=None):
+    async def generate():
+        calls.append(1)
+        try:
+            for chunk in chunks:
+                await asyncio.sleep(delay)
+                yield chunk
+        except asyncio.CancelledError:
+            if started is not None:
+                started.append("cancelled")
+            raise
+    return generate
+
+
+async def collect(stream, pause=0.0):
+    result = []
+    async for chunk in stream:
+        result.append(chunk)
+        if pause:
+            await asyncio.sleep(pause)
+    return result
+
+
+def test_concurrent_identical_requests_share_one_upstream():
+    calls = []
+    flight = SingleFlight(enabled=True, queue_size=16)
+    source = make_source(["a", "b", "c", "d"], calls)
+
+    async def run():
+        first = asyncio.create_task(collect(flight.stream("k", source)))
+        await asyncio.sleep(0.025)
+        # 晚加入的订阅者先补读已产出的分块
+        late = asyncio.create_task(collect(flight.stream("k", source)))
+        other = asyncio.create_task(collect(flight.stream("other", source)))
+        return await asyncio.gather(first, late, other)
+
+    first, late, other = asyncio.run(run())
+    assert first == late == other == ["a", "b", "c", "d"]
+    assert len(calls) == 2
+    assert flight.stats()["coalesced"] == 1
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_slow_consumer_catches_up_without_blocking_others():
+    calls = []
+    flight = SingleFlight(enabled=True, queue_size=2)
+    chunks = [str(i) for i in range(20)]
+    source = make_source(chunks, calls, delay=0.001)
+
+    async def run():
+        fast = asyncio.create_task(collect(flight.stream("k", source)))
+        slow = asyncio.create_task(collect(flight.stream("k", source), pause=0.01))
+        fast_result = await fast
+        # 快速订阅者不受慢速订阅者拖累
+        assert not slow.done()
+        return fast_result, await slow
+
+    fast, slow = asyncio.run(run())
+    assert fast == slow == chunks
+    assert flight.lagging == 1
+    assert len(calls) == 1
+
+
+def test_upstream_cancelled_when_last_subscriber_leaves():
+    calls, events = [], []
+    flight = SingleFlight(enabled=True)
+    source = make_source(["x"] * 100, calls, delay=0.01, started=events)
+
+    async def take(n):
+        stream = flight.stream("k", source)
+        result = []
+        async for chunk in stream:
+            result.append(chunk)
+            if len(result) == n:
+                break
+        await stream.aclose()
+        return result
+
+    async def run():
+        await asyncio.gather(take(2), take(3))
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert events == ["cancelled"]
+    assert flight.abandoned == 1
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_upstream_error_reaches_every_subscriber():
+    flight = SingleFlight(enabled=True)
+
+    async def broken():
+        yield "partial"
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream reset")
+
+    async def run():
+        return await asyncio.gather(
+            collect(flight.stream("k", broken)),
+            collect(flight.stream("k", broken)),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+if __name__ == "__main__":
+    test_concurrent_identical_requests_share_one_upstream()
+    test_slow_consumer_catches_up_without_blocking_others()
+    test_upstream_cancelled_when_last_subscriber_leaves()
+    test_upstream_error_reaches_every_subscriber()
+    print("✅ 请求合并测试通过")
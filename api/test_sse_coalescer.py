@@ -0,0 +1,83 @@
+import asyncio
+import time
+from sse_coalescer import coalesce_chunks
+
+
+async def ticking_source(chunks, delay):
+    for chunk in chunks:
+        await asyncio.sleep(delay)
+        yield chunk
+
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+
+async def timed(stream):
+    started = time.perf_counter()
+    result = []
+    async for chunk in stream:
+        result.append((chunk, time.perf_counter() - started))
+    return result
+
+
+def test_first_chunk_is_not_delayed_and_rest_are_merged():
+    chunks = [f"{i}" for i in range(20)]
+    result = asyncio.run(timed(coalesce_chunks(ticking_source(chunks, 0.005), interval_ms=50, max_bytes=0)))
+    texts = [text for text, _ in result]
+    assert "".join(texts) == "".join(chunks)
+    # 首块立即单独发出
+    assert texts[0] == "0"
+    assert result[0][1] < 0.03
+    assert len(texts) < len(chunks) / 2
+
+
+def test_flushes_by_size():
+    async def source():
+        for _ in range(10):
+            yield "abcd"
+
+    texts = asyncio.run(collect(coalesce_chunks(source(), interval_ms=10_000, max_bytes=8)))
+    assert texts == ["abcd"] + ["abcdabcd"] * 4 + ["abcd"]
+
+
+def test_window_flushes_when_upstream_stalls():
+    async def source():
+        yield "a"
+        yield "b"
+        # 上游停顿期间，已缓冲的内容应在窗口到期时发出
+        await asyncio.sleep(0.3)
+        yield "c"
+
+    result = asyncio.run(timed(coalesce_chunks(source(), interval_ms=20, max_bytes=0)))
+    assert [text for text, _ in result] == ["a", "b", "c"]
+    assert result[1][1] < 0.15
+
+
+def test_disabled_passes_through_and_errors_flush_buffer():
+    async def source():
+        yield "a"
+        yield "b"
+        raise RuntimeError("boom")
+
+    received = []
+
+    async def run():
+        try:
+            async for chunk in coalesce_chunks(source(), interval_ms=10_000, max_bytes=0):
+                received.append(chunk)
+        except RuntimeError:
+            return True
+        return False
+
+    assert asyncio.run(run())
+    assert received == ["a", "b"]
+    assert asyncio.run(collect(coalesce_chunks(ticking_source(["x", "y"], 0), interval_ms=0, max_bytes=0))) == ["x", "y"]
+
+
+if __name__ == "__main__":
+    test_first_chunk_is_not_delayed_and_rest_are_merged()
+    test_flushes_by_size()
+    test_window_flushes_when_upstream_stalls()
+    test_disabled_passes_through_and_errors_flush_buffer()
+    print("✅ SSE分块合并测试通过")
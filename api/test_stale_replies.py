@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from database import Base
+from history_window import assign_token_counts, message_cost
+from models import Conversation, Message
+from routers.messages import STALE_REPLY_MESSAGE, fail_stale_replies
+
+
+def make_session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add(Conversation(id="conv1", character_id="char1"))
+    return db
+
+
+def add_message(db, message_id, role, content, age_seconds, status="completed"):
+    message = Message(
+        id=message_id, conversation_id="conv1", role=role, content=content, status=status,
+        created_at=datetime.utcnow() - timedelta(seconds=age_seconds)
+    )
+    assign_token_counts(db, message)
+    db.add(message)
+    db.commit()
+
+
+def test_stale_generating_replies_are_ended():
+    db = make_session()
+    add_message(db, "u1", "user", "你好", 3600)
+    # 进程退出前没有保存任何内容的占位
+    add_message(db, "a1", "assistant", "", 3600, status="generating")
+    add_message(db, "u2", "user", "还在吗", 3500)
+    # 已保存部分内容的占位
+    add_message(db, "a2", "assistant", "我在这里，", 3500, status="generating")
+    # 仍在其他进程中生成
+    add_message(db, "u3", "user", "继续", 5)
+    add_message(db, "a3", "assistant", "", 5, status="generating")
+
+    assert fail_stale_replies(db, "a3") == 0
+    assert fail_stale_replies(db) == 2
+    assert fail_stale_replies(db) == 0
+
+    db.expire_all()
+    failed = db.get(Message, "a1")
+    assert failed.status == "failed" and failed.content == STALE_REPLY_MESSAGE
+    partial = db.get(Message, "a2")
+    assert partial.status == "completed" and partial.truncated and partial.content == "我在这里，"
+    assert db.get(Message, "a3").status == "generating"
+
+    # 失败提示计入前缀和，后续消息随之平移
+    running = 0
+    for message in db.query(Message).order_by(Message.created_at).all():
+        running += message_cost(message.token_count)
+        assert message.cumulative_tokens == running
+
+
+if __name__ == "__main__":
+    test_stale_generating_replies_are_ended()
+    print("✅ 中断回复清理测试通过")
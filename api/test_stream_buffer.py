@@ -0,0 +1,287 @@
+import asyncio
+import json
+from stream_buffer import StreamBuffer, StreamRegistry
+
+
+def parse(frames):
+    """SSE帧 -> [(事件ID, 数据)]，心跳记为 ("ping", None)"""
+    events = []
+    for frame in frames:
+        text = frame.decode("utf-8")
+        if text.startswith(":"):
+            events.append(("ping", None))
+            continue
+        event_id = None
+        for line in text.strip().split("\n"):
+            if line.startswith("id: "):
+                event_id = int(line[4:])
+            elif line.startswith("data: "):
+                data = line[6:]
+                events.append((event_id, data if data == "[DONE]" else json.loads(data)))
+    return events
+
+
+def content_of(events):
+    return "".join(data["content"] for _, data in events if isinstance(data, dict) and data["type"] == "content")
+
+
+def stored(content):
+    async def load_content():
+        return content, {"type": "message_end", "message_id": "m1"}
+    return load_content
+
+
+async def collect(stream):
+    return [frame async for frame in stream]
+
+
+async def produce(registry, buffer, chunks, delay=0.0):
+    for chunk in chunks:
+        await asyncio.sleep(delay)
+        buffer.append(chunk)
+    registry.finish(buffer, {"type": "message_end", "message_id": buffer.message_id})
+
+
+def test_frames_after_slices_partial_frame_and_detects_gap():
+    buffer = StreamBuffer("m1", max_frames=3)
+    for chunk in ["ab", "cd", "ef", "gh"]:
+        buffer.append(chunk)
+    # 只保留最后三帧：cd ef gh
+    assert buffer.frames_after(2) == [(4, "cd"), (6, "ef"), (8, "gh")]
+    assert buffer.frames_after(5) == [(6, "f"), (8, "gh")]
+    assert buffer.frames_after(8) == []
+    assert buffer.frames_after(1) is None
+
+
+def test_follow_streams_live_content_with_offset_ids():
+    async def scenario():
+        registry = StreamRegistry(max_frames=16, heartbeat_interval=0)
+        buffer = registry.start("m1")
+        producer = asyncio.create_task(produce(registry, buffer, ["你好", "，旅行", "者！"], delay=0.01))
+        frames = await collect(registry.follow(buffer, 0, stored("unused")))
+        await producer
+        return frames
+
+    events = parse(asyncio.run(scenario()))
+    assert content_of(events) == "你好，旅行者！"
+    ids = [event_id for event_id, data in events if isinstance(data, dict) and data["type"] == "content"]
+    assert ids == [2, 5, 7]
+    assert events[-2][1]["type"] == "message_end"
+    assert events[-1][1] == "[DONE]"
+
+
+def test_resume_from_buffer_after_disconnect():
+    async def scenario():
+        registry = StreamRegistry(max_frames=16, heartbeat_interval=0)
+        buffer = registry.start("m1")
+        producer = asyncio.create_task(produce(registry, buffer, ["one ", "two ", "three ", "four"], delay=0.01))
+
+        # 第一个连接收到两帧后断开
+        first = []
+        stream = registry.follow(buffer, 0, stored("unused"))
+        async for frame in stream:
+            first.append(frame)
+            if len(first) == 2:
+                break
+        await stream.aclose()
+        last_id = parse(first)[-1][0]
+
+        resumed = await collect(registry.follow(registry.get("m1"), last_id, stored("unused"), resume=True))
+        await producer
+        return first, resumed, registry.stats()
+
+    first, resumed, stats = asyncio.run(scenario())
+    assert content_of(parse(first)) + content_of(parse(resumed)) == "one two three four"
+    assert stats["resumed_from_buffer"] == 1 and stats["resumed_from_storage"] == 0
+
+
+def test_resume_falls_back_to_storage_when_buffer_overflowed():
+    async def scenario():
+        registry = StreamRegistry(max_frames=2, heartbeat_interval=0)
+        buffer = registry.start("m1")
+        for chunk in ["a", "b", "c"]:
+            buffer.append(chunk)
+        producer = asyncio.create_task(produce(registry, buffer, ["d", "e"], delay=0.01))
+        # 续传位置已被挤出环形缓冲：等生成结束后从持久化内容截取
+        frames = await collect(registry.follow(buffer, 0, stored("abcde"), resume=True))
+        await producer
+        return frames, registry.stats()
+
+    frames, stats = asyncio.run(scenario())
+    events = parse(frames)
+    assert content_of(events) == "abcde"
+    assert events[0][0] == 5
+    assert stats["resumed_from_storage"] == 1
+
+
+def test_unknown_stream_resumes_from_storage():
+    registry = StreamRegistry(heartbeat_interval=0)
+    events = parse(asyncio.run(collect(registry.follow(registry.get("m1"), 3, stored("hello world"), resume=True))))
+    assert content_of(events) == "lo world"
+    assert events[-2][1]["type"] == "message_end"
+
+
+def test_storage_fallback_only_ends_final_replies():
+    registry = StreamRegistry(heartbeat_interval=0)
+
+    async def generating():
+        return "", None
+
+    async def failed():
+        return "", {"type": "error", "message": "抱歉，AI服务出现错误，请稍后重试。"}
+
+    # 其他进程仍在生成：不发送结束事件，客户端稍后重连
+    assert asyncio.run(collect(registry.follow(None, 0, generating, resume=True))) == []
+    # 生成失败：以 error 事件结束，错误提示不作为回复内容
+    events = parse(asyncio.run(collect(registry.follow(None, 0, failed, resume=True))))
+    assert content_of(events) == ""
+    assert events[0][1]["type"] == "error" and events[-1][1] == "[DONE]"
+
+
+def test_heartbeat_while_waiting_for_first_token():
+    async def scenario():
+        registry = StreamRegistry(max_frames=16, heartbeat_interval=0.02)
+        buffer = registry.start("m1")
+        producer = asyncio.create_task(produce(registry, buffer, ["late"], delay=0.09))
+        frames = await collect(registry.follow(buffer, 0, stored("unused")))
+        await producer
+        return frames, registry.stats()
+
+    frames, stats = asyncio.run(scenario())
+    events = parse(frames)
+    pings = [event for event in events if event[0] == "ping"]
+    assert len(pings) >= 2 and stats["heartbeats"] == len(pings)
+    assert content_of(events) == "late"
+
+
+async def slow_producer(registry, buffer, chunks, delay, outcome):
+    try:
+        await produce(registry, buffer, chunks, delay)
+        outcome.append("completed")
+    except asyncio.CancelledError:
+        registry.record_truncated(buffer.length)
+        registry.finish(buffer, {"type": "message_end", "message_id": buffer.message_id, "truncated": True})
+        outcome.append("cancelled")
+        raise
+
+
+async def read_frames(registry, buffer, count):
+    """读取 count 个内容帧后断开"""
+    stream = registry.follow(buffer, 0, stored("unused"))
+    received = 0
+    async for frame in stream:
+        received += 1
+        if received == count:
+            break
+    await stream.aclose()
+
+
+def test_last_subscriber_leaving_cancels_generation():
+    async def scenario():
+        registry = StreamRegistry(max_frames=16, heartbeat_interval=0, cancel_grace_seconds=0)
+        buffer = registry.start("m1")
+        outcome = []
+        buffer.task = asyncio.create_task(slow_producer(registry, buffer, ["x"] * 50, 0.01, outcome))
+        await read_frames(registry, buffer, 2)
+        await asyncio.gather(buffer.task, return_exceptions=True)
+        return buffer, outcome, registry.stats()
+
+    buffer, outcome, stats = asyncio.run(scenario())
+    assert outcome == ["cancelled"]
+    assert buffer.final_event["truncated"] is True
+    assert stats["cancelled"] == 1 and stats["truncated"] == 1
+    assert stats["tokens_saved"] > 0
+
+
+def test_reconnect_within_grace_keeps_generation():
+    async def scenario():
+        registry = StreamRegistry(max_frames=64, heartbeat_interval=0, cancel_grace_seconds=0.1)
+        buffer = registry.start("m1")
+        outcome = []
+        buffer.task = asyncio.create_task(slow_producer(registry, buffer, ["x"] * 10, 0.01, outcome))
+        await read_frames(registry, buffer, 2)
+        await asyncio.sleep(0.02)
+        resumed = await collect(registry.follow(buffer, 2, stored("unused"), resume=True))
+        await buffer.task
+        return outcome, resumed, registry.stats()
+
+    outcome, resumed, stats = asyncio.run(scenario())
+    assert outcome == ["completed"]
+    assert content_of(parse(resumed)) == "x" * 8
+    assert stats["cancelled"] == 0
+
+
+def test_default_grace_resumes_complete_reply():
+    async def scenario():
+        # 默认配置：断开后不立即取消，宽限期内重连能拿到完整回复
+        registry = StreamRegistry(max_frames=64, heartbeat_interval=0)
+        buffer = registry.start("m1")
+        outcome = []
+        chunks = [f"{i} " for i in range(20)]
+        buffer.task = asyncio.create_task(slow_producer(registry, buffer, chunks, 0.01, outcome))
+        first = []
+        stream = registry.follow(buffer, 0, stored("unused"))
+        async for frame in stream:
+            first.append(frame)
+            if len(first) == 3:
+                break
+        await stream.aclose()
+        await asyncio.sleep(0.05)
+        last_id = parse(first)[-1][0]
+        resumed = await collect(registry.follow(registry.get("m1"), last_id, stored("unused"), resume=True))
+        await buffer.task
+        return registry, "".join(chunks), first, resumed
+
+    registry, reply, first, resumed = asyncio.run(scenario())
+    assert registry.cancel_grace_seconds >= 5
+    assert content_of(parse(first)) + content_of(parse(resumed)) == reply
+    assert "truncated" not in parse(resumed)[-2][1]
+    assert registry.stats()["cancelled"] == 0
+
+
+def test_unclaimed_stream_is_cancelled():
+    async def scenario():
+        registry = StreamRegistry(max_frames=64, heartbeat_interval=0, cancel_grace_seconds=0)
+        outcomes = []
+        # 响应从未开始读取（客户端在此之前断开）
+        unclaimed = registry.start("m1")
+        registry.attach(unclaimed, asyncio.create_task(slow_producer(registry, unclaimed, ["x"] * 500, 0.01, outcomes)))
+        # 正常读取的响应不受影响
+        claimed = registry.start("m2")
+        registry.attach(claimed, asyncio.create_task(slow_producer(registry, claimed, ["y"] * 150, 0.01, outcomes)))
+        frames = await collect(registry.follow(claimed, 0, stored("unused")))
+        await asyncio.gather(unclaimed.task, claimed.task, return_exceptions=True)
+        return unclaimed, frames, outcomes, registry.stats()
+
+    unclaimed, frames, outcomes, stats = asyncio.run(scenario())
+    assert sorted(outcomes) == ["cancelled", "completed"]
+    assert unclaimed.final_event["truncated"] is True
+    assert content_of(parse(frames)) == "y" * 150
+    assert stats["cancelled"] == 1
+
+
+def test_finished_buffers_expire():
+    now = [0.0]
+    registry = StreamRegistry(retention_seconds=60, heartbeat_interval=0, clock=lambda: now[0])
+    buffer = registry.start("m1")
+    buffer.append("hi")
+    registry.finish(buffer, {"type": "message_end", "message_id": "m1"})
+    assert registry.get("m1") is buffer
+    now[0] = 200.0
+    assert registry.get("m1") is None
+
+
+if __name__ == "__main__":
+    test_frames_after_slices_partial_frame_and_detects_gap()
+    test_follow_streams_live_content_with_offset_ids()
+    test_resume_from_buffer_after_disconnect()
+    test_resume_falls_back_to_storage_when_buffer_overflowed()
+    test_unknown_stream_resumes_from_storage()
+    test_storage_fallback_only_ends_final_replies()
+    test_heartbeat_while_waiting_for_first_token()
+    test_last_subscriber_leaving_cancels_generation()
+    test_reconnect_within_grace_keeps_generation()
+    test_default_grace_resumes_complete_reply()
+    test_unclaimed_stream_is_cancelled()
+    test_finished_buffers_expire()
+    print("✅ SSE断线续传测试通过")
@@ -0,0 +1,137 @@
+import asyncio
+import os
+import tempfile
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from database import Base
+from models import Conversation, Message
+from history_window import assign_token_counts, load_history_window
+from summarizer import ConversationSummarizer
+
+
+def make_session_factories(path):
+    """同一个临时库上的同步会话（准备数据、检查结果）和摘要器使用的异步会话"""
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    return sessionmaker(bind=engine), async_sessionmaker(async_engine, expire_on_commit=False), async_engine
+
+
+def add_turns(db, conversation_id, start, turns):
+    for i in range(start, start + turns * 2):
+        message = Message(
+            id=f"{conversation_id}-{i:04d}",
+            conversation_id=conversation_id,
+            role="user" if i % 2 == 0 else "assistant",
+            content=f"message {i}"
+        )
+        assign_token_counts(db, message)
+        db.add(message)
+        db.flush()
+    db.commit()
+
+
+def test_incremental_summary_advances_checkpoint():
+    workdir = tempfile.TemporaryDirectory()
+    session_factory, async_session_factory, async_engine = make_session_factories(
+        os.path.join(workdir.name, "summary.db")
+    )
+    calls = []
+
+    async def fake_summarize(messages, max_length, previous_summary):
+        calls.append((len(messages), previous_summary))
+        return f"summary of {messages[-1]['content']}"
+
+    async def run():
+        summarizer = ConversationSummarizer(
+            workers=1, queue_size=4, trigger_turns=2, trigger_tokens=10_000,
+            summarize=fake_summarize, session_factory=async_session_factory
+        )
+        await summarizer.start()
+        db = session_factory()
+        db.add(Conversation(id="c1", character_id="char1"))
+        db.commit()
+
+        # 未达到轮数阈值时不排队
+        add_turns(db, "c1", 0, 1)
+        head = db.get(Message, "c1-0001").cumulative_tokens
+        assert not summarizer.maybe_schedule(db, "c1", head, None)
+
+        add_turns(db, "c1", 2, 1)
+        head = db.get(Message, "c1-0003").cumulative_tokens
+        assert summarizer.maybe_schedule(db, "c1", head, None)
+        await summarizer.join()
+
+        db.expire_all()
+        conversation = db.get(Conversation, "c1")
+        assert conversation.summary == "summary of message 3"
+        assert conversation.summary_checkpoint_tokens == head
+
+        # 第二次只处理检查点之后的新消息，并带上旧摘要
+        add_turns(db, "c1", 4, 2)
+        head = db.get(Message, "c1-0007").cumulative_tokens
+        assert summarizer.maybe_schedule(db, "c1", head, conversation.summary_checkpoint_tokens)
+        await summarizer.join()
+        await summarizer.stop()
+
+        assert calls == [(4, None), (4, "summary of message 3")]
+        db.expire_all()
+        checkpoint = db.get(Conversation, "c1").summary_checkpoint_tokens
+        assert checkpoint == head
+
+        # 上下文只需加载检查点之后的消息
+        assert load_history_window(db, "c1", 10_000, after_tokens=checkpoint) == []
+        db.close()
+        await async_engine.dispose()
+
+    asyncio.run(run())
+    workdir.cleanup()
+
+
+def test_backlog_is_summarized_in_chunks():
+    workdir = tempfile.TemporaryDirectory()
+    session_factory, async_session_factory, async_engine = make_session_factories(
+        os.path.join(workdir.name, "summary.db")
+    )
+    calls = []
+
+    async def fake_summarize(messages, max_length, previous_summary):
+        calls.append(([message["content"] for message in messages], previous_summary))
+        return f"summary of {messages[-1]['content']}"
+
+    db = session_factory()
+    db.add(Conversation(id="c1", character_id="char1"))
+    db.commit()
+    add_turns(db, "c1", 0, 10)
+    messages = db.query(Message).filter(Message.conversation_id == "c1").order_by(Message.cumulative_tokens).all()
+    head = messages[-1].cumulative_tokens
+    # 每段最多容纳约四条消息
+    max_input_tokens = messages[3].cumulative_tokens
+
+    async def run():
+        summarizer = ConversationSummarizer(
+            max_input_tokens=max_input_tokens, summarize=fake_summarize, session_factory=async_session_factory
+        )
+        assert await summarizer.summarize_conversation("c1")
+        assert not await summarizer.summarize_conversation("c1")
+        await async_engine.dispose()
+
+    asyncio.run(run())
+
+    # 积压的消息全部按顺序合并，每条只出现一次，每段都带上前一段的摘要
+    assert len(calls) > 1
+    assert [content for chunk, _ in calls for content in chunk] == [message.content for message in messages]
+    assert calls[0][1] is None
+    for (previous_chunk, _), (_, previous_summary) in zip(calls, calls[1:]):
+        assert previous_summary == f"summary of {previous_chunk[-1]}"
+    db.expire_all()
+    assert db.get(Conversation, "c1").summary_checkpoint_tokens == head
+    db.close()
+    workdir.cleanup()
+
+
+if __name__ == "__main__":
+    test_incremental_summary_advances_checkpoint()
+    test_backlog_is_summarized_in_chunks()
+    print("✅ 摘要测试通过")
@@ -0,0 +1,8 @@
+-- 为messages表添加token计数和会话内token前缀和
+ALTER TABLE messages ADD COLUMN token_count INTEGER;
+ALTER TABLE messages ADD COLUMN cumulative_tokens INTEGER;
+
+-- 按前缀和做范围查询选取最近的历史消息
+CREATE INDEX IF NOT EXISTS ix_messages_conversation_cumulative ON messages (conversation_id, cumulative_tokens);
+
+-- 历史数据的token数需在迁移后执行 python history_window.py 回填
@@ -0,0 +1,2 @@
+-- 记录滚动摘要已覆盖到的消息位置（messages.cumulative_tokens）
+ALTER TABLE conversations ADD COLUMN summary_checkpoint_tokens INTEGER;
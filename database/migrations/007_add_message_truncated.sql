@@ -0,0 +1,2 @@
+-- 标记客户端断开后提前终止生成、只保存了部分内容的AI回复
+ALTER TABLE messages ADD COLUMN truncated BOOLEAN NOT NULL DEFAULT 0;
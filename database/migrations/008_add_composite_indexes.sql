@@ -0,0 +1,29 @@
+-- 列表查询的复合索引：过滤条件在前、排序键和id在后，按索引顺序读取一页即可，不再
+-- 整体排序（USE TEMP B-TREE）。被新索引前缀覆盖或不再使用的单列索引一并删除
+DROP INDEX IF EXISTS ix_characters_name;
+DROP INDEX IF EXISTS ix_characters_is_public;
+DROP INDEX IF EXISTS ix_characters_chat_count;
+DROP INDEX IF EXISTS ix_characters_created_at;
+DROP INDEX IF EXISTS ix_conversations_user_id;
+DROP INDEX IF EXISTS ix_conversations_last_message_at;
+DROP INDEX IF EXISTS ix_messages_conversation_id;
+DROP INDEX IF EXISTS ix_messages_created_at;
+
+-- 公开角色列表的三种排序
+CREATE INDEX IF NOT EXISTS ix_characters_public_latest ON characters (is_public, created_at, id);
+CREATE INDEX IF NOT EXISTS ix_characters_public_popular ON characters (is_public, chat_count, id);
+CREATE INDEX IF NOT EXISTS ix_characters_public_alphabetical ON characters (is_public, name, id);
+
+-- 登录用户的角色列表（公开或自己创建）沿排序索引顺序扫描
+CREATE INDEX IF NOT EXISTS ix_characters_latest ON characters (created_at, id);
+CREATE INDEX IF NOT EXISTS ix_characters_popular ON characters (chat_count, id);
+CREATE INDEX IF NOT EXISTS ix_characters_alphabetical ON characters (name, id);
+
+-- 我的角色
+CREATE INDEX IF NOT EXISTS ix_characters_creator_latest ON characters (creator_id, created_at, id);
+
+-- 用户的会话列表按最近消息时间倒序
+CREATE INDEX IF NOT EXISTS ix_conversations_user_last_message ON conversations (user_id, last_message_at, id);
+
+-- 会话内的消息按时间顺序
+CREATE INDEX IF NOT EXISTS ix_messages_conversation_created ON messages (conversation_id, created_at, id);
@@ -0,0 +1,5 @@
+-- AI回复的生成状态：generating（占位，生成中）、completed（已结束，可能被截断）、failed（生成失败，内容为错误提示）
+ALTER TABLE messages ADD COLUMN status VARCHAR(20) NOT NULL DEFAULT 'completed';
+
+-- 查找生成中断（进程退出）后遗留的 generating 占位
+CREATE INDEX IF NOT EXISTS ix_messages_status_created ON messages (status, created_at);